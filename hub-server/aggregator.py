@@ -1,19 +1,30 @@
 import logging
 import threading
 import time
-from database import Database
+from typing import Optional
+from storage import StorageBackend
 from mqtt_manager import MQTTManager
-from config import HISTORY_RETENTION_MONTHS
+from config import ARCHIVE_AFTER_MONTHS, HISTORY_RETENTION_MONTHS
+from live_energy import LiveEnergyIntegrator
+from startup import StartupStatus
+
+# Hours aggregated per pass; a full pass is followed by another without waiting
+AGGREGATE_LIMIT_HOURS = 1000
 
 
 class Aggregator:
-    def __init__(self, database: Database, mqtt_manager: MQTTManager, interval_sec=300):
+    def __init__(self, database: StorageBackend, mqtt_manager: MQTTManager, interval_sec=300,
+                 live_energy: Optional[LiveEnergyIntegrator] = None,
+                 startup: Optional[StartupStatus] = None):
         self.database = database
         self.mqtt_manager = mqtt_manager
+        self.live_energy = live_energy
         self.interval_sec = interval_sec
         self._stop_event = threading.Event()
         self._thread = None
         self._last_truncation_ts = 0
+        # Marks the "aggregation" phase done once missed hours are caught up
+        self.startup = startup
 
 
     def aggregate_loop(self):
@@ -22,24 +33,41 @@ class Aggregator:
 
         Idempotent: calling multiple times won't start multiple threads.
         """
+        if self.startup is not None:
+            self.startup.start("aggregation")
         while not self._stop_event.is_set():
+            processed = 0
             try:
-                # Perform history truncation check once per day
-                if HISTORY_RETENTION_MONTHS > 0:
+                # Perform history truncation and archiving check once per day
+                if HISTORY_RETENTION_MONTHS > 0 or ARCHIVE_AFTER_MONTHS > 0:
                     now = time.time()
                     if now - self._last_truncation_ts >= 86400:
-                        self.database.truncate_old_data(HISTORY_RETENTION_MONTHS)
+                        if HISTORY_RETENTION_MONTHS > 0:
+                            self.database.truncate_old_data(HISTORY_RETENTION_MONTHS)
+                        if ARCHIVE_AFTER_MONTHS > 0:
+                            self.database.archive_old_data(ARCHIVE_AFTER_MONTHS)
                         self._last_truncation_ts = now
 
-                processed = self.database.aggregate_hours(limit_hours=1000)
+                processed = self.database.aggregate_hours(limit_hours=AGGREGATE_LIMIT_HOURS)
                 logging.debug(f"Aggregator processed {processed} hours")
 
                 # Publish total energy to MQTT
                 total_kwh = self.database.get_total_energy()
+                if self.live_energy is not None:
+                    # Hand the persisted hours to the live total, which adds the partial hour
+                    self.live_energy.set_completed(total_kwh, self.database.get_last_aggregated_hour())
+                    total_kwh = self.live_energy.total()
                 self.mqtt_manager.publish_energy(total_kwh)
 
             except Exception:
                 logging.exception("Unhandled exception in aggregator loop")
+
+            if processed >= AGGREGATE_LIMIT_HOURS:
+                # Still catching up on hours missed while the server was down
+                continue
+            if self.startup is not None:
+                self.startup.finish("aggregation")
+                self.startup = None
             # Sleep with wake-up on stop event
             self._stop_event.wait(self.interval_sec)
         logging.debug("Hourly aggregator thread stopping")
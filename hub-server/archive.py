@@ -0,0 +1,348 @@
+"""
+Cold-data archive: closed months of readings as compressed column chunks.
+
+With ARCHIVE_AFTER_MONTHS > 0, Database.archive_old_data moves the readings
+of each closed, fully aggregated month older than that into the
+archive_chunks table, one chunk per label and month, and deletes them from
+readings. A chunk holds three columns:
+
+- timestamps, delta-of-delta encoded: a hub reporting every N seconds
+  stores a run of zeros;
+- rowids, delta-of-delta encoded too, so archived readings keep the order
+  aggregation integrates them in;
+- values as integers at the smallest decimal scale that reproduces every
+  value exactly, delta encoded and run-length encoded (raw float64 when no
+  scale fits);
+
+written as zigzag varints and compressed with zlib or lzma
+(ARCHIVE_COMPRESSION).
+
+Reads are transparent: read_range, read_previous and read_next merge
+readings and archived chunks in (timestamp, rowid) order, exactly as the
+readings table returns them. Database aggregation and reaggregate.py use
+them for ranges before the end of the archive. summarize adds archived
+readings to per-bucket statistics of the readings table.
+"""
+import lzma
+import math
+import struct
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+COMPRESSIONS = ("zlib", "lzma")
+
+# First byte of every chunk, bumped if the layout changes
+FORMAT_VERSION = 1
+# Value column layouts
+_SCALED = 0
+_FLOAT64 = 1
+# Decimal places tried for the scaled value layout
+MAX_DECIMALS = 6
+
+# (timestamp, rowid, value)
+Row = Tuple[int, int, float]
+# Chunks already decoded by one caller, by (label, start_ts)
+Decoded = Dict[Tuple[str, int], Tuple[Row, ...]]
+
+LIVE_SELECT = """
+    SELECT timestamp, readings.rowid, labels.label, readings.value
+    FROM readings
+    INNER JOIN labels ON labels.label_id = readings.label_id
+"""
+LIVE_RANGE_WHERE = """
+    WHERE timestamp >= ? AND timestamp < ? {labels}
+    ORDER BY timestamp ASC, readings.rowid ASC
+"""
+LIVE_PREVIOUS_WHERE = """
+    WHERE timestamp < ? {labels}
+    ORDER BY timestamp DESC, readings.rowid DESC LIMIT 1
+"""
+LIVE_NEXT_WHERE = """
+    WHERE timestamp >= ? {labels}
+    ORDER BY timestamp ASC, readings.rowid ASC LIMIT 1
+"""
+CHUNKS_SELECT = """
+    SELECT labels.label, archive_chunks.start_ts, archive_chunks.end_ts, archive_chunks.codec, archive_chunks.data
+    FROM archive_chunks
+    INNER JOIN labels ON labels.label_id = archive_chunks.label_id
+"""
+LIVE_SUMMARY_SQL = """
+    SELECT timestamp - timestamp % ? AS bucket, labels.label,
+           COUNT(*), MIN(readings.value), MAX(readings.value), SUM(readings.value)
+    FROM readings
+    INNER JOIN labels ON labels.label_id = readings.label_id
+    WHERE timestamp >= ? AND timestamp < ? {labels}
+    GROUP BY bucket, labels.label
+"""
+INSERT_CHUNK_SQL = """
+    INSERT OR REPLACE INTO archive_chunks(label_id, start_ts, end_ts, count, codec, data) VALUES (?,?,?,?,?,?)
+"""
+
+
+def month_bounds(timestamp: int) -> Tuple[int, int]:
+    """Start of the local calendar month containing `timestamp` and of the next one."""
+    start = datetime.fromtimestamp(timestamp).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    year, month = divmod(start.month, 12)
+    end = start.replace(year=start.year + year, month=month + 1)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+# ---------------- Encoding ----------------
+def _put_varint(out: bytearray, n: int):
+    """Append zigzag varint of signed `n`."""
+    n = n << 1 if n >= 0 else (-n << 1) - 1
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varints(data: bytes, pos: int, count: int) -> Tuple[List[int], int]:
+    """Read `count` zigzag varints from `data` at `pos`. Returns (values, next pos)."""
+    values = []
+    append = values.append
+    for _ in range(count):
+        n = shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        append(n >> 1 if not n & 1 else -((n + 1) >> 1))
+    return values, pos
+
+
+def _put_delta_of_delta(out: bytearray, values: Sequence[int]):
+    previous = previous_delta = 0
+    for i, value in enumerate(values):
+        delta = value - previous
+        _put_varint(out, delta - previous_delta)
+        previous = value
+        # The first value is stored as is, the second as a plain delta
+        previous_delta = delta if i else 0
+
+
+def _get_delta_of_delta(data: bytes, pos: int, count: int) -> Tuple[List[int], int]:
+    encoded, pos = _get_varints(data, pos, count)
+    values = []
+    previous = previous_delta = 0
+    for i, delta_of_delta in enumerate(encoded):
+        delta = delta_of_delta + previous_delta
+        previous += delta
+        values.append(previous)
+        previous_delta = delta if i else 0
+    return values, pos
+
+
+def _decimal_places(values: Sequence[float]) -> Optional[int]:
+    """The fewest decimal places at which every value round-trips exactly, or None."""
+    if not all(math.isfinite(value) for value in values):
+        return None
+    for decimals in range(MAX_DECIMALS + 1):
+        scale = 10 ** decimals
+        if all(round(value * scale) / scale == value for value in values):
+            return decimals
+    return None
+
+
+def _put_values(out: bytearray, values: Sequence[float]):
+    decimals = _decimal_places(values)
+    if decimals is None:
+        out.append(_FLOAT64)
+        out += struct.pack(f"<{len(values)}d", *values)
+        return
+
+    out.append(_SCALED)
+    out.append(decimals)
+    scale = 10 ** decimals
+    # Run-length encoded deltas: (delta, run) pairs
+    previous = 0
+    run_delta, run = None, 0
+    for value in values:
+        scaled = round(value * scale)
+        delta = scaled - previous
+        previous = scaled
+        if delta == run_delta:
+            run += 1
+            continue
+        if run:
+            _put_varint(out, run_delta)
+            _put_varint(out, run)
+        run_delta, run = delta, 1
+    if run:
+        _put_varint(out, run_delta)
+        _put_varint(out, run)
+
+
+def _get_values(data: bytes, pos: int, count: int) -> List[float]:
+    layout = data[pos]
+    pos += 1
+    if layout == _FLOAT64:
+        return list(struct.unpack_from(f"<{count}d", data, pos))
+
+    scale = 10 ** data[pos]
+    pos += 1
+    values = []
+    previous = 0
+    while len(values) < count:
+        (delta, run), pos = _get_varints(data, pos, 2)
+        for _ in range(run):
+            previous += delta
+            values.append(previous / scale)
+    return values
+
+
+def _check_compression(compression: str):
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown archive compression '{compression}', expected one of {', '.join(COMPRESSIONS)}")
+
+
+def encode_chunk(rows: Sequence[Row], compression: str = "zlib") -> bytes:
+    """
+    Encode and compress (timestamp, rowid, value) rows, in the order they
+    should be read back.
+    """
+    _check_compression(compression)
+    timestamps, rowids, values = zip(*rows) if rows else ((), (), ())
+    out = bytearray([FORMAT_VERSION])
+    _put_varint(out, len(rows))
+    _put_delta_of_delta(out, timestamps)
+    _put_delta_of_delta(out, rowids)
+    _put_values(out, values)
+    if compression == "lzma":
+        return lzma.compress(bytes(out))
+    return zlib.compress(bytes(out), 9)
+
+
+def decode_chunk(data: bytes, compression: str = "zlib") -> Tuple[Row, ...]:
+    """The rows of an encode_chunk result."""
+    _check_compression(compression)
+    data = lzma.decompress(data) if compression == "lzma" else zlib.decompress(data)
+    if data[0] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported archive chunk format {data[0]}")
+    (count,), pos = _get_varints(data, 1, 1)
+    timestamps, pos = _get_delta_of_delta(data, pos, count)
+    rowids, pos = _get_delta_of_delta(data, pos, count)
+    values = _get_values(data, pos, count)
+    return tuple(zip(timestamps, rowids, values))
+
+
+# ---------------- Reading ----------------
+def _labels_filter(column: str, labels: Sequence[str]) -> str:
+    return f"AND {column} IN ({', '.join('?' * len(labels))})" if labels else ""
+
+
+def archived_until(cursor) -> int:
+    """End of the last archived month, 0 if nothing is archived."""
+    return cursor.execute("SELECT COALESCE(MAX(end_ts), 0) FROM archive_chunks").fetchone()[0]
+
+
+def _decode(decoded: Optional[Decoded], label: str, start_ts: int, codec: str, data: bytes) -> Tuple[Row, ...]:
+    """
+    decode_chunk, reusing the caller's `decoded` if given. A decoded month is
+    tens of MB, so it is only kept as long as the caller keeps `decoded`.
+    """
+    if decoded is None:
+        return decode_chunk(data, codec)
+    rows = decoded.get((label, start_ts))
+    if rows is None:
+        rows = decoded[(label, start_ts)] = decode_chunk(data, codec)
+    return rows
+
+
+def _chunks(cursor, where: str, params: tuple, labels: Sequence[str]):
+    """Matching (label, start_ts, end_ts, codec, data) chunks, fetched lazily."""
+    sql = CHUNKS_SELECT + where.format(labels=_labels_filter("labels.label", labels))
+    return cursor.execute(sql, params + tuple(labels))
+
+
+def read_range(cursor, start: int, end: int, labels: Sequence[str] = (),
+               decoded: Optional[Decoded] = None) -> List[Tuple[int, str, float]]:
+    """
+    (timestamp, label, value) of readings in [start, end), archived or not,
+    ordered by timestamp and then insertion order. Optionally only `labels`.
+    Pass the same `decoded` dict to reads of one range to decode each chunk
+    once.
+    """
+    labels = list(labels)
+    sql = LIVE_SELECT + LIVE_RANGE_WHERE.format(labels=_labels_filter("labels.label", labels))
+    rows = cursor.execute(sql, (start, end, *labels)).fetchall()
+
+    chunks = _chunks(cursor, "WHERE start_ts < ? AND end_ts > ? {labels}", (end, start), labels).fetchall()
+    if not chunks:
+        return [(timestamp, label, value) for timestamp, _, label, value in rows]
+    for label, start_ts, _, codec, data in chunks:
+        rows.extend((timestamp, rowid, label, value)
+                    for timestamp, rowid, value in _decode(decoded, label, start_ts, codec, data)
+                    if start <= timestamp < end)
+    rows.sort(key=lambda row: (row[0], row[1]))
+    return [(timestamp, label, value) for timestamp, _, label, value in rows]
+
+
+def _read_nearest(cursor, live_where: str, bound: int, labels: Sequence[str], before: bool,
+                  decoded: Optional[Decoded]):
+    labels = list(labels)
+    sql = LIVE_SELECT + live_where.format(labels=_labels_filter("labels.label", labels))
+    best = cursor.execute(sql, (bound, *labels)).fetchone()
+
+    # Archived months nearest the bound first
+    if before:
+        months = _chunks(cursor, "WHERE start_ts < ? {labels} ORDER BY start_ts DESC", (bound,), labels)
+    else:
+        months = _chunks(cursor, "WHERE end_ts > ? {labels} ORDER BY start_ts ASC", (bound,), labels)
+    for label, start_ts, end_ts, codec, data in months:
+        if best is not None and (best[0] >= end_ts if before else best[0] < start_ts):
+            # Nothing further out in the archive beats it
+            break
+        for timestamp, rowid, value in _decode(decoded, label, start_ts, codec, data):
+            if (timestamp < bound) if before else (timestamp >= bound):
+                candidate = (timestamp, rowid, label, value)
+                if best is None or ((candidate[:2] > best[:2]) if before else (candidate[:2] < best[:2])):
+                    best = candidate
+    return [] if best is None else [(best[0], best[2], best[3])]
+
+
+def read_previous(cursor, before: int, labels: Sequence[str] = (),
+                  decoded: Optional[Decoded] = None) -> List[Tuple[int, str, float]]:
+    """The last reading before `before`, archived or not, as a list of at most one row."""
+    return _read_nearest(cursor, LIVE_PREVIOUS_WHERE, before, labels, True, decoded)
+
+
+def read_next(cursor, after: int, labels: Sequence[str] = (),
+              decoded: Optional[Decoded] = None) -> List[Tuple[int, str, float]]:
+    """The first reading at or after `after`, archived or not, as a list of at most one row."""
+    return _read_nearest(cursor, LIVE_NEXT_WHERE, after, labels, False, decoded)
+
+
+def summarize(cursor, start: int, end: int, bucket: int,
+              labels: Sequence[str] = ()) -> List[Tuple[int, str, int, float, float, float]]:
+    """
+    (bucket start, label, count, min, max, mean) of values in [start, end),
+    archived or not, per `bucket` seconds and label, ordered by bucket and
+    label. Optionally only `labels`.
+    """
+    labels = list(labels)
+    sql = LIVE_SUMMARY_SQL.format(labels=_labels_filter("labels.label", labels))
+    stats = {
+        (bucket_start, label): [count, low, high, total]
+        for bucket_start, label, count, low, high, total in cursor.execute(sql, (bucket, start, end, *labels)).fetchall()
+    }
+
+    for label, _, _, codec, data in _chunks(cursor, "WHERE start_ts < ? AND end_ts > ? {labels}", (end, start),
+                                            labels).fetchall():
+        for timestamp, _, value in decode_chunk(data, codec):
+            if not start <= timestamp < end:
+                continue
+            entry = stats.get((timestamp - timestamp % bucket, label))
+            if entry is None:
+                stats[(timestamp - timestamp % bucket, label)] = [1, value, value, value]
+            else:
+                entry[0] += 1
+                entry[1] = min(entry[1], value)
+                entry[2] = max(entry[2], value)
+                entry[3] += value
+    return [(bucket_start, label, count, low, high, total / count)
+            for (bucket_start, label), (count, low, high, total) in sorted(stats.items())]
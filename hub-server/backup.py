@@ -0,0 +1,240 @@
+"""
+Online backups of the database with the SQLite backup API.
+
+With BACKUP_DIR set, BackupScheduler copies the live database every
+BACKUP_INTERVAL seconds without stopping the server. Database.backup copies
+BACKUP_STEP_PAGES pages at a time on the shared connection and sleeps
+BACKUP_STEP_SLEEP seconds between steps, so ingest waits one step at most
+and its commits go into the copy instead of restarting it.
+
+The copy is written next to its final name and, with BACKUP_COMPRESS,
+streamed through gzip in chunks, then renamed into place, so BACKUP_DIR only
+ever holds complete backups:
+
+    data/backups/readings-20250101-030000.db.gz
+
+The newest BACKUP_KEEP are kept. A backup is due BACKUP_INTERVAL after the
+newest one in the directory, so restarts don't reset the schedule.
+
+A one-off backup, e.g. from cron with the server stopped or running:
+
+    python backup.py --dir data/backups --keep 30
+"""
+import argparse
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Union
+from config import BACKUP_COMPRESS, BACKUP_DIR, BACKUP_INTERVAL, BACKUP_KEEP, BACKUP_STEP_PAGES, BACKUP_STEP_SLEEP
+from database import Database
+from metrics import Counter, Gauge, Histogram
+from storage import StorageBackend
+
+BACKUP_DURATION = Histogram(
+    "efergy_backup_duration_seconds", "Time taken by a backup, including the pauses between steps.",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+)
+BACKUP_PAGES = Counter("efergy_backup_pages_total", "Database pages copied by backups.")
+BACKUP_LOCK_WAIT = Counter(
+    "efergy_backup_lock_wait_seconds_total", "Time backup steps waited for the database connection."
+)
+BACKUP_BUSY_STEPS = Counter("efergy_backup_busy_steps_total", "Backup steps that found the database busy or locked.")
+BACKUP_RESTARTS = Counter(
+    "efergy_backup_restarts_total", "Times a backup started over after another connection wrote to the database."
+)
+BACKUP_FAILURES = Counter("efergy_backup_failures_total", "Backups that failed or were cancelled.")
+BACKUP_LAST_SUCCESS = Gauge(
+    "efergy_backup_last_success_timestamp_seconds", "When the last successful backup finished."
+)
+BACKUP_SIZE = Gauge("efergy_backup_size_bytes", "Size of the last backup file.")
+
+DEFAULT_BACKUP_DIR = Path(__file__).resolve().parent / "data/backups"
+# Bytes read at a time when compressing
+COPY_CHUNK = 1024 * 1024
+
+
+class BackupCancelled(Exception):
+    pass
+
+
+class BackupScheduler:
+    """
+    Args:
+        database: The Database to back up.
+        directory: Where backup files are written.
+        interval: Seconds between backups, 0 disables the schedule.
+        keep: Backup files to keep, 0 keeps all.
+        compress: Gzip the backup files.
+        pages: Pages copied per step.
+        step_sleep: Seconds to sleep between steps.
+    """
+
+    def __init__(self, database: Database, directory: Union[str, Path], interval: float = BACKUP_INTERVAL,
+                 keep: int = BACKUP_KEEP, compress: bool = BACKUP_COMPRESS, pages: int = BACKUP_STEP_PAGES,
+                 step_sleep: float = BACKUP_STEP_SLEEP):
+        self.database = database
+        self.directory = Path(directory)
+        self.interval = interval
+        self.keep = keep
+        self.compress = compress
+        self.pages = pages
+        self.step_sleep = step_sleep
+        self.prefix = f"{database.db_path.stem}-"
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def backup_files(self) -> List[Path]:
+        """Complete backups in the directory, oldest first."""
+        if not self.directory.is_dir():
+            return []
+        return sorted(
+            path for path in self.directory.iterdir()
+            if path.name.startswith(self.prefix) and path.name.endswith((".db", ".db.gz"))
+        )
+
+    def seconds_until_due(self, now: Optional[float] = None) -> float:
+        """Seconds until the next backup, from the newest backup file's time."""
+        files = self.backup_files()
+        if not files:
+            return 0.0
+        now = time.time() if now is None else now
+        return max(0.0, files[-1].stat().st_mtime + self.interval - now)
+
+    def _check_stopping(self, remaining: int, total: int):
+        if self._stop_event.is_set():
+            raise BackupCancelled(f"Backup cancelled with {remaining} of {total} pages left")
+
+    def run_once(self) -> Path:
+        """
+        Take a backup now and rotate old ones. Raises on failure.
+
+        Returns:
+            The backup file.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"{self.prefix}{time.strftime('%Y%m%d-%H%M%S')}.db"
+        path = self.directory / (name + ".gz" if self.compress else name)
+        copy = self.directory / (name + ".partial")
+        compressed = self.directory / (path.name + ".partial")
+
+        start = time.monotonic()
+        try:
+            target = sqlite3.connect(copy)
+            try:
+                stats = self.database.backup(target, self.pages, self.step_sleep, progress=self._check_stopping)
+            finally:
+                target.close()
+
+            if self.compress:
+                with open(copy, "rb") as src, open(compressed, "wb") as raw:
+                    with gzip.GzipFile(filename=name, mode="wb", fileobj=raw, compresslevel=6) as dst:
+                        shutil.copyfileobj(src, dst, COPY_CHUNK)
+                    raw.flush()
+                    os.fsync(raw.fileno())
+                os.replace(compressed, path)
+                copy.unlink()
+            else:
+                os.replace(copy, path)
+        except BaseException:
+            BACKUP_FAILURES.inc()
+            for partial in (copy, compressed):
+                partial.unlink(missing_ok=True)
+            raise
+
+        duration = time.monotonic() - start
+        size = path.stat().st_size
+        BACKUP_DURATION.observe(duration)
+        BACKUP_PAGES.inc(amount=stats["pages"])
+        BACKUP_LOCK_WAIT.inc(amount=stats["lock_wait"])
+        BACKUP_BUSY_STEPS.inc(amount=stats["busy_steps"])
+        BACKUP_RESTARTS.inc(amount=stats["restarts"])
+        BACKUP_LAST_SUCCESS.set(time.time())
+        BACKUP_SIZE.set(size)
+        logging.info(f"Backup written to {path} ({size} bytes, {stats['pages']} pages in {stats['steps']} steps, "
+                     f"{duration:.1f}s, {stats['lock_wait'] * 1000:.1f}ms waiting for the database, "
+                     f"{stats['restarts']} restarts)")
+        self.rotate()
+        return path
+
+    def rotate(self) -> List[Path]:
+        """Delete all but the newest `keep` backups. Returns the deleted files."""
+        files = self.backup_files()
+        if self.keep <= 0 or len(files) <= self.keep:
+            return []
+        removed = files[:-self.keep]
+        for path in removed:
+            path.unlink(missing_ok=True)
+            logging.debug(f"Removed old backup {path}")
+        return removed
+
+    def backup_loop(self):
+        while not self._stop_event.wait(self.seconds_until_due()):
+            try:
+                self.run_once()
+            except BackupCancelled:
+                break
+            except Exception:
+                logging.exception("Backup failed")
+                # Retried after a full interval rather than in a tight loop
+                if self._stop_event.wait(self.interval):
+                    break
+        logging.debug("Backup thread stopping")
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.backup_loop, name='backup', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread, cancelling a backup in progress."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+def scheduler_from_config(database: StorageBackend) -> Optional[BackupScheduler]:
+    """A started BackupScheduler for BACKUP_DIR, relative to the hub-server directory, or None if unset."""
+    if not BACKUP_DIR:
+        return None
+    if not isinstance(database, Database):
+        logging.warning("BACKUP_DIR needs the sqlite storage backend, backups disabled")
+        return None
+    scheduler = BackupScheduler(database, Path(__file__).resolve().parent / BACKUP_DIR)
+    scheduler.start()
+    return scheduler
+
+
+def main(argv: Optional[List[str]] = None) -> Path:
+    parser = argparse.ArgumentParser(description="Back up the readings database")
+    parser.add_argument("--db", default=str(Path(__file__).resolve().parent / "data/readings.db"),
+                        help="database file")
+    parser.add_argument("--dir", default=str(DEFAULT_BACKUP_DIR), help="backup directory")
+    parser.add_argument("--keep", type=int, default=BACKUP_KEEP, help="backups to keep, 0 = all")
+    parser.add_argument("--compress", action=argparse.BooleanOptionalAction, default=BACKUP_COMPRESS,
+                        help="gzip the backup")
+    # From another process, the server's commits restart a stepped copy; one step copies a consistent snapshot
+    parser.add_argument("--pages", type=int, default=-1, help="pages per step, -1 = all at once")
+    parser.add_argument("--step-sleep", type=float, default=BACKUP_STEP_SLEEP, help="seconds between steps")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    database = Database(args.db)
+    try:
+        scheduler = BackupScheduler(database, args.dir, keep=args.keep, compress=args.compress, pages=args.pages,
+                                    step_sleep=args.step_sleep)
+        return scheduler.run_once()
+    finally:
+        database.close(checkpoint=False)
+
+
+if __name__ == "__main__":
+    main()
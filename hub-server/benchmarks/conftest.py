@@ -0,0 +1,41 @@
+"""
+Shared fixtures for the performance benchmarks.
+
+The benchmarks use pytest-benchmark and are kept out of the default test
+run. Results can be stored and compared between commits:
+
+    pytest benchmarks/ --benchmark-autosave
+    pytest benchmarks/ --benchmark-compare --benchmark-compare-fail=mean:10%
+
+Data sizes are controlled with environment variables:
+
+    BENCH_SAMPLE_INTERVAL  seconds between synthetic readings per sensor (default 60)
+    BENCH_MAX_ROWS         skip parametrizations larger than this (default 2000000)
+    BENCH_FULL             set to 1 to run every parametrization regardless of size
+    BENCH_SETUP_DB_MB      size of the database used for the startup benchmark (default 64)
+"""
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from benchmarks.synthetic import populate
+
+
+@pytest.fixture(scope="session")
+def template_db(tmp_path_factory):
+    """
+    Returns a factory building (and caching) populated template databases.
+    Benchmarks that modify data must copy the template with `clone_db`.
+    """
+    cache = {}
+    base = tmp_path_factory.mktemp("bench-templates")
+
+    def factory(days: int, sensors: int):
+        key = (days, sensors)
+        if key not in cache:
+            path = base / f"readings_{days}d_{sensors}s.db"
+            populate(path, days, sensors)
+            cache[key] = path
+        return cache[key]
+
+    return factory
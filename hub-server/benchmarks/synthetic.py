@@ -0,0 +1,102 @@
+"""
+Synthetic data helpers for the benchmarks. See conftest.py for the knobs.
+"""
+import os
+import shutil
+import sqlite3
+import time
+import pytest
+from database import Database
+
+SAMPLE_INTERVAL = int(os.getenv("BENCH_SAMPLE_INTERVAL", "60"))
+MAX_ROWS = int(os.getenv("BENCH_MAX_ROWS", "2000000"))
+FULL = os.getenv("BENCH_FULL", "0").lower() in ("true", "1", "yes", "on")
+SETUP_DB_MB = int(os.getenv("BENCH_SETUP_DB_MB", "64"))
+
+
+def io_syscalls() -> int:
+    """read + write syscalls made by this process so far (Linux only, 0 elsewhere)."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines() if line)
+        return int(fields["syscr"]) + int(fields["syscw"])
+    except (OSError, KeyError, ValueError):
+        return 0
+
+
+def per_reading_cost(function, readings: int) -> dict:
+    """Run `function` once and return CPU microseconds and read/write syscalls per reading."""
+    syscalls, cpu = io_syscalls(), time.process_time()
+    function()
+    return {
+        "cpu_us_per_reading": round((time.process_time() - cpu) / readings * 1e6, 2),
+        "syscalls_per_reading": round((io_syscalls() - syscalls) / readings, 2),
+    }
+
+
+def skip_if_too_large(days: int, sensors: int):
+    rows = days * 86400 // SAMPLE_INTERVAL * sensors
+    if not FULL and rows > MAX_ROWS:
+        pytest.skip(f"{rows} rows exceeds BENCH_MAX_ROWS={MAX_ROWS} (set BENCH_FULL=1 to run)")
+
+
+def populate(db_path, days: int, sensors: int, end_ts: int = None, interval: int = SAMPLE_INTERVAL,
+             batch_size: int = 100000) -> int:
+    """
+    Fill `db_path` with `days` of readings for `sensors` h2 sensors, ending
+    at `end_ts` (default: the start of the previous hour). Returns the row count.
+    """
+    if end_ts is None:
+        now = int(time.time())
+        end_ts = now - (now % 3600) - 3600
+    start_ts = end_ts - days * 86400
+
+    database = Database(db_path)
+    database.setup()
+    database._conn.close()
+    database._conn = None
+
+    rows = 0
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO labels(label) VALUES (?)",
+            [(f"efergy_h2_{100000 + s}",) for s in range(sensors)]
+        )
+        label_ids = [row[0] for row in conn.execute("SELECT label_id FROM labels ORDER BY label_id")]
+
+        batch = []
+        for ts in range(start_ts, end_ts, interval):
+            for i, label_id in enumerate(label_ids):
+                batch.append((label_id, ts + i, 1000.0 + (ts // interval + i) % 500))
+            if len(batch) >= batch_size:
+                conn.executemany("INSERT INTO readings(label_id, timestamp, value) VALUES (?,?,?)", batch)
+                rows += len(batch)
+                batch.clear()
+        if batch:
+            conn.executemany("INSERT INTO readings(label_id, timestamp, value) VALUES (?,?,?)", batch)
+            rows += len(batch)
+        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return rows
+
+
+def clone_db(template, target, profile: dict = None) -> Database:
+    shutil.copyfile(template, target)
+    database = Database(target, profile=profile)
+    database.setup()
+    return database
+
+
+def grow_to_size(db_path, target_bytes: int, sensors: int = 10, block_days: int = 30) -> int:
+    """
+    Append blocks of older readings to `db_path` until the file is at least
+    `target_bytes` large. Returns the number of rows written.
+    """
+    now = int(time.time())
+    end_ts = now - (now % 3600) - 3600
+    rows = 0
+    while not db_path.exists() or db_path.stat().st_size < target_bytes:
+        rows += populate(db_path, block_days, sensors, end_ts=end_ts)
+        end_ts -= block_days * 86400
+    return rows
@@ -0,0 +1,20 @@
+import pytest
+from benchmarks.synthetic import clone_db, skip_if_too_large
+
+
+@pytest.mark.parametrize("sensors", [1, 10, 50])
+@pytest.mark.parametrize("days", [1, 30, 365])
+def test_aggregate_hours(benchmark, template_db, tmp_path, days, sensors):
+    skip_if_too_large(days, sensors)
+    database = clone_db(template_db(days, sensors), tmp_path / "aggregate.db")
+    limit_hours = days * 24 + 48
+
+    def reset():
+        with database._get_connection() as conn:
+            conn.execute("DELETE FROM energy_hourly")
+            conn.commit()
+
+    benchmark.extra_info["hours"] = days * 24
+    processed = benchmark.pedantic(database.aggregate_hours, kwargs={"limit_hours": limit_hours},
+                                   setup=reset, rounds=3, iterations=1)
+    assert processed >= days * 24
@@ -0,0 +1,95 @@
+import sqlite3
+import pytest
+from unittest.mock import patch
+from database import Database
+from benchmarks.synthetic import clone_db, grow_to_size, per_reading_cost, SETUP_DB_MB
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(tmp_path / "bench.db")
+    database.setup()
+    return database
+
+
+def test_log_data_single(benchmark, db):
+    benchmark(db.log_data, "efergy_h2_100000", 1234.5)
+
+
+@pytest.mark.parametrize("batch_size", [10, 100, 1000])
+def test_log_many_batched(benchmark, db, batch_size):
+    batch = [(f"efergy_h2_{100000 + i % 10}", 1234.5, None) for i in range(batch_size)]
+    benchmark.extra_info["readings_per_call"] = batch_size
+    benchmark(db.log_many, batch)
+
+
+def test_log_data_cost_per_reading(benchmark, db):
+    """CPU and read/write syscalls per reading for single-row inserts, recorded in extra_info."""
+    labels = [f"efergy_h2_{100000 + i}" for i in range(10)]
+
+    def insert():
+        for i in range(1000):
+            db.log_data(labels[i % 10], 1234.5)
+
+    benchmark.extra_info.update(per_reading_cost(insert, 1000))
+    benchmark.pedantic(insert, rounds=3, iterations=1)
+
+
+def test_log_many_cost_per_reading(benchmark, db):
+    """CPU and read/write syscalls per reading for 100-reading batches, recorded in extra_info."""
+    batch = [(f"efergy_h2_{100000 + i % 10}", 1234.5, None) for i in range(100)]
+
+    def insert():
+        for _ in range(100):
+            db.log_many(batch)
+
+    benchmark.extra_info.update(per_reading_cost(insert, 10000))
+    benchmark.pedantic(insert, rounds=3, iterations=1)
+
+
+@pytest.fixture(scope="module")
+def aggregated_year(template_db, tmp_path_factory):
+    database = clone_db(template_db(365, 1), tmp_path_factory.mktemp("bench-energy") / "energy.db")
+    database.aggregate_hours(limit_hours=365 * 24 + 48)
+    return database
+
+
+def test_get_total_energy(benchmark, aggregated_year):
+    assert benchmark(aggregated_year.get_total_energy) > 0
+
+
+def test_get_total_energy_monthly_reset(benchmark, aggregated_year):
+    with patch("database.ENERGY_MONTHLY_RESET", True):
+        benchmark(aggregated_year.get_total_energy)
+
+
+def test_truncate_old_data(benchmark, template_db, tmp_path):
+    template = template_db(120, 3)
+    counter = iter(range(1000))
+
+    def setup():
+        database = clone_db(template, tmp_path / f"truncate_{next(counter)}.db")
+        return (database, 1), {}
+
+    deleted = benchmark.pedantic(Database.truncate_old_data, setup=setup, rounds=3, iterations=1)
+    assert deleted > 0
+
+
+@pytest.fixture(scope="module")
+def large_db_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp("bench-large") / "large.db"
+    grow_to_size(path, SETUP_DB_MB * 1024 * 1024)
+    return path
+
+
+def test_database_setup_startup(benchmark, large_db_file):
+    """Time from constructing Database to a completed setup() on a large existing file."""
+    benchmark.extra_info["db_bytes"] = large_db_file.stat().st_size
+
+    def start():
+        database = Database(large_db_file)
+        database.setup()
+        database._conn.close()
+        database._conn = None
+
+    benchmark.pedantic(start, rounds=5, iterations=1)
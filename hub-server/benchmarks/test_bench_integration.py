@@ -0,0 +1,31 @@
+"""
+Pure-Python vs NumPy energy integration over a month of 6-second readings.
+
+    pytest benchmarks/test_bench_integration.py --benchmark-group-by=param:split_hours
+"""
+import random
+import pytest
+from energy_integration import HAS_NUMPY, integrate_hours
+
+DAYS = 30
+INTERVAL = 6
+
+
+@pytest.fixture(scope="module")
+def month_series():
+    rng = random.Random(0)
+    start = 1_700_000_000 - (1_700_000_000 % 3600)
+    timestamps = list(range(start, start + DAYS * 86400, INTERVAL))
+    kw = [rng.uniform(0.1, 5.0) for _ in timestamps]
+    return timestamps, kw
+
+
+@pytest.mark.parametrize("split_hours", [False, True])
+@pytest.mark.parametrize("use_numpy", [False, pytest.param(True, marks=pytest.mark.skipif(
+    not HAS_NUMPY, reason="NumPy not installed"))])
+def test_integrate_month(benchmark, month_series, use_numpy, split_hours):
+    timestamps, kw = month_series
+    benchmark.extra_info["readings"] = len(timestamps)
+    result = benchmark(integrate_hours, timestamps, kw, method="trapezoid", max_gap=60,
+                       split_hours=split_hours, use_numpy=use_numpy)
+    assert len(result) == DAYS * 24
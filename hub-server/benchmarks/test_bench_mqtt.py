@@ -0,0 +1,37 @@
+"""
+MQTT publishing cost of one hub post: a message per sensor vs one batched
+message per post. The paho client is a stand-in, so only JSON encoding,
+connection checks and topic handling are measured.
+
+    pytest benchmarks/test_bench_mqtt.py --benchmark-group-by=param:sensors
+"""
+import pytest
+from mqtt_manager import MQTTManager
+
+
+class _NullClient:
+    def publish(self, topic, payload, retain=False):
+        pass
+
+
+def _manager(batched: bool) -> MQTTManager:
+    manager = MQTTManager(enabled=False, batched=batched, availability=False)
+    manager.enabled = manager.started = manager.connected = True
+    manager.discovery_enabled = False
+    manager.client = _NullClient()
+    return manager
+
+
+@pytest.mark.parametrize("sensors", [3, 12])
+@pytest.mark.parametrize("batched", [False, True])
+def test_publish_post(benchmark, batched, sensors):
+    manager = _manager(batched)
+    readings = [(f"efergy_h3_{100000 + i}", str(100000 + i), 391.86 + i) for i in range(sensors)]
+
+    def publish():
+        if manager.per_sensor_topics:
+            for label, sid, value in readings:
+                manager.publish_power(label, sid, "h3", value)
+        manager.publish_hub_power("41.0a.04.001ec0", "h3", readings, 1_700_000_000)
+
+    benchmark(publish)
@@ -0,0 +1,94 @@
+"""
+Per-request overhead of the proxy hop from legacy-nginx to the hub server:
+a new TCP connection per post (nginx without an upstream keepalive pool),
+a pooled keep-alive TCP connection, and the same over a Unix domain socket.
+
+A real server answers an h3 post over loopback; DB and MQTT are no-op
+stand-ins, so the difference between the cases is connection setup and
+teardown.
+
+    pytest benchmarks/test_bench_proxy_hop.py --benchmark-group-by=func
+"""
+import http.client
+import socket
+import threading
+import pytest
+from hub_server import EfergyHTTPServer, FakeEfergyServer
+
+H3_BODY = b"\r\n".join(f"{815751 + i}|1|EFCT|P1,391.86|-66".encode() for i in range(3))
+HEADERS = {"Host": "41.0a.04.001ec0.h3.sensornet.info", "Content-Type": "text/plain"}
+
+
+class _NullDatabase:
+    def log_data(self, label, value, timestamp=None):
+        pass
+
+
+class _NullMQTT:
+    per_sensor_topics = True
+
+    def publish_power(self, label, sid, hub_version, value):
+        pass
+
+    def publish_availability(self, label, online):
+        pass
+
+    def publish_hub_power(self, hub, hub_version, readings, timestamp):
+        pass
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, **kwargs):
+        super().__init__("localhost", **kwargs)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+@pytest.fixture(params=["tcp", "unix"])
+def server(request, tmp_path):
+    address = ("127.0.0.1", 0) if request.param == "tcp" else str(tmp_path / "hub.sock")
+    httpd = EfergyHTTPServer(address, FakeEfergyServer, _NullDatabase(), _NullMQTT())
+    # The same body is posted every round, so measure the full path rather than the duplicate drop
+    httpd.deduper.window = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+
+def _connect(httpd: EfergyHTTPServer) -> http.client.HTTPConnection:
+    if isinstance(httpd.server_address, str):
+        return _UnixHTTPConnection(httpd.server_address, timeout=5)
+    return http.client.HTTPConnection(*httpd.server_address[:2], timeout=5)
+
+
+def _post(conn: http.client.HTTPConnection):
+    conn.request("POST", "/h3", body=H3_BODY, headers=HEADERS)
+    response = conn.getresponse()
+    response.read()
+    assert response.status == 200
+
+
+def test_connection_per_request(benchmark, server):
+    def post():
+        conn = _connect(server)
+        try:
+            _post(conn)
+        finally:
+            conn.close()
+
+    benchmark(post)
+
+
+def test_keepalive(benchmark, server):
+    conn = _connect(server)
+    try:
+        benchmark(lambda: _post(conn))
+    finally:
+        conn.close()
@@ -0,0 +1,91 @@
+"""
+Per-request CPU cost of the hub request handler, without sockets.
+
+The handler is fed an in-memory request so only parsing, logging and
+dispatch are measured; DB and MQTT are no-op stand-ins.
+"""
+import io
+import logging
+import pytest
+from dedupe import IngestDeduper
+from hot_window import HotWindow
+from hub_server import FakeEfergyServer
+from liveness import LivenessRegistry
+
+H3_BODY = b"\r\n".join(f"{815751 + i}|1|EFCT|P1,391.86|-66".encode() for i in range(3))
+
+
+class _NullDatabase:
+    def log_data(self, label, value, timestamp=None):
+        pass
+
+
+class _NullMQTT:
+    per_sensor_topics = True
+
+    def publish_power(self, label, sid, hub_version, value):
+        pass
+
+    def publish_availability(self, label, online):
+        pass
+
+    def publish_hub_power(self, hub, hub_version, readings, timestamp):
+        pass
+
+
+class _Server:
+    def __init__(self):
+        self.database = _NullDatabase()
+        self.mqtt_manager = _NullMQTT()
+        self.published_discovery = set()
+        self.hot_window = HotWindow()
+        self.live_energy = None
+        self.liveness = LivenessRegistry()
+        # The same body is replayed every round, so measure the full path rather than the duplicate drop
+        self.deduper = IngestDeduper(window=0)
+
+    def connection_busy(self, handler):
+        pass
+
+    def connection_idle(self, handler):
+        return True
+
+    def connection_closed(self, handler):
+        pass
+
+
+class _Request:
+    def __init__(self, raw: bytes):
+        self._raw = raw
+
+    def makefile(self, mode, *args, **kwargs):
+        return io.BytesIO(self._raw) if "r" in mode else io.BytesIO()
+
+    def sendall(self, data):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+
+def _raw_post(path: str, body: bytes) -> bytes:
+    return (
+        f"POST {path} HTTP/1.1\r\nHost: 41.0a.04.001ec0.h3.sensornet.info\r\n"
+        f"Content-Type: text/plain\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+    ).encode() + body
+
+
+@pytest.mark.parametrize("level", ["INFO", "DEBUG"])
+def test_post_h3_handler(benchmark, level):
+    server = _Server()
+    raw = _raw_post("/h3", H3_BODY)
+
+    root = logging.getLogger()
+    previous_level, previous_handlers = root.level, root.handlers[:]
+    root.setLevel(level)
+    root.handlers = [logging.NullHandler()]
+    try:
+        benchmark(lambda: FakeEfergyServer(_Request(raw), ("127.0.0.1", 40000), server))
+    finally:
+        root.setLevel(previous_level)
+        root.handlers = previous_handlers
@@ -0,0 +1,60 @@
+"""
+Compare the SQLITE_PROFILE presets on the ingest, read and aggregation paths.
+
+    pytest benchmarks/test_bench_sqlite_profile.py --benchmark-group-by=func
+"""
+import time
+import pytest
+from database import Database, sqlite_profile
+from benchmarks.synthetic import clone_db
+
+PROFILES = ["default", "sdcard", "ssd"]
+
+
+@pytest.fixture(params=PROFILES)
+def profile(request):
+    return sqlite_profile(request.param)
+
+
+@pytest.fixture
+def db(tmp_path, profile):
+    database = Database(tmp_path / "profile.db", profile=profile)
+    database.setup()
+    return database
+
+
+def test_profile_log_data(benchmark, db):
+    benchmark(db.log_data, "efergy_h2_100000", 1234.5)
+
+
+def test_profile_log_many(benchmark, db):
+    batch = [(f"efergy_h2_{100000 + i % 10}", 1234.5, None) for i in range(100)]
+    benchmark(db.log_many, batch)
+
+
+def test_profile_checkpoint(benchmark, db):
+    def setup():
+        db.log_many([("efergy_h2_100000", 1234.5, None)] * 1000)
+        return (), {}
+
+    benchmark.pedantic(db.checkpoint, setup=setup, rounds=10, iterations=1)
+
+
+@pytest.fixture
+def month_db(template_db, tmp_path, profile):
+    return clone_db(template_db(30, 10), tmp_path / "month.db", profile=profile)
+
+
+def test_profile_recent_readings(benchmark, month_db):
+    since = int(time.time()) - 86400
+    assert benchmark(month_db.get_recent_readings, since)
+
+
+def test_profile_aggregate_hours(benchmark, month_db):
+    def reset():
+        with month_db._get_connection() as conn:
+            conn.execute("DELETE FROM energy_hourly")
+            conn.commit()
+
+    benchmark.pedantic(month_db.aggregate_hours, kwargs={"limit_hours": 30 * 24 + 48},
+                       setup=reset, rounds=3, iterations=1)
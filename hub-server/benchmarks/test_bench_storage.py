@@ -0,0 +1,65 @@
+"""
+Storage backends on the same synthetic history: a daily summary of every
+reading, a month of raw readings and catching up hourly aggregation.
+
+    pytest benchmarks/test_bench_storage.py --benchmark-group-by=param:days,func
+"""
+import sqlite3
+import time
+import pytest
+from benchmarks.synthetic import SAMPLE_INTERVAL, clone_db, skip_if_too_large
+from storage import HAS_DUCKDB, DuckDBStorage
+
+BACKENDS = ["sqlite", pytest.param("duckdb", marks=pytest.mark.skipif(not HAS_DUCKDB, reason="DuckDB not installed"))]
+
+
+@pytest.fixture
+def storage(backend, template_db, tmp_path, days, sensors):
+    skip_if_too_large(days, sensors)
+    template = template_db(days, sensors)
+    if backend == "sqlite":
+        store = clone_db(template, tmp_path / "readings.db")
+    else:
+        store = DuckDBStorage(tmp_path / "readings.duckdb")
+        store.setup()
+        with sqlite3.connect(template) as conn:
+            cursor = conn.execute("""
+                SELECT labels.label, readings.value, readings.timestamp FROM readings
+                INNER JOIN labels ON labels.label_id = readings.label_id
+                ORDER BY readings.timestamp, readings.rowid
+            """)
+            while batch := cursor.fetchmany(100000):
+                store.log_many(batch)
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("sensors", [1, 10])
+@pytest.mark.parametrize("days", [30, 365])
+def test_summarize_days(benchmark, storage, days, sensors):
+    rows = benchmark(storage.summarize_readings, 0, 2 ** 62, 86400)
+    assert sum(row[2] for row in rows) == days * 86400 // SAMPLE_INTERVAL * sensors
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("sensors", [1, 10])
+@pytest.mark.parametrize("days", [30, 365])
+def test_read_month(benchmark, storage, days, sensors):
+    # The synthetic history ends at the start of the previous hour
+    now = int(time.time())
+    end = now - now % 3600 - 3600
+    rows = benchmark(storage.get_readings, end - 30 * 86400, end, storage.get_all_labels()[:1])
+    assert rows
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("sensors", [1, 10])
+@pytest.mark.parametrize("days", [30, 365])
+def test_aggregate_hours(benchmark, storage, days, sensors):
+    def reset():
+        storage.replace_hours({}, 0, 2 ** 62)
+
+    processed = benchmark.pedantic(storage.aggregate_hours, kwargs={"limit_hours": days * 24 + 48},
+                                   setup=reset, rounds=3, iterations=1)
+    assert processed >= days * 24
@@ -1,17 +1,67 @@
+import json
 import os
 
 # Hub server config
 SERVER_PORT = int(os.getenv("SERVER_PORT", "5000"))
+# Listen on this Unix domain socket path instead of SERVER_PORT, e.g. for a
+# proxy on the same host or sharing a volume; empty listens on TCP
+SERVER_UNIX_SOCKET = os.getenv("SERVER_UNIX_SOCKET", "")
+# Seconds a kept-alive connection may sit idle before the server closes it,
+# 0 = never. Longer than the gap between hub posts, so the proxy's pooled
+# upstream connections are reused rather than closed under it
+SERVER_IDLE_TIMEOUT = float(os.getenv("SERVER_IDLE_TIMEOUT", "120"))
 MAINS_VOLTAGE = int(os.getenv("MAINS_VOLTAGE", "230"))
 POWER_FACTOR = float(os.getenv("POWER_FACTOR", "0.6"))
+# Per-sensor overrides as JSON, {"<label>" or "*": {"power_factor": .., "mains_voltage": .., "scale": ..}}
+SENSOR_CALIBRATION = json.loads(os.getenv("SENSOR_CALIBRATION", "") or "{}")
 
 # Logging level, values are DEBUG, INFO, WARN, ERROR, CRITICAL
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 
+# Log 1 in N requests in full at INFO level when DEBUG is off (0 disables sampling)
+DEBUG_SAMPLE_RATE = int(os.getenv("DEBUG_SAMPLE_RATE", "0"))
+
+# Storage backend: "sqlite" (data/readings.db) or "duckdb" (data/readings.duckdb,
+# needs the duckdb package; no ingest workers, archive, backups or maintenance)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").lower()
+
 # SQL timeout in seconds
 SQLITE_TIMEOUT = float(os.getenv("SQLITE_TIMEOUT", "5.0"))
 SQLITE_RETRIES = int(os.getenv("SQLITE_RETRIES", "5"))
 SQLITE_RETRY_DELAY = float(os.getenv("SQLITE_RETRY_DELAY", "0.2"))
+# Prepared statements kept per connection (Python's default is 128)
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+
+# SQLite performance profile: "default" (SQLite's own settings), "sdcard"
+# (Raspberry Pi on an SD card: small cache, no autocheckpoint, writes batched
+# by background checkpoints) or "ssd" (larger cache and mmap).
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "default").lower()
+SQLITE_PROFILES = {
+    "default": {
+        "mmap_size": 0, "cache_size": -2000, "temp_store": "DEFAULT", "page_size": 4096,
+        "wal_autocheckpoint": 1000, "checkpoint_interval": 0, "optimize_interval": 0,
+    },
+    "sdcard": {
+        "mmap_size": 32 * 1024 * 1024, "cache_size": -8000, "temp_store": "MEMORY", "page_size": 4096,
+        "wal_autocheckpoint": 0, "checkpoint_interval": 300, "optimize_interval": 86400,
+    },
+    "ssd": {
+        "mmap_size": 256 * 1024 * 1024, "cache_size": -64000, "temp_store": "MEMORY", "page_size": 4096,
+        "wal_autocheckpoint": 0, "checkpoint_interval": 60, "optimize_interval": 86400,
+    },
+}
+# Individual overrides of the profile, empty keeps the profile's value:
+# mmap_size in bytes, cache_size in pages (negative = KiB), temp_store
+# DEFAULT/FILE/MEMORY, page_size for new databases, wal_autocheckpoint in
+# pages (0 = only background checkpoints), checkpoint_interval and
+# optimize_interval in seconds (0 disables).
+SQLITE_MMAP_SIZE = os.getenv("SQLITE_MMAP_SIZE", "")
+SQLITE_CACHE_SIZE = os.getenv("SQLITE_CACHE_SIZE", "")
+SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "")
+SQLITE_PAGE_SIZE = os.getenv("SQLITE_PAGE_SIZE", "")
+SQLITE_WAL_AUTOCHECKPOINT = os.getenv("SQLITE_WAL_AUTOCHECKPOINT", "")
+SQLITE_CHECKPOINT_INTERVAL = os.getenv("SQLITE_CHECKPOINT_INTERVAL", "")
+SQLITE_OPTIMIZE_INTERVAL = os.getenv("SQLITE_OPTIMIZE_INTERVAL", "")
 
 # Enable or disable MQTT
 MQTT_ENABLED = os.getenv("MQTT_ENABLED", "false").lower() in ("true", "1", "yes", "on")
@@ -22,6 +72,10 @@ MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 MQTT_USER = os.getenv("MQTT_USER", None)
 MQTT_PASS = os.getenv("MQTT_PASS", None)
 MQTT_BASE_TOPIC = os.getenv("MQTT_BASE_TOPIC", "home/efergy")
+# Publish one message per hub post with every sensor's value instead of one per sensor.
+# MQTT_BATCHED_PER_SENSOR keeps publishing the per-sensor topics as well.
+MQTT_BATCHED = os.getenv("MQTT_BATCHED", "false").lower() in ("true", "1", "yes", "on")
+MQTT_BATCHED_PER_SENSOR = os.getenv("MQTT_BATCHED_PER_SENSOR", "false").lower() in ("true", "1", "yes", "on")
 
 # Home Assistant
 HA_DISCOVERY = os.getenv("HA_DISCOVERY", "false").lower() in ("true", "1", "yes", "on")
@@ -56,8 +110,101 @@ ENERGY_UNIT_OF_MEASUREMENT = os.getenv("ENERGY_UNIT_OF_MEASUREMENT", "kWh")
 
 ENERGY_MONTHLY_RESET = os.getenv("ENERGY_MONTHLY_RESET", "false").lower() in ("true", "1", "yes", "on")
 
+# Prometheus-style metrics endpoint, served on its own port at /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("true", "1", "yes", "on")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Live stream of incoming readings as Server-Sent Events at /stream on its own port.
+# Each client may fall STREAM_CLIENT_BUFFER readings behind before it is disconnected.
+STREAM_ENABLED = os.getenv("STREAM_ENABLED", "false").lower() in ("true", "1", "yes", "on")
+STREAM_PORT = int(os.getenv("STREAM_PORT", "5002"))
+STREAM_CLIENT_BUFFER = int(os.getenv("STREAM_CLIENT_BUFFER", "256"))
+STREAM_MAX_CLIENTS = int(os.getenv("STREAM_MAX_CLIENTS", "16"))
+
+# Unrecognized requests: ring buffer size, body byte cap, per-client rate limit
+# (packets per window seconds) and an optional rotating capture file for offline analysis
+UNKNOWN_PACKET_BUFFER = int(os.getenv("UNKNOWN_PACKET_BUFFER", "100"))
+UNKNOWN_PACKET_MAX_BYTES = int(os.getenv("UNKNOWN_PACKET_MAX_BYTES", "1024"))
+UNKNOWN_PACKET_RATE_LIMIT = int(os.getenv("UNKNOWN_PACKET_RATE_LIMIT", "5"))
+UNKNOWN_PACKET_RATE_WINDOW = float(os.getenv("UNKNOWN_PACKET_RATE_WINDOW", "60"))
+UNKNOWN_PACKET_CAPTURE_FILE = os.getenv("UNKNOWN_PACKET_CAPTURE_FILE", "")
+UNKNOWN_PACKET_CAPTURE_MAX_BYTES = int(os.getenv("UNKNOWN_PACKET_CAPTURE_MAX_BYTES", str(10 * 1024 * 1024)))
+UNKNOWN_PACKET_CAPTURE_BACKUPS = int(os.getenv("UNKNOWN_PACKET_CAPTURE_BACKUPS", "3"))
+UNKNOWN_PACKET_SUMMARY_INTERVAL = float(os.getenv("UNKNOWN_PACKET_SUMMARY_INTERVAL", "300"))
+
+# Peers trusted to name the real client in the X-Real-IP header, i.e. legacy-nginx.
+# Comma separated addresses or networks, "unix" for the Unix socket listener.
+TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "unix,127.0.0.0/8,::1,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16")
+
+# Minutes of recent readings kept in memory per sensor for /api/recent and partial-hour energy
+HOT_WINDOW_MINUTES = int(os.getenv("HOT_WINDOW_MINUTES", "60"))
+
+# Seconds between live energy publishes (completed hours + current partial hour), 0 disables
+LIVE_ENERGY_INTERVAL = int(os.getenv("LIVE_ENERGY_INTERVAL", "60"))
+
+# Multi-process ingest: number of HTTP worker processes forwarding readings
+# to a single writer process, 0 runs everything in one process
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))
+# Writer batching: max readings per transaction, and seconds to wait for more
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5"))
+
+# Write-ahead ingest journal: readings are appended here before the hub is
+# acknowledged and committed to SQLite in the background. Empty disables.
+# Relative paths are relative to the hub-server directory.
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", "")
+# Seconds between batched fsyncs of the journal, 0 fsyncs every append
+JOURNAL_FSYNC_INTERVAL = float(os.getenv("JOURNAL_FSYNC_INTERVAL", "0.2"))
+# Seconds between journal drains into SQLite
+JOURNAL_DRAIN_INTERVAL = float(os.getenv("JOURNAL_DRAIN_INTERVAL", "1.0"))
+# Rewrite the journal once this many bytes have been committed
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", str(1024 * 1024)))
+
+# Online backups of the database into this directory, empty disables.
+# Relative paths are relative to the hub-server directory.
+BACKUP_DIR = os.getenv("BACKUP_DIR", "")
+# Seconds between backups, and how many backup files to keep
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", "86400"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+# Gzip the backup files
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "true").lower() in ("true", "1", "yes", "on")
+# Pages copied per backup step while ingest waits, and seconds to sleep between steps
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "256"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.02"))
+
+# Hourly energy integration: "left" (Riemann sum) or "trapezoid", the max
+# seconds a sample is held (0 = no cap) and whether intervals crossing an
+# hour boundary are split between the hours
+ENERGY_INTEGRATION_METHOD = os.getenv("ENERGY_INTEGRATION_METHOD", "left").lower()
+ENERGY_INTEGRATION_MAX_GAP = int(os.getenv("ENERGY_INTEGRATION_MAX_GAP", "0"))
+ENERGY_INTEGRATION_SPLIT_HOURS = os.getenv("ENERGY_INTEGRATION_SPLIT_HOURS", "false").lower() in ("true", "1", "yes", "on")
+
+# Retried hub posts: a sensor line the same hub already posted within
+# DEDUPE_WINDOW seconds is dropped as a duplicate, 0 (default) disables. Off by
+# default: most hubs send a constant post counter, so an unchanged reading
+# posted again is indistinguishable from a retry. At most DEDUPE_MAX_KEYS
+# recent keys are kept in memory.
+DEDUPE_WINDOW = int(os.getenv("DEDUPE_WINDOW", "0"))
+DEDUPE_MAX_KEYS = int(os.getenv("DEDUPE_MAX_KEYS", "100000"))
+
+# Sensor liveness: seconds without a reading before a sensor (or hub) is
+# reported offline, and seconds between availability checks and checkpoints
+# of the liveness registry to SQLite
+LIVENESS_TIMEOUT = int(os.getenv("LIVENESS_TIMEOUT", "300"))
+LIVENESS_INTERVAL = int(os.getenv("LIVENESS_INTERVAL", "30"))
+# Publish online/offline per sensor and reference it as availability_topic in HA discovery
+MQTT_AVAILABILITY = os.getenv("MQTT_AVAILABILITY", "true").lower() in ("true", "1", "yes", "on")
+
+# Seconds to wait for in-flight requests on SIGTERM/SIGINT before shutting down anyway
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "5"))
+
 # History retention in months (0 means keep everything)
 HISTORY_RETENTION_MONTHS = int(os.getenv("HISTORY_RETENTION_MONTHS", "0"))
+# Compact readings of closed months older than this many months into compressed
+# archive chunks, still read by aggregation and re-aggregation (0 = never)
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "0"))
+# Compression of archive chunks: zlib (faster) or lzma (smaller)
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zlib").lower()
 
 DEVICE_NAME = os.getenv("DEVICE_NAME", "Efergy Hub")
 DEVICE_IDENTIFIERS = os.getenv("DEVICE_IDENTIFIERS", ["efergy"])
@@ -5,23 +5,184 @@ import sqlite3
 from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict, Union
+from typing import Callable, Optional, Dict, Iterable, List, Sequence, Tuple, Union
+import archive
 from config import (
-    SQLITE_TIMEOUT, POWER_FACTOR, MAINS_VOLTAGE, ENERGY_MONTHLY_RESET, SQLITE_RETRIES, SQLITE_RETRY_DELAY
+    SQLITE_TIMEOUT, POWER_FACTOR, MAINS_VOLTAGE, ENERGY_MONTHLY_RESET, SQLITE_RETRIES, SQLITE_RETRY_DELAY,
+    SQLITE_PROFILE, SQLITE_PROFILES, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE, SQLITE_TEMP_STORE, SQLITE_PAGE_SIZE,
+    SQLITE_WAL_AUTOCHECKPOINT, SQLITE_CHECKPOINT_INTERVAL, SQLITE_OPTIMIZE_INTERVAL, SQLITE_CACHED_STATEMENTS,
+    ENERGY_INTEGRATION_SPLIT_HOURS, SENSOR_CALIBRATION, ARCHIVE_COMPRESSION
 )
+from energy_integration import integrate_rows
+from metrics import (
+    DB_COMMIT_DURATION, DB_LOCK_WAIT, AGGREGATION_HOUR_DURATION, DB_CHECKPOINT_DURATION, DB_WAL_FRAMES
+)
+
+# Stored in PRAGMA user_version once setup() has created the schema below.
+# Bump it whenever tables or indices change so existing databases are migrated.
+SCHEMA_VERSION = 1
+
+# INSERT ... RETURNING needs SQLite 3.35
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+INSERT_LABEL_SQL = "INSERT INTO labels(label) VALUES (?) ON CONFLICT(label) DO NOTHING RETURNING label_id"
+
+# Hot statements, kept as constants so every call hits the connection's statement cache
+INSERT_READING_SQL = "INSERT INTO readings(label_id, timestamp, value) VALUES (?,?,?)"
+HOUR_EXISTS_SQL = "SELECT 1 FROM energy_hourly WHERE hour_start = ?"
+INSERT_HOUR_SQL = "INSERT OR REPLACE INTO energy_hourly(hour_start, kwh) VALUES (?, ?)"
+READINGS_FROM = """
+    FROM readings
+    INNER JOIN labels ON labels.label_id = readings.label_id
+"""
+KW_SELECT = """
+    SELECT timestamp,
+           CASE
+               WHEN labels.label LIKE 'efergy_h1%%' OR labels.label LIKE 'efergy_h2%%'
+                   THEN (? * ? * (readings.value / 1000.0)) / 1000.0
+               WHEN labels.label LIKE 'efergy_h3%%'
+                   THEN (readings.value / 10.0) / 1000.0
+               ELSE readings.value / 1000.0
+           END AS kw
+""" + READINGS_FROM
+# Raw values for conversion in Python, used when SENSOR_CALIBRATION is set
+RAW_SELECT = "SELECT timestamp, labels.label, readings.value" + READINGS_FROM
+HOUR_WHERE = """
+    WHERE timestamp >= ? AND timestamp < ?
+    ORDER BY timestamp ASC, readings.rowid ASC
+"""
+# Readings either side of an hour, for ENERGY_INTEGRATION_SPLIT_HOURS
+PREVIOUS_WHERE = """
+    WHERE timestamp < ?
+    ORDER BY timestamp DESC, readings.rowid DESC LIMIT 1
+"""
+NEXT_WHERE = """
+    WHERE timestamp >= ?
+    ORDER BY timestamp ASC, readings.rowid ASC LIMIT 1
+"""
+# (kW query, raw query) per range
+KW_QUERIES = {
+    "hour": (KW_SELECT + HOUR_WHERE, RAW_SELECT + HOUR_WHERE),
+    "previous": (KW_SELECT + PREVIOUS_WHERE, RAW_SELECT + PREVIOUS_WHERE),
+    "next": (KW_SELECT + NEXT_WHERE, RAW_SELECT + NEXT_WHERE),
+}
+# The same ranges including archived readings, as (timestamp, label, value)
+ARCHIVE_READS = {
+    "hour": archive.read_range,
+    "previous": archive.read_previous,
+    "next": archive.read_next,
+}
+ARCHIVE_READINGS_SQL = """
+    SELECT timestamp, rowid, value FROM readings
+    WHERE label_id = ? AND timestamp >= ? AND timestamp < ?
+    ORDER BY timestamp ASC, rowid ASC
+"""
+UPSERT_LIVENESS_SQL = """
+    INSERT OR REPLACE INTO liveness(kind, key, hub, hub_version, last_seen, last_value, count, rssi, last_ping)
+    VALUES (?,?,?,?,?,?,?,?,?)
+"""
+UPSERT_INGEST_KEY_SQL = "INSERT OR REPLACE INTO ingest_keys(hub, label, line, timestamp) VALUES (?,?,?,?)"
+UPSERT_LATEST_SQL = """
+    INSERT INTO latest_readings(label_id, timestamp, value, watts) VALUES (?,?,?,?)
+    ON CONFLICT(label_id) DO UPDATE SET
+        timestamp = excluded.timestamp, value = excluded.value, watts = excluded.watts
+    WHERE excluded.timestamp >= latest_readings.timestamp
+"""
+
+
+def sqlite_profile(name: str = SQLITE_PROFILE) -> Dict[str, Union[int, str]]:
+    """
+    Resolve a SQLITE_PROFILES preset with the individual SQLITE_* overrides applied.
+    Unknown profile names fall back to "default".
+    """
+    if name not in SQLITE_PROFILES:
+        logging.warning(f"Unknown SQLITE_PROFILE '{name}', using 'default'")
+        name = "default"
+    profile = dict(SQLITE_PROFILES[name])
+
+    overrides = {
+        "mmap_size": SQLITE_MMAP_SIZE, "cache_size": SQLITE_CACHE_SIZE, "temp_store": SQLITE_TEMP_STORE,
+        "page_size": SQLITE_PAGE_SIZE, "wal_autocheckpoint": SQLITE_WAL_AUTOCHECKPOINT,
+        "checkpoint_interval": SQLITE_CHECKPOINT_INTERVAL, "optimize_interval": SQLITE_OPTIMIZE_INTERVAL,
+    }
+    for key, value in overrides.items():
+        if value != "":
+            profile[key] = value.upper() if key == "temp_store" else int(value)
+
+    if profile["temp_store"] not in ("DEFAULT", "FILE", "MEMORY"):
+        raise ValueError(f"Invalid SQLITE_TEMP_STORE: {profile['temp_store']}")
+    return profile
+
+
+def sensor_calibration(label: str, calibration: Optional[Dict[str, dict]] = None) -> Optional[dict]:
+    """
+    The calibration override for `label` from `calibration` (SENSOR_CALIBRATION
+    if None): its own entry, else the "*" entry, else None.
+    """
+    calibration = SENSOR_CALIBRATION if calibration is None else calibration
+    return calibration.get(label, calibration.get("*")) if calibration else None
+
+
+def raw_to_kw(label: str, value: float, calibration: Optional[Dict[str, dict]] = None) -> float:
+    """
+    Convert a raw sensor value to kW exactly as the aggregation query does,
+    operation for operation, so Python and SQL results are bit-identical.
+    A calibration override replaces power_factor/mains_voltage and
+    multiplies the result by its scale.
+    """
+    override = sensor_calibration(label, calibration)
+    if override:
+        return raw_to_watts(label, value, calibration) / 1000.0
+    if label.startswith(("efergy_h1", "efergy_h2")):
+        return (POWER_FACTOR * MAINS_VOLTAGE * (value / 1000.0)) / 1000.0
+    if label.startswith("efergy_h3"):
+        return (value / 10.0) / 1000.0
+    return value / 1000.0
+
+
+def raw_to_watts(label: str, value: float, calibration: Optional[Dict[str, dict]] = None) -> float:
+    """
+    Convert a raw sensor value to watts using the same formulas as aggregation.
+
+    h1/h2 values are milliamps (P = PF x V x I / 1000), h3 values are deciwatts.
+    """
+    override = sensor_calibration(label, calibration)
+    if override:
+        if label.startswith(("efergy_h1", "efergy_h2")):
+            watts = (override.get("power_factor", POWER_FACTOR) * override.get("mains_voltage", MAINS_VOLTAGE)
+                     * value) / 1000.0
+        elif label.startswith("efergy_h3"):
+            watts = value / 10.0
+        else:
+            watts = value
+        return watts * override.get("scale", 1.0)
+    if label.startswith(("efergy_h1", "efergy_h2")):
+        return (POWER_FACTOR * MAINS_VOLTAGE * value) / 1000.0
+    if label.startswith("efergy_h3"):
+        return value / 10.0
+    return value
+
+
+def months_ago(months: int) -> datetime:
+    """Local midnight on the first day of the month `months` before the current one."""
+    now = datetime.now()
+    year, month = divmod(now.month - months - 1, 12)
+    return now.replace(year=now.year + year, month=month + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
 
 
 class Database:
     """Handles all database operations for sensor readings."""
 
-    def __init__(self, db_path: Union[str, Path]):
+    def __init__(self, db_path: Union[str, Path], profile: Optional[Dict[str, Union[int, str]]] = None):
         """
         Initializes the Database handler.
 
         Args:
             db_path: The file path to the sqlite database.
+            profile: SQLite performance settings, see `sqlite_profile()`.
+                Defaults to the configured SQLITE_PROFILE.
         """
         self.db_path = Path(db_path)
+        self.profile = profile if profile is not None else sqlite_profile()
 
         # Ensure parent directory exists
         if not self.db_path.parent.exists():
@@ -29,9 +190,20 @@ class Database:
             self.db_path.parent.mkdir(parents=True, exist_ok=True)
 
         self._conn: Optional[sqlite3.Connection] = None
+        # Long-lived cursor for the hot paths, only used under _conn_lock
+        self._cursor: Optional[sqlite3.Cursor] = None
         self._conn_lock = threading.Lock()
+        # label -> label_id. Replaced (copy-on-write) under _label_lock, read without it
         self._label_cache: Dict[str, int] = {}
         self._label_lock = threading.Lock()
+        # Labels resolved in the current transaction, published on commit
+        self._new_labels: Dict[str, int] = {}
+        # label -> (timestamp, raw value, watts), mirrors the latest_readings table
+        self._latest: Dict[str, Tuple[int, float, float]] = {}
+        # Optional write-ahead journal (journal.IngestJournal)
+        self._journal = None
+        # End of the last archived month; earlier ranges are also read from archive_chunks
+        self._archived_until = 0
 
         self._aggregator_stop = threading.Event()
         self._aggregator_thread = None
@@ -44,14 +216,27 @@ class Database:
         if not self.db_path.parent.exists():
             raise RuntimeError("Database directory missing")
 
+        new_db = not self.db_path.exists() or self.db_path.stat().st_size == 0
+
         self._conn = sqlite3.connect(
             self.db_path,
             timeout=SQLITE_TIMEOUT,
-            check_same_thread=False
+            check_same_thread=False,
+            cached_statements=SQLITE_CACHED_STATEMENTS
         )
+        self._cursor = self._conn.cursor()
 
+        profile = self.profile
+        if new_db:
+            # Only takes effect before the first write, and can't change once in WAL mode
+            self._conn.execute(f"PRAGMA page_size = {int(profile['page_size'])};")
         self._conn.execute("PRAGMA journal_mode=WAL;")
         self._conn.execute("PRAGMA busy_timeout = 5000;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute(f"PRAGMA mmap_size = {int(profile['mmap_size'])};")
+        self._conn.execute(f"PRAGMA cache_size = {int(profile['cache_size'])};")
+        self._conn.execute(f"PRAGMA temp_store = {profile['temp_store']};")
+        self._conn.execute(f"PRAGMA wal_autocheckpoint = {int(profile['wal_autocheckpoint'])};")
 
 
     def _get_connection(self):
@@ -65,7 +250,9 @@ class Database:
         """
         for attempt in range(1, SQLITE_RETRIES + 1):
             try:
+                wait_start = time.perf_counter()
                 with self._conn_lock:
+                    DB_LOCK_WAIT.observe(time.perf_counter() - wait_start)
                     self._connect()
                     yield self._conn
                 return
@@ -78,6 +265,7 @@ class Database:
                         except Exception:
                             pass
                         self._conn = None
+                        self._cursor = None
                 if attempt < SQLITE_RETRIES:
                     time.sleep(SQLITE_RETRY_DELAY)
 
@@ -88,6 +276,9 @@ class Database:
     def setup(self) -> None:
         """
         Sets up the database, creating tables and indices if they don't exist.
+
+        Skipped when the stored schema version is current, so startup on a
+        large database only loads the in-memory caches.
         """
         db_exists = self.db_path.exists()
 
@@ -96,65 +287,196 @@ class Database:
         else:
             logging.debug(f"Using existing database: {self.db_path}")
 
-        logging.debug("Setting up database tables and indices...")
-
         with self._get_connection() as conn:
             cursor = conn.cursor()
 
-            # Enable WAL + busy timeout
-            self._conn.execute("PRAGMA synchronous=NORMAL;")
-            cursor.execute("PRAGMA journal_mode=WAL;")
-            cursor.execute("PRAGMA busy_timeout = 5000;")
+            cursor.execute("PRAGMA user_version")
+            version = cursor.fetchone()[0]
+            if version < SCHEMA_VERSION:
+                logging.info(f"Updating database schema from version {version} to {SCHEMA_VERSION}")
+                self._create_schema(cursor)
+                conn.commit()
+            elif version > SCHEMA_VERSION:
+                # Written by a newer release; leave it as it is rather than downgrading user_version
+                logging.warning(f"Database schema version {version} is newer than this release's "
+                                f"{SCHEMA_VERSION}, using it unchanged")
+            else:
+                logging.debug(f"Database schema version {version} is current")
 
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS labels (
-                    label_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    label STRING UNIQUE
-                )
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS readings (
-                    label_id INTEGER,
-                    timestamp INTEGER,
-                    value REAL,
-                    FOREIGN KEY(label_id) REFERENCES labels(label_id)
-                )
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS energy_hourly (
-                    hour_start INTEGER PRIMARY KEY,
-                    kwh REAL
-                )
-            """)
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_labels_label_index
-                ON labels(label)
-            """)
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_readings_timestamp
-                ON readings(timestamp)
-            """)
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_readings_label_id
-                ON readings(label_id)
-            """)
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_readings_label_id_timestamp
-                ON readings(label_id, timestamp)
-            """)
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_energy_hourly_hour
-                ON energy_hourly (hour_start)
-            """)
+            self._load_latest(cursor)
+            self._archived_until = archive.archived_until(cursor)
+
+            # Preload every label so no sensor pays a lookup after a restart
+            cursor.execute("SELECT label, label_id FROM labels")
+            with self._label_lock:
+                self._label_cache = dict(cursor.fetchall())
 
         logging.debug("Database setup complete.")
 
 
+    def _create_schema(self, cursor: sqlite3.Cursor) -> None:
+        """Create missing tables and indices and record SCHEMA_VERSION. Caller commits."""
+        logging.debug("Setting up database tables and indices...")
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS labels (
+                label_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                label STRING UNIQUE
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS readings (
+                label_id INTEGER,
+                timestamp INTEGER,
+                value REAL,
+                FOREIGN KEY(label_id) REFERENCES labels(label_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS energy_hourly (
+                hour_start INTEGER PRIMARY KEY,
+                kwh REAL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS latest_readings (
+                label_id INTEGER PRIMARY KEY,
+                timestamp INTEGER,
+                value REAL,
+                watts REAL,
+                FOREIGN KEY(label_id) REFERENCES labels(label_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS journal_checkpoint (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation TEXT,
+                journal_offset INTEGER
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS liveness (
+                kind TEXT,
+                key TEXT,
+                hub TEXT,
+                hub_version TEXT,
+                last_seen INTEGER,
+                last_value REAL,
+                count INTEGER,
+                rssi REAL,
+                last_ping INTEGER,
+                PRIMARY KEY (kind, key)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_keys (
+                hub TEXT,
+                label TEXT,
+                line TEXT,
+                timestamp INTEGER
+            )
+        """)
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_ingest_keys_key
+            ON ingest_keys(hub, label, line)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ingest_keys_timestamp
+            ON ingest_keys(timestamp)
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS archive_chunks (
+                label_id INTEGER,
+                start_ts INTEGER,
+                end_ts INTEGER,
+                count INTEGER,
+                codec TEXT,
+                data BLOB,
+                PRIMARY KEY (label_id, start_ts),
+                FOREIGN KEY(label_id) REFERENCES labels(label_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_archive_chunks_start
+            ON archive_chunks(start_ts)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_labels_label_index
+            ON labels(label)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_readings_timestamp
+            ON readings(timestamp)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_readings_label_id
+            ON readings(label_id)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_readings_label_id_timestamp
+            ON readings(label_id, timestamp)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_energy_hourly_hour
+            ON energy_hourly (hour_start)
+        """)
+
+        self._backfill_latest_readings(cursor)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+    def _load_latest(self, cursor: sqlite3.Cursor) -> None:
+        """Replace the in-memory latest readings with the latest_readings table."""
+        cursor.execute("""
+            SELECT labels.label, latest_readings.timestamp, latest_readings.value, latest_readings.watts
+            FROM latest_readings
+            INNER JOIN labels ON labels.label_id = latest_readings.label_id
+        """)
+        self._latest = {label: (ts, value, watts) for label, ts, value, watts in cursor.fetchall()}
+
+
+    def load_latest_readings(self) -> None:
+        """Load the in-memory latest readings without running setup()."""
+        try:
+            with self._get_connection() as conn:
+                self._load_latest(conn.cursor())
+        except Exception as e:
+            logging.error(f"Failed to load latest readings: {e}")
+
+
+    def _backfill_latest_readings(self, cursor: sqlite3.Cursor) -> None:
+        """
+        Fill latest_readings for labels that have readings but no latest row,
+        e.g. databases created before the table existed. One indexed lookup per label.
+        """
+        cursor.execute("""
+            SELECT label_id, label FROM labels
+            WHERE label_id NOT IN (SELECT label_id FROM latest_readings)
+        """)
+        missing = cursor.fetchall()
+
+        for label_id, label in missing:
+            cursor.execute(
+                "SELECT timestamp, value FROM readings WHERE label_id = ? ORDER BY timestamp DESC LIMIT 1",
+                (label_id,)
+            )
+            row = cursor.fetchone()
+            if row:
+                ts, value = row
+                cursor.execute(UPSERT_LATEST_SQL, (label_id, ts, value, raw_to_watts(label, value)))
+
+        if missing:
+            logging.debug(f"Backfilled latest readings for {len(missing)} labels")
+
+
     def _get_or_create_label_id(self, cursor: sqlite3.Cursor, label: str) -> int:
         """
         Gets a label_id from the cache or database.
         If the label doesn't exist, it's created.
 
+        Cache hits take no lock. A label resolved from the database only
+        becomes visible in the cache once `_publish_labels` runs after commit.
+
         NOTE: This must be called with a cursor from an active transaction,
         as it may perform a database write (INSERT).
 
@@ -165,25 +487,71 @@ class Database:
         Returns:
             The integer ID for the label.
         """
-        # Check cache first
-        with self._label_lock:
-            if label in self._label_cache:
-                return self._label_cache[label]
+        label_id = self._label_cache.get(label)
+        if label_id is not None:
+            return label_id
+        return self._get_or_create_label_ids(cursor, (label,))[label]
 
-            # If not in cache, check database
-            cursor.execute("SELECT label_id FROM labels WHERE label=?", (label,))
-            row = cursor.fetchone()
 
-            if row:
-                label_id = row[0]
+    def _get_or_create_label_ids(self, cursor: sqlite3.Cursor, labels: Iterable[str]) -> Dict[str, int]:
+        """
+        Batch version of _get_or_create_label_id: labels missing from the
+        cache are looked up with a single SELECT and only the new ones inserted.
+        Must be called under _conn_lock, inside the transaction that uses the ids.
+        """
+        cache = self._label_cache
+        result = {}
+        missing = []
+        for label in labels:
+            label_id = cache.get(label, self._new_labels.get(label))
+            if label_id is None:
+                missing.append(label)
+            else:
+                result[label] = label_id
+        if not missing:
+            return result
+
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            cursor.execute(
+                f"SELECT label, label_id FROM labels WHERE label IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for label, label_id in cursor.fetchall():
+                result[label] = label_id
+
+        for label in missing:
+            if label in result:
+                continue
+            if HAS_RETURNING:
+                cursor.execute(INSERT_LABEL_SQL, (label,))
+                row = cursor.fetchone()
             else:
-                # Not in DB, so create it
-                cursor.execute("INSERT INTO labels(label) VALUES (?)", (label,))
-                label_id = cursor.lastrowid
-                logging.debug(f"Created new label '{label}' with id {label_id}")
+                cursor.execute("INSERT OR IGNORE INTO labels(label) VALUES (?)", (label,))
+                row = (cursor.lastrowid,) if cursor.rowcount == 1 else None
+            if row is None:
+                # Created concurrently by another connection
+                cursor.execute("SELECT label_id FROM labels WHERE label = ?", (label,))
+                row = cursor.fetchone()
+            else:
+                logging.debug(f"Created new label '{label}' with id {row[0]}")
+            result[label] = row[0]
 
-            self._label_cache[label] = label_id
-            return label_id
+        for label in missing:
+            self._new_labels[label] = result[label]
+        return result
+
+
+    def _publish_labels(self) -> None:
+        """
+        After a commit, copy-on-write the labels resolved in the transaction
+        into the cache, so readers never see a dict being mutated or an id
+        from a rolled back transaction.
+        """
+        if self._new_labels:
+            with self._label_lock:
+                self._label_cache = {**self._label_cache, **self._new_labels}
+            self._new_labels = {}
 
 
     def log_data(self, label: str, value: float, timestamp: Optional[int] = None) -> None:
@@ -192,6 +560,7 @@ class Database:
 
         This opens a single connection and handles the transaction
         for potentially creating a new label and logging the reading.
+        With a journal attached the reading is journaled and committed later.
 
         Args:
             label: The string identifier for the data (e.g., 'efergy_h2_123456').
@@ -201,24 +570,394 @@ class Database:
         if timestamp is None:
             timestamp = int(time.time())
 
+        if self._journal is not None:
+            self.log_many([(label, value, timestamp)])
+            return
+
+        try:
+            with self._get_connection() as conn:
+                cursor = self._cursor
+                try:
+                    label_id = self._get_or_create_label_id(cursor, label)
+
+                    # Insert the actual reading
+                    timestamp = int(timestamp)
+                    watts = raw_to_watts(label, value)
+                    cursor.execute(INSERT_READING_SQL, (label_id, timestamp, value))
+                    cursor.execute(UPSERT_LATEST_SQL, (label_id, timestamp, value, watts))
+                    with DB_COMMIT_DURATION.time():
+                        conn.commit()
+                    self._publish_labels()
+                except Exception:
+                    self._new_labels = {}
+                    conn.rollback()
+                    raise
+
+            self._update_latest(label, timestamp, value, watts)
+
+            logging.debug("Inserted reading: %s (%s), %s", label, label_id, value)
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to log data for label '{label}': {e}")
+        except Exception as e:
+            logging.error(f"An unexpected error occurred in log_data: {e}")
+
+
+    def log_many(self, readings: Iterable[Tuple[str, float, Optional[int]]]) -> int:
+        """
+        Logs a batch of data points in a single transaction.
+
+        With a journal attached the batch is appended to the journal instead
+        and committed by its drain.
+
+        Args:
+            readings: Iterable of (label, value, timestamp) tuples. A timestamp
+                of None means the current time.
+
+        Returns:
+            The number of readings inserted (or journaled).
+        """
+        if self._journal is not None:
+            now = int(time.time())
+            batch = [(label, value, int(now if ts is None else ts)) for label, value, ts in readings]
+            try:
+                self._journal.append(batch)
+                for label, value, timestamp in batch:
+                    self._update_latest(label, timestamp, value, raw_to_watts(label, value))
+                return len(batch)
+            except OSError as e:
+                logging.error(f"Journal append failed, writing directly: {e}")
+                readings = batch
+
+        try:
+            count = self._write_many(readings)
+            logging.debug(f"Inserted {count} readings in one batch")
+            return count
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to log batch of readings: {e}")
+        except Exception as e:
+            logging.error(f"An unexpected error occurred in log_many: {e}")
+        return 0
+
+
+    def _write_many(self, readings: Iterable[Tuple[str, float, Optional[int]]],
+                    checkpoint: Optional[Tuple[str, int]] = None) -> int:
+        """
+        Insert a batch in one transaction, optionally recording a journal
+        (generation, offset) checkpoint in the same transaction. Raises on failure.
+        """
+        now = int(time.time())
+
+        readings = list(readings)
+        with self._get_connection() as conn:
+            cursor = self._cursor
+            try:
+                label_ids = self._get_or_create_label_ids(cursor, {reading[0] for reading in readings})
+                rows = []
+                latest: Dict[str, Tuple[int, int, float]] = {}
+                for label, value, timestamp in readings:
+                    label_id = label_ids[label]
+                    timestamp = int(now if timestamp is None else timestamp)
+                    rows.append((label_id, timestamp, value))
+                    if label not in latest or timestamp >= latest[label][1]:
+                        latest[label] = (label_id, timestamp, value)
+
+                cursor.executemany(INSERT_READING_SQL, rows)
+                latest_rows = [
+                    (label, label_id, timestamp, value, raw_to_watts(label, value))
+                    for label, (label_id, timestamp, value) in latest.items()
+                ]
+                cursor.executemany(UPSERT_LATEST_SQL, [row[1:] for row in latest_rows])
+                if checkpoint is not None:
+                    cursor.execute(
+                        "INSERT OR REPLACE INTO journal_checkpoint(id, generation, journal_offset) VALUES (1, ?, ?)",
+                        checkpoint
+                    )
+                with DB_COMMIT_DURATION.time():
+                    conn.commit()
+                self._publish_labels()
+            except Exception:
+                self._new_labels = {}
+                conn.rollback()
+                raise
+
+        for label, _, timestamp, value, watts in latest_rows:
+            self._update_latest(label, timestamp, value, watts)
+        return len(rows)
+
+
+    def attach_journal(self, journal) -> None:
+        """Route log_data/log_many through a write-ahead IngestJournal."""
+        self._journal = journal
+
+
+    def commit_journal_batch(self, readings: List[Tuple[str, float, int]], generation: str, offset: int) -> int:
+        """
+        Commit readings drained from the journal together with the journal
+        position they were read up to. Raises on failure so the drain retries.
+        """
+        return self._write_many(readings, (generation, offset))
+
+
+    def get_journal_checkpoint(self) -> Optional[Tuple[str, int]]:
+        """The (generation, offset) the journal has been committed up to, or None."""
+        with self._get_connection() as conn:
+            row = conn.execute("SELECT generation, journal_offset FROM journal_checkpoint WHERE id = 1").fetchone()
+            return (row[0], int(row[1])) if row else None
+
+
+    def save_liveness(self, rows: List[tuple]) -> int:
+        """
+        Upsert LivenessRegistry.checkpoint_rows in one transaction. Raises on failure.
+
+        Returns:
+            The number of rows written.
+        """
+        with self._get_connection() as conn:
+            try:
+                self._cursor.executemany(UPSERT_LIVENESS_SQL, rows)
+                with DB_COMMIT_DURATION.time():
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return len(rows)
+
+
+    def get_liveness(self) -> List[tuple]:
+        """Rows of the liveness table, in the order of LivenessRegistry.checkpoint_rows."""
+        try:
+            with self._get_connection() as conn:
+                return conn.execute("""
+                    SELECT kind, key, hub, hub_version, last_seen, last_value, count, rssi, last_ping FROM liveness
+                """).fetchall()
+        except Exception as e:
+            logging.error(f"Failed to load liveness: {e}")
+            return []
+
+
+    def save_ingest_keys(self, keys: List[Tuple[str, str, str, int]], prune_before: int) -> int:
+        """
+        Store (hub, label, line, timestamp) dedupe keys and delete keys
+        older than `prune_before`, in one transaction. Raises on failure.
+
+        Returns:
+            The number of keys written.
+        """
+        with self._get_connection() as conn:
+            try:
+                self._cursor.executemany(UPSERT_INGEST_KEY_SQL, keys)
+                self._cursor.execute("DELETE FROM ingest_keys WHERE timestamp < ?", (prune_before,))
+                with DB_COMMIT_DURATION.time():
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return len(keys)
+
+
+    def get_ingest_keys(self, since: int) -> List[Tuple[str, str, str, int]]:
+        """Dedupe keys seen at or after `since`, oldest first."""
+        try:
+            with self._get_connection() as conn:
+                return conn.execute(
+                    "SELECT hub, label, line, timestamp FROM ingest_keys WHERE timestamp >= ? ORDER BY timestamp",
+                    (since,)
+                ).fetchall()
+        except Exception as e:
+            logging.error(f"Failed to load ingest keys: {e}")
+            return []
+
+
+    def _update_latest(self, label: str, timestamp: int, value: float, watts: float) -> None:
+        current = self._latest.get(label)
+        if current is None or timestamp >= current[0]:
+            self._latest[label] = (timestamp, value, watts)
+
+
+    def get_latest_readings(self) -> Dict[str, dict]:
+        """
+        Return the most recent reading per label from memory, without touching the DB.
+
+        Returns:
+            {label: {"timestamp": int, "value": raw value, "watts": float}}
+        """
+        return {
+            label: {"timestamp": ts, "value": value, "watts": watts}
+            for label, (ts, value, watts) in list(self._latest.items())
+        }
+
+
+    def get_recent_readings(self, since_ts: int) -> Dict[str, List[Tuple[int, float]]]:
+        """
+        Return readings with timestamp >= since_ts per label, oldest first.
+        Uses the (label_id, timestamp) index with one range scan per label.
+        """
+        recent = {}
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-                label_id = self._get_or_create_label_id(cursor, label)
+                cursor.execute("SELECT label_id, label FROM labels")
+                for label_id, label in cursor.fetchall():
+                    cursor.execute(
+                        "SELECT timestamp, value FROM readings WHERE label_id = ? AND timestamp >= ? ORDER BY timestamp",
+                        (label_id, int(since_ts))
+                    )
+                    rows = cursor.fetchall()
+                    if rows:
+                        recent[label] = rows
+        except Exception as e:
+            logging.error(f"Failed to fetch recent readings: {e}")
+        return recent
 
-                # Insert the actual reading
-                cursor.execute(
-                    "INSERT INTO readings(label_id, timestamp, value) VALUES (?,?,?)",
-                    (label_id, int(timestamp), value)
-                )
-                conn.commit()
 
-            logging.debug(f"Inserted reading: {label} ({label_id}), {value}")
+    def get_readings(self, start: int, end: int, labels: Sequence[str] = ()) -> List[Tuple[int, str, float]]:
+        """
+        (timestamp, label, raw value) of readings in [start, end), archived or
+        not, ordered by timestamp and then insertion. Optionally only `labels`.
+        """
+        try:
+            with self._get_connection() as conn:
+                return archive.read_range(conn.cursor(), int(start), int(end), labels)
+        except Exception as e:
+            logging.error(f"Failed to fetch readings: {e}")
+            return []
 
+
+    def summarize_readings(self, start: int, end: int, bucket: int = 86400,
+                           labels: Sequence[str] = ()) -> List[Tuple[int, str, int, float, float, float]]:
+        """
+        Statistics of raw values in [start, end), archived or not, per
+        `bucket` seconds (counted from the epoch, so days are UTC days) and
+        label.
+
+        Returns:
+            (bucket start, label, count, min, max, mean) rows, ordered by
+            bucket and label.
+        """
+        try:
+            with self._get_connection() as conn:
+                return archive.summarize(conn.cursor(), int(start), int(end), int(bucket), labels)
+        except Exception as e:
+            logging.error(f"Failed to summarize readings: {e}")
+            return []
+
+
+    def checkpoint(self, mode: str = "PASSIVE") -> Optional[Tuple[int, int, int]]:
+        """
+        Run a WAL checkpoint on a separate connection, so the shared
+        connection (and ingest) is not held while pages are copied. PASSIVE
+        never waits for readers or writers.
+
+        Returns:
+            (busy, wal frames, checkpointed frames) or None on failure.
+        """
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Invalid checkpoint mode: {mode}")
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=SQLITE_TIMEOUT)
+            try:
+                with DB_CHECKPOINT_DURATION.time():
+                    result = tuple(conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone())
+            finally:
+                conn.close()
+            DB_WAL_FRAMES.set(result[1])
+            logging.debug("WAL checkpoint (%s): busy=%s, frames=%s, checkpointed=%s", mode, *result)
+            return result
         except sqlite3.Error as e:
-            logging.error(f"Failed to log data for label '{label}': {e}")
+            logging.error(f"WAL checkpoint failed: {e}")
+            return None
+
+
+    def optimize(self) -> None:
+        """Run PRAGMA optimize (a bounded ANALYZE of tables that need it)."""
+        try:
+            with self._get_connection() as conn:
+                conn.execute("PRAGMA analysis_limit = 400;")
+                conn.execute("PRAGMA optimize;")
+            logging.debug("Ran PRAGMA optimize")
         except Exception as e:
-            logging.error(f"An unexpected error occurred in log_data: {e}")
+            logging.error(f"PRAGMA optimize failed: {e}")
+
+
+    def backup(self, target: sqlite3.Connection, pages: int = 256, sleep: float = 0.0,
+               progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, float]:
+        """
+        Copy the database into `target` with the SQLite online backup API.
+
+        The copy runs on the shared connection, so the server's own commits
+        are carried into it instead of restarting it as a commit from another
+        connection would. Each step copies `pages` pages holding the
+        connection lock; the lock is released for `sleep` seconds between
+        steps, so writes are held up for one step at most.
+
+        Args:
+            target: Connection to the destination database.
+            pages: Pages per step, -1 copies everything in one step.
+            sleep: Seconds to pause between steps.
+            progress: Called as `progress(remaining, total)` pages after each
+                step, without the lock; raising from it aborts the backup.
+
+        Returns:
+            {"steps", "pages", "busy_steps", "restarts", "lock_wait"}, where
+            lock_wait is the seconds steps waited for the connection.
+        """
+        stats = {"steps": 0, "pages": 0, "busy_steps": 0, "restarts": 0, "lock_wait": 0.0}
+        last_remaining = None
+
+        def on_step(status, remaining, total):
+            nonlocal last_remaining
+            stats["steps"] += 1
+            if status in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+                stats["busy_steps"] += 1
+            if last_remaining is None or remaining > last_remaining:
+                if last_remaining is not None:
+                    # Written to by another connection: the copy started over
+                    stats["restarts"] += 1
+                stats["pages"] += total - remaining
+            else:
+                stats["pages"] += last_remaining - remaining
+            last_remaining = remaining
+
+            self._conn_lock.release()
+            try:
+                if progress is not None:
+                    progress(remaining, total)
+                if remaining and sleep > 0:
+                    time.sleep(sleep)
+            finally:
+                wait_start = time.perf_counter()
+                self._conn_lock.acquire()
+                stats["lock_wait"] += time.perf_counter() - wait_start
+
+        wait_start = time.perf_counter()
+        with self._get_connection() as conn:
+            stats["lock_wait"] += time.perf_counter() - wait_start
+            conn.backup(target, pages=pages, progress=on_step)
+        return stats
+
+
+    def close(self, checkpoint: bool = True) -> None:
+        """
+        Close the shared connection, first folding the WAL back into the
+        database with a TRUNCATE checkpoint so a restart starts clean.
+        """
+        with self._conn_lock:
+            if self._conn is None:
+                return
+            try:
+                if checkpoint:
+                    with DB_CHECKPOINT_DURATION.time():
+                        result = self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()
+                    logging.debug("Final WAL checkpoint: busy=%s, frames=%s, checkpointed=%s", *result)
+            except sqlite3.Error as e:
+                logging.warning(f"Final WAL checkpoint failed: {e}")
+            finally:
+                self._conn.close()
+                self._conn = None
+                self._cursor = None
+        logging.info("Database closed.")
 
 
     def get_all_labels(self):
@@ -275,12 +1014,7 @@ class Database:
             return 0
 
         try:
-            now = datetime.now()
-            year, month = divmod(now.month - months - 1, 12)
-            month += 1
-            year = now.year + year
-
-            cutoff_date = now.replace(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0)
+            cutoff_date = months_ago(months)
             cutoff_ts = int(cutoff_date.timestamp())
 
             deleted_count = 0
@@ -290,6 +1024,11 @@ class Database:
                 # Delete from readings
                 cursor.execute("DELETE FROM readings WHERE timestamp < ?", (cutoff_ts,))
                 deleted_count += cursor.rowcount
+
+                # Delete archived months, which start on month boundaries like the cutoff
+                cursor.execute("SELECT COALESCE(SUM(count), 0) FROM archive_chunks WHERE start_ts < ?", (cutoff_ts,))
+                deleted_count += cursor.fetchone()[0]
+                cursor.execute("DELETE FROM archive_chunks WHERE start_ts < ?", (cutoff_ts,))
                 
                 # Delete from energy_hourly
                 cursor.execute("DELETE FROM energy_hourly WHERE hour_start < ?", (cutoff_ts,))
@@ -309,6 +1048,90 @@ class Database:
             return 0
 
 
+    def archive_old_data(self, months: int, compression: str = ARCHIVE_COMPRESSION) -> int:
+        """
+        Move readings of closed months older than `months` into archive_chunks,
+        one compressed chunk per label and month. Only months whose hours are
+        all aggregated are archived. Readings that arrive later for an
+        archived month are merged into its chunk on the next run.
+
+        Args:
+            months: Number of months of readings to keep uncompressed.
+            compression: "zlib" or "lzma".
+
+        Returns:
+            Number of readings archived.
+        """
+        if months <= 0:
+            return 0
+
+        try:
+            cutoff_ts = int(months_ago(months).timestamp())
+            with self._get_connection() as conn:
+                last_hour = conn.execute("SELECT MAX(hour_start) FROM energy_hourly").fetchone()[0]
+                first = conn.execute("SELECT MIN(timestamp) FROM readings WHERE timestamp < ?",
+                                     (cutoff_ts,)).fetchone()[0]
+            if last_hour is None or first is None:
+                return 0
+            # Aggregation reads the readings table for hours not yet aggregated
+            cutoff_ts = min(cutoff_ts, last_hour + 3600)
+
+            archived = 0
+            start, end = archive.month_bounds(first)
+            while end <= cutoff_ts:
+                with self._get_connection() as conn:
+                    label_ids = [row[0] for row in conn.execute(
+                        "SELECT DISTINCT label_id FROM readings WHERE timestamp >= ? AND timestamp < ?", (start, end)
+                    ).fetchall()]
+                for label_id in label_ids:
+                    archived += self._archive_label_month(label_id, start, end, compression)
+                self._archived_until = max(self._archived_until, end)
+                start, end = archive.month_bounds(end)
+
+            if archived > 0:
+                with self._get_connection() as conn:
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                logging.info(f"Archived {archived} readings of months before "
+                             f"{datetime.fromtimestamp(start).strftime('%Y-%m-%d')}")
+            return archived
+        except Exception as e:
+            logging.error(f"Failed to archive old data: {e}")
+            return 0
+
+
+    def _archive_label_month(self, label_id: int, start: int, end: int, compression: str) -> int:
+        """Merge a label's readings in [start, end) into its chunk for that month. Returns the readings moved."""
+        with self._get_connection() as conn:
+            rows = conn.execute(ARCHIVE_READINGS_SQL, (label_id, start, end)).fetchall()
+            existing = conn.execute(
+                "SELECT codec, data FROM archive_chunks WHERE label_id = ? AND start_ts = ?", (label_id, start)
+            ).fetchone()
+        if not rows:
+            return 0
+        last_rowid = max(rowid for _, rowid, _ in rows)
+        chunk_rows = rows
+        if existing is not None:
+            chunk_rows = sorted(archive.decode_chunk(existing[1], existing[0]) + tuple(rows), key=lambda row: row[:2])
+        # Encoded without holding the connection, so ingest carries on meanwhile
+        data = archive.encode_chunk(chunk_rows, compression)
+
+        with self._get_connection() as conn:
+            try:
+                self._cursor.execute(archive.INSERT_CHUNK_SQL,
+                                     (label_id, start, end, len(chunk_rows), compression, data))
+                # Only the rows read above: later inserts have higher rowids
+                self._cursor.execute(
+                    "DELETE FROM readings WHERE label_id = ? AND timestamp >= ? AND timestamp < ? AND rowid <= ?",
+                    (label_id, start, end, last_rowid)
+                )
+                with DB_COMMIT_DURATION.time():
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return len(rows)
+
+
     # ---------------- Aggregation logic ----------------
     def fetch_hour_range_to_process(self, cursor: sqlite3.Cursor) -> Optional[int]:
         """
@@ -338,53 +1161,120 @@ class Database:
         return last_hour_done + 3600
 
 
+    def _fetch_kw(self, cursor: sqlite3.Cursor, which: str, *params) -> List[Tuple[int, float]]:
+        """
+        (timestamp, kW) rows of a KW_QUERIES range, converted in SQL unless
+        calibration overrides apply or the range reaches into the archive.
+        """
+        archived_until = self._archived_until
+        if archived_until and params[0] < archived_until:
+            return self._fetch_archived_kw(cursor, which, *params)
+
+        kw_sql, raw_sql = KW_QUERIES[which]
+        if SENSOR_CALIBRATION:
+            cursor.execute(raw_sql, params)
+            rows = [(timestamp, raw_to_kw(label, value)) for timestamp, label, value in cursor.fetchall()]
+        else:
+            cursor.execute(kw_sql, (POWER_FACTOR, MAINS_VOLTAGE) + params)
+            rows = cursor.fetchall()
+
+        if which == "previous" and archived_until and (not rows or rows[0][0] < archived_until):
+            # The reading before may be archived
+            return self._fetch_archived_kw(cursor, which, *params)
+        return rows
+
+
+    def _fetch_archived_kw(self, cursor: sqlite3.Cursor, which: str, *params) -> List[Tuple[int, float]]:
+        rows = ARCHIVE_READS[which](cursor, *params)
+        return [(timestamp, raw_to_kw(label, value)) for timestamp, label, value in rows]
+
+
+    def _fetch_hour_kw(self, cursor: sqlite3.Cursor, hour_start: int) -> List[Tuple[int, float]]:
+        """
+        Return (timestamp, kW) for all readings in [hour_start, hour_start+3600),
+        in the order aggregation integrates them.
+        """
+        return self._fetch_kw(cursor, "hour", hour_start, hour_start + 3600)
+
+
+    def get_hour_series(self, hour_start: int) -> List[Tuple[int, float]]:
+        """(timestamp, kW) readings of one hour, as used by aggregate_one_hour."""
+        try:
+            with self._get_connection() as conn:
+                return self._fetch_hour_kw(conn.cursor(), hour_start)
+        except Exception as e:
+            logging.error(f"Failed to fetch readings for hour {hour_start}: {e}")
+            return []
+
+
+    def get_last_aggregated_hour(self) -> Optional[int]:
+        """hour_start of the most recent row in energy_hourly, or None."""
+        try:
+            with self._get_connection() as conn:
+                row = conn.execute("SELECT MAX(hour_start) FROM energy_hourly").fetchone()
+                return int(row[0]) if row and row[0] is not None else None
+        except Exception as e:
+            logging.error(f"Failed to fetch last aggregated hour: {e}")
+            return None
+
+
+    def get_hourly_energy(self, start: int, end: int) -> List[Tuple[int, float]]:
+        """(hour_start, kWh) rows of energy_hourly in [start, end), oldest first."""
+        try:
+            with self._get_connection() as conn:
+                return conn.execute(
+                    "SELECT hour_start, kwh FROM energy_hourly WHERE hour_start >= ? AND hour_start < ? "
+                    "ORDER BY hour_start", (int(start), int(end))
+                ).fetchall()
+        except Exception as e:
+            logging.error(f"Failed to fetch hourly energy: {e}")
+            return []
+
+
     def aggregate_one_hour(self, cursor: sqlite3.Cursor, hour_start: int) -> Optional[float]:
         """
         Aggregate a single hour [hour_start, hour_start+3600) and return kwh inserted,
         or None if there were no readings in that hour.
         """
-        hour_end = hour_start + 3600
-
-        cursor.execute("""
-            SELECT timestamp,
-                   CASE
-                       WHEN labels.label LIKE 'efergy_h1%%' OR labels.label LIKE 'efergy_h2%%'
-                           THEN (? * ? * (readings.value / 1000.0)) / 1000.0
-                       WHEN labels.label LIKE 'efergy_h3%%'
-                           THEN (readings.value / 10.0) / 1000.0
-                       ELSE readings.value / 1000.0
-                   END AS kw
-            FROM readings
-            INNER JOIN labels ON labels.label_id = readings.label_id
-            WHERE timestamp >= ? AND timestamp < ?
-            ORDER BY timestamp ASC
-        """, (POWER_FACTOR, MAINS_VOLTAGE, hour_start, hour_end))
-
-        rows = cursor.fetchall()
+        rows = self._fetch_hour_kw(cursor, hour_start)
         if not rows:
             return None
 
-        kwh_total = 0.0
-        for i in range(len(rows) - 1):
-            ts, kw = rows[i]
-            next_ts = rows[i + 1][0]
-            interval_sec = next_ts - ts
-            kwh_total += kw * (interval_sec / 3600)
+        if ENERGY_INTEGRATION_SPLIT_HOURS:
+            # Include the intervals crossing into and out of this hour
+            rows = self._fetch_kw(cursor, "previous", hour_start) + rows
+            rows += self._fetch_kw(cursor, "next", hour_start + 3600)
 
-        # Last reading (assume same interval as previous)
-        if len(rows) > 1:
-            last_ts, last_kw = rows[-1]
-            interval_sec = rows[-1][0] - rows[-2][0]
-            kwh_total += last_kw * (interval_sec / 3600)
+        kwh_total = integrate_rows(rows, split_hours=ENERGY_INTEGRATION_SPLIT_HOURS)[hour_start]
 
         # Store hourly total
-        cursor.execute(
-            "INSERT OR REPLACE INTO energy_hourly(hour_start, kwh) VALUES (?, ?)",
-            (hour_start, kwh_total)
-        )
+        cursor.execute(INSERT_HOUR_SQL, (hour_start, kwh_total))
         return kwh_total
 
 
+    def replace_hours(self, hours: Dict[int, float], start: int, end: int) -> int:
+        """
+        Replace energy_hourly rows in [start, end) with `hours` in one
+        transaction. Hours in the range missing from `hours` are deleted.
+        Raises on failure.
+
+        Returns:
+            The number of rows written.
+        """
+        rows = sorted((hour_start, kwh) for hour_start, kwh in hours.items() if start <= hour_start < end)
+        with self._get_connection() as conn:
+            cursor = self._cursor
+            try:
+                cursor.execute("DELETE FROM energy_hourly WHERE hour_start >= ? AND hour_start < ?", (start, end))
+                cursor.executemany(INSERT_HOUR_SQL, rows)
+                with DB_COMMIT_DURATION.time():
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return len(rows)
+
+
     def aggregate_hours(self, limit_hours: int = 1000) -> int:
         """
         Aggregate up to `limit_hours` past unprocessed full hours.
@@ -394,9 +1284,13 @@ class Database:
         now = int(time.time())
         processed = 0
 
+        if self._journal is not None:
+            # Commit journaled readings first so closed hours are complete
+            self._journal.drain()
+
         try:
             with self._get_connection() as conn:
-                cursor = conn.cursor()
+                cursor = self._cursor
 
                 next_hour = self.fetch_hour_range_to_process(cursor)
                 if next_hour is None:
@@ -407,16 +1301,14 @@ class Database:
 
                 while next_hour + 3600 <= cutoff and processed < limit_hours:
                     # If an entry already exists (defensive), skip
-                    cursor.execute(
-                        "SELECT 1 FROM energy_hourly WHERE hour_start = ?",
-                        (next_hour,)
-                    )
+                    cursor.execute(HOUR_EXISTS_SQL, (next_hour,))
                     if cursor.fetchone():
                         next_hour += 3600
                         continue
 
                     # Do the work for this hour
-                    kwh = self.aggregate_one_hour(cursor, next_hour)
+                    with AGGREGATION_HOUR_DURATION.time():
+                        kwh = self.aggregate_one_hour(cursor, next_hour)
 
                     if kwh is not None:
                         readable = time.strftime('%Y-%m-%d %H:%M', time.localtime(next_hour))
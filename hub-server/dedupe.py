@@ -0,0 +1,149 @@
+"""
+Deduplication of retried hub posts.
+
+Hubs resend a post when the connection through the SSLv3 proxy fails
+before they see the response, so the server may already have stored it.
+A retry repeats every sensor line unchanged. IngestDeduper remembers the
+(hub, sensor, line) keys seen in the last DEDUPE_WINDOW seconds and drops
+lines whose key it has seen, before they are stored, integrated or
+published.
+
+The key is the whole sensor line, value included: the field after the
+sensor id is a constant `1` in real posts (`741459|1|EFCT|P1,2479.98`), so
+it alone would drop every repeated post. Even the whole line can't tell a
+retry from an unchanged reading posted again, which is why deduplication is
+off unless DEDUPE_WINDOW is set.
+
+The in-memory set is insertion ordered, so expiring old keys and capping it
+at DEDUPE_MAX_KEYS are O(1) per line. New keys are flushed periodically to
+the ingest_keys table and loaded back at startup, so a retry straddling a
+restart is usually still caught. The table only remembers keys; it does
+not constrain the readings table, so a retry whose key wasn't flushed, or
+one handled by another ingest worker, is stored again.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from config import DEDUPE_MAX_KEYS, DEDUPE_WINDOW
+from storage import StorageBackend
+from metrics import Counter
+
+INGEST_DUPLICATES = Counter(
+    "efergy_ingest_duplicates_total", "Sensor lines dropped as retried duplicates.", ["hub_version"]
+)
+
+# Seconds between flushes of new keys to the database
+FLUSH_INTERVAL = 30
+
+
+class IngestDeduper:
+    """
+    Args:
+        database: Where keys are flushed and loaded from, None keeps them in
+            memory only.
+        window: Seconds a key is remembered, 0 disables deduplication.
+        max_keys: Max keys kept in memory; the oldest are evicted first.
+        flush_interval: Seconds between flushes to the database.
+    """
+
+    def __init__(self, database: Optional[StorageBackend] = None, window: int = DEDUPE_WINDOW,
+                 max_keys: int = DEDUPE_MAX_KEYS, flush_interval: float = FLUSH_INTERVAL):
+        self.database = database
+        self.window = window
+        self.max_keys = max_keys
+        self.flush_interval = flush_interval
+        # (hub, label, line) -> first-seen timestamp, oldest first
+        self._keys: "OrderedDict[Tuple[str, str, str], int]" = OrderedDict()
+        self._pending: List[Tuple[str, str, str, int]] = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _expire(self, now: int):
+        keys = self._keys
+        cutoff = now - self.window
+        while keys:
+            key, timestamp = next(iter(keys.items()))
+            if timestamp >= cutoff:
+                break
+            keys.popitem(last=False)
+
+    def is_duplicate(self, hub: str, label: str, line: Optional[str], timestamp: int) -> bool:
+        """
+        Record the key of a sensor line.
+
+        Returns:
+            True if the same hub posted the same line for `label` within
+            the window, i.e. the line is a retry and should be dropped.
+            Empty lines are never duplicates.
+        """
+        if not self.window or not line:
+            return False
+        key = (hub, label, line)
+        with self._lock:
+            self._expire(timestamp)
+            if key in self._keys:
+                return True
+            self._keys[key] = timestamp
+            self._pending.append((hub, label, line, timestamp))
+            if len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+        return False
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def load_from_database(self):
+        """Restore the keys of the last window from the database."""
+        if self.database is None or not self.window:
+            return
+        rows = self.database.get_ingest_keys(int(time.time()) - self.window)
+        with self._lock:
+            # Older than any line seen since startup, so they go first and are evicted first
+            for hub, label, line, timestamp in reversed(rows[-self.max_keys:]):
+                key = (hub, label, line)
+                if key not in self._keys:
+                    self._keys[key] = timestamp
+                    self._keys.move_to_end(key, last=False)
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+        logging.debug(f"Loaded {len(rows)} recent ingest keys")
+
+    def flush(self) -> int:
+        """Write keys seen since the last flush and prune expired ones. Returns the number written."""
+        if self.database is None or not self.window:
+            return 0
+        with self._lock:
+            pending, self._pending = self._pending, []
+        try:
+            return self.database.save_ingest_keys(pending, int(time.time()) - self.window)
+        except Exception:
+            # Retried with the next flush
+            with self._lock:
+                self._pending[:0] = pending
+            raise
+
+    def flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("Unhandled exception flushing ingest keys")
+        logging.debug("Ingest key flush thread stopping")
+
+    def start(self):
+        if self.database is None or not self.window or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.flush_loop, name='ingest-keys', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread and flush the remaining keys."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
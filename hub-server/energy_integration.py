@@ -0,0 +1,261 @@
+"""
+Energy integration engine: kW samples to kWh per hour.
+
+`integrate_hours` turns a time-ordered (timestamp, kW) series into kWh per
+hour_start. The default settings reproduce Database.aggregate_one_hour
+exactly: each hour on its own, left Riemann sum, the last sample extended by
+the previous interval. Options:
+
+- method "trapezoid" averages the two ends of each interval instead of
+  holding the left value.
+- max_gap caps how many seconds a sample is held, so a sensor that went
+  offline isn't extrapolated across the outage. Capped intervals hold the
+  left value whatever the method.
+- split_hours integrates the series continuously and splits intervals that
+  cross an hour boundary between the hours, instead of treating each hour
+  on its own. The last sample of the series is still extended by the
+  previous interval.
+
+The series is every sensor's readings interleaved by timestamp, not one
+array per label: that is how aggregate_one_hour has always integrated an
+hour (each reading held until the next reading of any sensor), and stored
+hours, the live total and reaggregate.py have to keep agreeing with it.
+Integrating per label and summing would change every hour's kWh.
+
+With NumPy installed the per-interval arithmetic is vectorized; otherwise a
+pure-Python loop is used. Both compute every term with the same float
+operations and add them up sequentially in time order, so they return
+bit-identical results (and match the running sums of LiveEnergyIntegrator).
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+from config import ENERGY_INTEGRATION_METHOD, ENERGY_INTEGRATION_MAX_GAP, ENERGY_INTEGRATION_SPLIT_HOURS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAS_NUMPY = np is not None
+
+METHODS = ("left", "trapezoid")
+
+
+def _check_method(method: str):
+    if method not in METHODS:
+        raise ValueError(f"Unknown integration method '{method}', expected one of {', '.join(METHODS)}")
+
+
+def interval_kwh(kw: float, next_kw: float, seconds: int, method: str = ENERGY_INTEGRATION_METHOD,
+                 max_gap: int = ENERGY_INTEGRATION_MAX_GAP) -> float:
+    """
+    kWh of one closed interval between two samples of the same hour, as
+    integrate_hours computes it without split_hours.
+    """
+    if max_gap and seconds > max_gap:
+        return kw * (max_gap / 3600)
+    if method == "trapezoid":
+        return ((kw + next_kw) / 2) * (seconds / 3600)
+    return kw * (seconds / 3600)
+
+
+def _split_parts(start: int, kw: float, next_kw: float, seconds: int, capped: bool,
+                 method: str) -> List[Tuple[int, float]]:
+    """
+    Split the interval [start, start+seconds) at hour boundaries.
+    Returns (hour_start, kWh) per hour touched, in time order.
+    """
+    end = start + seconds
+    parts = []
+    a = start
+    kw_a = kw
+    while a < end:
+        hour = a - (a % 3600)
+        b = min(hour + 3600, end)
+        if method == "trapezoid" and not capped:
+            kw_b = next_kw if b == end else kw + (next_kw - kw) * ((b - start) / seconds)
+            parts.append((hour, ((kw_a + kw_b) / 2) * ((b - a) / 3600)))
+            kw_a = kw_b
+        else:
+            parts.append((hour, kw * ((b - a) / 3600)))
+        a = b
+    return parts
+
+
+def _add_sequential(totals: Dict[int, float], hour: int, kwh: float):
+    if hour in totals:
+        totals[hour] += kwh
+    else:
+        totals[hour] = kwh
+
+
+# ---------------- Pure Python ----------------
+def _integrate_python(timestamps: Sequence[int], kw: Sequence[float], method: str, max_gap: int,
+                      split_hours: bool) -> Dict[int, float]:
+    totals: Dict[int, float] = {}
+    n = len(timestamps)
+
+    if not split_hours:
+        start = 0
+        while start < n:
+            hour = timestamps[start] - (timestamps[start] % 3600)
+            end = start
+            while end < n and timestamps[end] - (timestamps[end] % 3600) == hour:
+                end += 1
+
+            kwh = 0.0
+            for i in range(start, end - 1):
+                kwh += interval_kwh(kw[i], kw[i + 1], timestamps[i + 1] - timestamps[i], method, max_gap)
+            if end - start > 1:
+                # Last reading (assume same interval as previous)
+                last_interval = timestamps[end - 1] - timestamps[end - 2]
+                kwh += interval_kwh(kw[end - 1], kw[end - 1], last_interval, "left", max_gap)
+            totals[hour] = kwh
+            start = end
+        return totals
+
+    for i in range(n):
+        if i < n - 1:
+            seconds = timestamps[i + 1] - timestamps[i]
+            next_kw = kw[i + 1]
+        elif n > 1:
+            # Last reading of the series, held for the previous interval
+            seconds = timestamps[i] - timestamps[i - 1]
+            next_kw = kw[i]
+        else:
+            seconds = 0
+            next_kw = kw[i]
+        capped = bool(max_gap) and seconds > max_gap
+        if capped:
+            seconds = max_gap
+        if i == n - 1:
+            capped = True
+
+        hour = timestamps[i] - (timestamps[i] % 3600)
+        if seconds == 0:
+            _add_sequential(totals, hour, 0.0)
+            continue
+        for part_hour, kwh in _split_parts(timestamps[i], kw[i], next_kw, seconds, capped, method):
+            _add_sequential(totals, part_hour, kwh)
+    return totals
+
+
+# ---------------- NumPy ----------------
+def _sequential_sum(values) -> float:
+    """Left-to-right sum; np.cumsum accumulates strictly in order, unlike np.sum."""
+    return float(np.cumsum(values)[-1]) if len(values) else 0.0
+
+
+def _integrate_numpy(timestamps, kw, method: str, max_gap: int, split_hours: bool) -> Dict[int, float]:
+    ts = np.asarray(timestamps, dtype=np.int64)
+    kw = np.asarray(kw, dtype=np.float64)
+    n = len(ts)
+    hours = ts - ts % 3600
+
+    if not split_hours:
+        totals = {}
+        # Hours are contiguous in a sorted series
+        bounds = np.flatnonzero(np.diff(hours)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [n]))
+
+        seconds = np.diff(ts)
+        capped = seconds > max_gap if max_gap else np.zeros(n - 1, dtype=bool)
+        if method == "trapezoid":
+            terms = ((kw[:-1] + kw[1:]) / 2) * (seconds / 3600)
+        else:
+            terms = kw[:-1] * (seconds / 3600)
+        if max_gap:
+            terms[capped] = kw[:-1][capped] * (max_gap / 3600)
+
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            if end - start < 2:
+                totals[int(hours[start])] = 0.0
+                continue
+            last_interval = int(ts[end - 1] - ts[end - 2])
+            extension = interval_kwh(float(kw[end - 1]), float(kw[end - 1]), last_interval, "left", max_gap)
+            # Intervals start..end-2 stay inside the hour; the one leaving it is dropped
+            totals[int(hours[start])] = _sequential_sum(np.append(terms[start:end - 1], extension))
+        return totals
+
+    # Continuous series: interval i is [ts[i], ts[i] + seconds[i]), the last one held
+    seconds = np.empty(n, dtype=np.int64)
+    seconds[:-1] = np.diff(ts)
+    seconds[-1] = ts[-1] - ts[-2] if n > 1 else 0
+    next_kw = np.empty(n, dtype=np.float64)
+    next_kw[:-1] = kw[1:]
+    next_kw[-1] = kw[-1]
+    capped = seconds > max_gap if max_gap else np.zeros(n, dtype=bool)
+    if max_gap:
+        seconds = np.minimum(seconds, max_gap)
+    capped[-1] = True
+
+    if method == "trapezoid":
+        terms = np.where(capped, kw, (kw + next_kw) / 2) * (seconds / 3600)
+    else:
+        terms = kw * (seconds / 3600)
+
+    interval_ends = ts + seconds - 1
+    crossing = np.flatnonzero((seconds > 0) & (interval_ends - interval_ends % 3600 > hours))
+
+    # Parts of crossing intervals that fall in later hours, added to the front of those hours
+    carried: Dict[int, List[float]] = {}
+    for i in crossing.tolist():
+        parts = _split_parts(int(ts[i]), float(kw[i]), float(next_kw[i]), int(seconds[i]), bool(capped[i]), method)
+        terms[i] = parts[0][1]
+        for hour, kwh in parts[1:]:
+            carried.setdefault(hour, []).append(kwh)
+
+    bounds = np.flatnonzero(np.diff(hours)) + 1
+    starts = np.concatenate(([0], bounds)).tolist()
+    ends = np.concatenate((bounds, [n])).tolist()
+    own = {int(hours[start]): (start, end) for start, end in zip(starts, ends)}
+
+    totals = {}
+    for hour in sorted(set(own) | set(carried)):
+        values = carried.get(hour, [])
+        if hour in own:
+            start, end = own[hour]
+            values = np.concatenate((np.asarray(values, dtype=np.float64), terms[start:end]))
+        totals[hour] = _sequential_sum(np.asarray(values, dtype=np.float64))
+    return totals
+
+
+def integrate_hours(timestamps: Sequence[int], kw: Sequence[float], method: str = ENERGY_INTEGRATION_METHOD,
+                    max_gap: int = ENERGY_INTEGRATION_MAX_GAP, split_hours: bool = ENERGY_INTEGRATION_SPLIT_HOURS,
+                    use_numpy: Optional[bool] = None) -> Dict[int, float]:
+    """
+    Integrate a kW series into kWh per hour.
+
+    Args:
+        timestamps: Sample times in epoch seconds, ascending.
+        kw: Power in kW at each timestamp.
+        method: "left" or "trapezoid".
+        max_gap: Hold a sample for at most this many seconds, 0 for no cap.
+        split_hours: Integrate across hour boundaries, splitting intervals.
+        use_numpy: Force the NumPy (True) or pure-Python (False) path;
+            None uses NumPy when it is installed.
+
+    Returns:
+        {hour_start: kWh} for every hour with a sample or part of an interval.
+    """
+    _check_method(method)
+    if len(timestamps) != len(kw):
+        raise ValueError("timestamps and kw must have the same length")
+    if not len(timestamps):
+        return {}
+
+    if use_numpy is None:
+        use_numpy = HAS_NUMPY
+    if use_numpy:
+        if not HAS_NUMPY:
+            raise RuntimeError("NumPy is not installed")
+        return _integrate_numpy(timestamps, kw, method, max_gap, split_hours)
+    return _integrate_python(list(timestamps), list(kw), method, max_gap, split_hours)
+
+
+def integrate_rows(rows: Sequence[Tuple[int, float]], **options) -> Dict[int, float]:
+    """integrate_hours over (timestamp, kW) rows, as returned by Database.get_hour_series."""
+    if not rows:
+        return {}
+    timestamps, kw = zip(*rows)
+    return integrate_hours(timestamps, kw, **options)
@@ -0,0 +1,169 @@
+"""
+In-memory hot window of recent readings per sensor.
+
+Keeps the last HOT_WINDOW_MINUTES of (timestamp, value) per label in
+compact `array`-backed storage so recent-window questions ("average over
+the last 5 minutes", "peak in the last hour", energy so far this hour)
+are answered without touching SQLite.
+"""
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import HOT_WINDOW_MINUTES
+from database import raw_to_kw, raw_to_watts
+from storage import StorageBackend
+
+
+class _Series:
+    """Parallel timestamp/value arrays; entries before `head` are expired."""
+    __slots__ = ("timestamps", "values", "head")
+
+    def __init__(self):
+        self.timestamps = array("q")
+        self.values = array("d")
+        self.head = 0
+
+    def compact(self):
+        if self.head:
+            del self.timestamps[:self.head]
+            del self.values[:self.head]
+            self.head = 0
+
+
+class HotWindow:
+    """
+    Ring-buffer style store of recent readings.
+
+    Args:
+        window_sec: How many seconds of history to keep per label.
+    """
+
+    def __init__(self, window_sec: int = HOT_WINDOW_MINUTES * 60):
+        self.window_sec = window_sec
+        self._series: Dict[str, _Series] = {}
+        self._lock = threading.Lock()
+
+    def _trim(self, series: _Series, now: int):
+        cutoff = now - self.window_sec
+        timestamps = series.timestamps
+        head = series.head
+        while head < len(timestamps) and timestamps[head] < cutoff:
+            head += 1
+        series.head = head
+        # Compact once the expired prefix dominates, keeping appends amortized O(1)
+        if head > 64 and head * 2 > len(timestamps):
+            series.compact()
+
+    def add(self, label: str, timestamp: int, value: float):
+        """Append a reading. Out-of-order readings are inserted in place."""
+        timestamp = int(timestamp)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = _Series()
+
+            timestamps = series.timestamps
+            if not timestamps or timestamp >= timestamps[-1]:
+                timestamps.append(timestamp)
+                series.values.append(value)
+            else:
+                index = bisect_left(timestamps, timestamp, series.head)
+                timestamps.insert(index, timestamp)
+                series.values.insert(index, value)
+
+            self._trim(series, max(timestamp, timestamps[-1]))
+
+    def load(self, readings: Dict[str, Iterable[Tuple[int, float]]]):
+        """
+        Bulk load {label: [(timestamp, value), ...]} sorted by timestamp.
+        Readings added since startup are kept, and only loaded readings
+        older than a label's first one are put before them.
+        """
+        with self._lock:
+            for label, rows in readings.items():
+                series = self._series.get(label)
+                if series is None:
+                    series = self._series[label] = _Series()
+                if series.head < len(series.timestamps):
+                    first = series.timestamps[series.head]
+                    older = [(int(timestamp), value) for timestamp, value in rows if timestamp < first]
+                    series.compact()
+                    series.timestamps[0:0] = array("q", (timestamp for timestamp, _ in older))
+                    series.values[0:0] = array("d", (value for _, value in older))
+                    continue
+                for timestamp, value in rows:
+                    series.timestamps.append(int(timestamp))
+                    series.values.append(value)
+                if series.timestamps:
+                    self._trim(series, series.timestamps[-1])
+
+    def load_from_database(self, database: StorageBackend, now: Optional[int] = None) -> int:
+        """
+        Populate the window from the tail of `readings`.
+
+        Returns:
+            The number of readings loaded.
+        """
+        now = int(time.time()) if now is None else now
+        recent = database.get_recent_readings(now - self.window_sec)
+        self.load(recent)
+        count = sum(len(rows) for rows in recent.values())
+        logging.info(f"Hot window loaded {count} readings for {len(recent)} labels")
+        return count
+
+    def labels(self) -> List[str]:
+        return sorted(self._series)
+
+    def window(self, label: str, seconds: Optional[int] = None, now: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Return (timestamp, value) pairs for `label` from the last `seconds`
+        (the whole window if None), oldest first.
+        """
+        now = int(time.time()) if now is None else now
+        seconds = self.window_sec if seconds is None else min(seconds, self.window_sec)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                return []
+            start = bisect_left(series.timestamps, now - seconds, series.head)
+            return list(zip(series.timestamps[start:], series.values[start:]))
+
+    def stats(self, label: str, seconds: int, now: Optional[int] = None) -> Optional[dict]:
+        """
+        Summary of `label` over the last `seconds`, in watts, or None if there
+        are no readings in that window.
+        """
+        rows = self.window(label, seconds, now)
+        if not rows:
+            return None
+
+        values = [value for _, value in rows]
+        return {
+            "count": len(values),
+            "average_watts": raw_to_watts(label, sum(values) / len(values)),
+            "peak_watts": raw_to_watts(label, max(values)),
+            "min_watts": raw_to_watts(label, min(values)),
+            "latest_watts": raw_to_watts(label, values[-1]),
+            "latest_timestamp": rows[-1][0],
+        }
+
+    def partial_hour_energy(self, label: str, now: Optional[int] = None) -> float:
+        """
+        kWh for `label` so far in the current hour, integrated the same way as
+        Database.aggregate_one_hour (left Riemann sum, last sample extended
+        by the previous interval).
+        """
+        now = int(time.time()) if now is None else now
+        hour_start = now - (now % 3600)
+        rows = self.window(label, now - hour_start + 1, now)
+        rows = [row for row in rows if hour_start <= row[0] < hour_start + 3600]
+
+        kwh = 0.0
+        for (ts, value), (next_ts, _) in zip(rows, rows[1:]):
+            kwh += raw_to_kw(label, value) * ((next_ts - ts) / 3600)
+        if len(rows) > 1:
+            kwh += raw_to_kw(label, rows[-1][1]) * ((rows[-1][0] - rows[-2][0]) / 3600)
+        return kwh
@@ -4,45 +4,257 @@ A fake Efergy sensor data server, updated for Python 3.
 This server emulates the sensornet.info API endpoints for an
 Efergy hub, logging incoming sensor data to a sqlite database.
 """
+import functools
+import ipaddress
+import itertools
+import json
 import logging
+import os
 import socket
+import socketserver
+import stat
 import sys
+import threading
+import time
 from http.server import HTTPServer, SimpleHTTPRequestHandler
-from typing import Type
+from typing import Iterable, Optional, Type, Union
 from urllib.parse import urlparse, parse_qs
 from pathlib import Path
 from database import Database
+from storage import StorageBackend, open_storage
+from dedupe import INGEST_DUPLICATES, IngestDeduper
 from mqtt_manager import MQTTManager
 from aggregator import Aggregator
 from payload_parser import parse_sensor_payload
+from packet_capture import UnknownPacketCapture
+from hot_window import HotWindow
+from live_energy import LiveEnergyIntegrator, LiveEnergyPublisher, live_energy_enabled
+from liveness import LivenessMonitor, LivenessRegistry, hub_id_from_host
+from journal import IngestJournal
+from maintenance import DatabaseMaintenance
+from backup import scheduler_from_config
+from stream import STREAM_CLIENTS, ReadingStream, start_stream_server
+from shutdown import ShutdownSequence, stop_http_server, wait_for_shutdown_signal
+from startup import StartupStatus, run_in_background
+from metrics import HTTP_REQUEST_DURATION, MQTT_QUEUE_DEPTH, SENSORS_ONLINE, record_reading, start_metrics_server
 from __version__ import __version__
 from config import (
-    SERVER_PORT, LOG_LEVEL, MQTT_ENABLED, HA_DISCOVERY, ENERGY_MONTHLY_RESET, HISTORY_RETENTION_MONTHS, SQLITE_TIMEOUT,
-    SQLITE_RETRIES, SQLITE_RETRY_DELAY, POWER_VALUE_TEMPLATE_H1, POWER_UNIT_OF_MEASUREMENT_H1, POWER_VALUE_TEMPLATE_H2,
+    SERVER_PORT, SERVER_UNIX_SOCKET, SERVER_IDLE_TIMEOUT, SHUTDOWN_TIMEOUT, LOG_LEVEL, DEBUG_SAMPLE_RATE,
+    METRICS_ENABLED, METRICS_PORT, STREAM_ENABLED, STREAM_PORT, LIVE_ENERGY_INTERVAL, INGEST_WORKERS, JOURNAL_FILE,
+    MQTT_ENABLED, HA_DISCOVERY, ENERGY_MONTHLY_RESET, HISTORY_RETENTION_MONTHS, STORAGE_BACKEND,
+    ARCHIVE_AFTER_MONTHS, ARCHIVE_COMPRESSION, BACKUP_DIR, BACKUP_INTERVAL, BACKUP_KEEP,
+    SQLITE_TIMEOUT, SQLITE_PROFILE, SQLITE_RETRIES, SQLITE_RETRY_DELAY, TRUSTED_PROXIES,
+    POWER_VALUE_TEMPLATE_H1, POWER_UNIT_OF_MEASUREMENT_H1, POWER_VALUE_TEMPLATE_H2,
     POWER_UNIT_OF_MEASUREMENT_H2, POWER_VALUE_TEMPLATE_H3, POWER_UNIT_OF_MEASUREMENT_H3, ENERGY_VALUE_TEMPLATE,
     ENERGY_UNIT_OF_MEASUREMENT
 )
 
-class EfergyHTTPServer(HTTPServer):
+# Permissions of the Unix socket, so a proxy running as another user can connect
+UNIX_SOCKET_MODE = 0o666
+
+
+def remove_stale_socket(path: str):
+    """Remove a Unix socket left behind by a previous run; anything else at `path` is left alone."""
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def bind_unix_socket(path: str, backlog: int = 128) -> socket.socket:
+    """A listening Unix domain socket at `path`, replacing a stale one."""
+    remove_stale_socket(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+        os.chmod(path, UNIX_SOCKET_MODE)
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def describe_address(address: Union[str, tuple]) -> str:
+    """A server address for log messages."""
+    if isinstance(address, str):
+        return f"Unix socket {address}"
+    host, port = address[:2]
+    return f"{host} port {port}"
+
+
+@functools.lru_cache(maxsize=8)
+def _proxy_networks(proxies: str) -> tuple:
+    return tuple(
+        entry if entry == "unix" else ipaddress.ip_network(entry, strict=False)
+        for entry in (part.strip() for part in proxies.split(",")) if entry
+    )
+
+
+def is_trusted_proxy(peer: str, proxies: Optional[str] = None) -> bool:
+    """
+    Whether `peer`, a client address or "unix", is one of `proxies`
+    (TRUSTED_PROXIES by default).
+    """
+    networks = _proxy_networks(TRUSTED_PROXIES if proxies is None else proxies)
+    if peer == "unix":
+        return "unix" in networks
+    try:
+        address = ipaddress.ip_address(peer)
+    except ValueError:
+        return False
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return any(not isinstance(network, str) and address in network for network in networks)
+
+
+class EfergyHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
     """
     A custom HTTPServer subclass that holds the database instance.
     This allows the request handler to access the database instance
     via `self.server.database`.
+
+    Each connection is handled on its own thread, so a proxy can keep a pool
+    of persistent upstream connections open without an idle one holding up
+    the rest. A str `server_address` listens on a Unix domain socket at that
+    path instead of TCP.
     """
+    daemon_threads = True
+    # Seconds server_close waits for requests in flight
+    drain_timeout = SHUTDOWN_TIMEOUT
+
     def __init__(self,
-                 server_address: tuple[str, int],
+                 server_address: Union[tuple[str, int], str],
                  request_handler_class: Type[SimpleHTTPRequestHandler],
-                 database: Database,
+                 database: StorageBackend,
                  mqtt_manager: MQTTManager,
-                 bind_and_activate: bool = True):
+                 bind_and_activate: bool = True,
+                 unknown_packets: Optional[UnknownPacketCapture] = None,
+                 hot_window: Optional[HotWindow] = None,
+                 live_energy: Optional[LiveEnergyIntegrator] = None,
+                 startup: Optional[StartupStatus] = None,
+                 liveness: Optional[LivenessRegistry] = None,
+                 deduper: Optional[IngestDeduper] = None,
+                 stream: Optional[ReadingStream] = None):
 
         # Store the database instance *before* calling super_init
         # so it's available if the handler needs it during init.
         self.database = database
         self.mqtt_manager = mqtt_manager
         self.published_discovery = set()
+        self.debug_sample_rate = DEBUG_SAMPLE_RATE
+        self.request_counter = itertools.count(1)
+        self.unknown_packets = unknown_packets or UnknownPacketCapture()
+        self.hot_window = hot_window if hot_window is not None else HotWindow()
+        self.live_energy = live_energy
+        self.startup = startup
+        self.liveness = liveness if liveness is not None else LivenessRegistry()
+        self.deduper = deduper if deduper is not None else IngestDeduper()
+        self.stream = stream
+        # Posts are handled concurrently and share whole-second timestamps, so storing a
+        # reading and adding it to the live total happen under one lock to keep the
+        # live integration in the database's rowid order
+        self.ingest_lock = threading.Lock()
+        # Open connections -> True while a request is being handled
+        self._connections = {}
+        self._connections_changed = threading.Condition()
+        self._closing = False
+        self._owns_socket_file = False
+        if isinstance(server_address, str):
+            self.address_family = socket.AF_UNIX
         super().__init__(server_address, request_handler_class, bind_and_activate)
 
+    def server_bind(self):
+        if self.address_family != socket.AF_UNIX:
+            super().server_bind()
+            return
+        remove_stale_socket(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        os.chmod(self.server_address, UNIX_SOCKET_MODE)
+        self._owns_socket_file = True
+        self.server_name = self.server_address
+        self.server_port = 0
+
+    def get_request(self):
+        request, client_address = super().get_request()
+        if self.address_family == socket.AF_UNIX:
+            # Unix peers have no address; the handler expects (host, port)
+            client_address = ("unix", 0)
+        else:
+            # Headers and body are separate writes; with Nagle's algorithm the body
+            # of a response on a kept-alive connection waits for the delayed ACK
+            request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+        return request, client_address
+
+    def connection_busy(self, handler):
+        """A request has arrived on `handler`'s connection."""
+        with self._connections_changed:
+            self._connections[handler] = True
+
+    def connection_idle(self, handler) -> bool:
+        """
+        `handler`'s connection is waiting for its next request.
+
+        Returns:
+            False if the server is closing, so the connection should be
+            closed rather than kept alive.
+        """
+        with self._connections_changed:
+            if self._closing:
+                self._connections.pop(handler, None)
+                self._connections_changed.notify_all()
+                return False
+            self._connections[handler] = False
+            self._connections_changed.notify_all()
+            return True
+
+    def connection_closed(self, handler):
+        with self._connections_changed:
+            self._connections.pop(handler, None)
+            self._connections_changed.notify_all()
+
+    def open_connections(self) -> int:
+        return len(self._connections)
+
+    def close_idle_connections(self, timeout: float = 0) -> bool:
+        """
+        Stop keeping connections alive: close the idle ones now and the busy
+        ones once their response is sent, waiting up to `timeout` seconds
+        for those.
+
+        Returns:
+            True if no request was still in flight.
+        """
+        deadline = time.monotonic() + timeout
+        with self._connections_changed:
+            self._closing = True
+            idle = [handler for handler, busy in self._connections.items() if not busy]
+            for handler in idle:
+                del self._connections[handler]
+        for handler in idle:
+            try:
+                # Wakes the handler thread blocked reading the next request
+                handler.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        with self._connections_changed:
+            while any(self._connections.values()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._connections_changed.wait(remaining)
+        return True
+
+    def server_close(self):
+        """Close the listening socket after draining requests in flight."""
+        if not self.close_idle_connections(self.drain_timeout):
+            logging.warning(f"Requests still in flight after {self.drain_timeout}s, closing anyway")
+        super().server_close()
+        if self._owns_socket_file:
+            self._owns_socket_file = False
+            remove_stale_socket(self.server_address)
+
 
 class FakeEfergyServer(SimpleHTTPRequestHandler):
     """
@@ -53,25 +265,131 @@ class FakeEfergyServer(SimpleHTTPRequestHandler):
     """
     protocol_version = "HTTP/1.1"
     server: "EfergyHTTPServer"
+    # Seconds a kept-alive connection may wait for its next request
+    timeout = SERVER_IDLE_TIMEOUT or None
+
+    def setup(self):
+        super().setup()
+        self.server.connection_idle(self)
+
+    def parse_request(self) -> bool:
+        # The request line has arrived, so the connection is no longer idle
+        self.server.connection_busy(self)
+        return super().parse_request()
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        if not self.server.connection_idle(self):
+            self.close_connection = True
+
+    def finish(self):
+        self.server.connection_closed(self)
+        super().finish()
+
+    # Paths reported individually in request metrics, anything else is "other"
+    METRIC_PATHS = {"/h2", "/h3", "/recjson", "/get_key.html", "/check_key.html"}
+
+    def _metrics_path(self) -> str:
+        if self.headers.get("Content-Type") == "application/eh-ping":
+            return "eh-ping"
+        path = self.path.split("?", 1)[0]
+        return path if path in self.METRIC_PATHS or path in self.API_ROUTES else "other"
+
+    # Read-only JSON API, path -> handler method name
+    API_ROUTES = {
+        "/api/latest": "_api_latest",
+        "/api/recent": "_api_recent",
+        "/api/ready": "_api_ready",
+        "/api/liveness": "_api_liveness",
+    }
+
+    def _api_latest(self, query: dict):
+        """Latest reading per label from memory, optionally filtered with ?label=."""
+        latest = self.server.database.get_latest_readings()
+        labels = query.get("label")
+        if labels:
+            latest = {label: latest[label] for label in labels if label in latest}
+        return 200, latest
+
+    def _api_ready(self, query: dict):
+        """Startup phases; 200 once all are done, 503 before."""
+        startup = self.server.startup
+        if startup is None:
+            return 200, {"ready": True, "phases": {}}
+        snapshot = startup.snapshot()
+        return (200 if snapshot["ready"] else 503), snapshot
+
+    def _api_liveness(self, query: dict):
+        """Last-seen state of every hub and sensor, optionally filtered with ?label=."""
+        snapshot = self.server.liveness.snapshot()
+        labels = query.get("label")
+        if labels:
+            sensors = snapshot["sensors"]
+            snapshot["sensors"] = {label: sensors[label] for label in labels if label in sensors}
+        return 200, snapshot
+
+    def _api_recent(self, query: dict):
+        """
+        Recent-window stats per label from the in-memory hot window.
+        ?seconds=N (default 300) and optional ?label= filters.
+        """
+        try:
+            seconds = int(query.get("seconds", ["300"])[0])
+        except ValueError:
+            return 400, {"error": "seconds must be an integer"}
+
+        hot_window = self.server.hot_window
+        now = int(time.time())
+        result = {}
+        for label in query.get("label") or hot_window.labels():
+            stats = hot_window.stats(label, seconds, now)
+            if stats is not None:
+                stats["hour_kwh"] = hot_window.partial_hour_energy(label, now)
+                result[label] = stats
+        return 200, {"seconds": seconds, "sensors": result}
+
+    # Level to log this request's full diagnostics at, None skips them
+    _detail_level: Optional[int] = None
+
+    def _begin_request(self):
+        """
+        Decide whether this request's diagnostics are logged, and at which level.
+
+        With DEBUG enabled every request is logged in full. Otherwise, if
+        DEBUG_SAMPLE_RATE is N > 0, every Nth request is logged in full at INFO
+        and the rest cost nothing beyond this check.
+        """
+        if logging.root.isEnabledFor(logging.DEBUG):
+            self._detail_level = logging.DEBUG
+        else:
+            rate = getattr(self.server, "debug_sample_rate", 0)
+            if rate and next(self.server.request_counter) % rate == 0:
+                self._detail_level = logging.INFO
+            else:
+                self._detail_level = None
+
+        if self._detail_level is not None:
+            self.log_request_info(self._detail_level)
 
-    def log_request_info(self):
-        """Helper to log request details using f-strings."""
-        parsed_url = urlparse(self.path)
-        query = parse_qs(parsed_url.query)
+    def log_request_info(self, level: int = logging.DEBUG):
+        """Helper to log request details. Formats eagerly, so callers decide whether to call it."""
+        query = parse_qs(urlparse(self.path).query)
         client_ip, client_port = self.client_address
 
-        logging.debug("=" * 80)
-        logging.debug(f">>> REQUEST: {self.command} {self.path}")
-        logging.debug(f">>> Query params: {query}")
-        logging.debug(f">>> Headers: {dict(self.headers)}")
-        logging.debug(f">>> Client: {client_ip}:{client_port}")
+        logging.log(level, "=" * 80)
+        logging.log(level, ">>> REQUEST: %s %s", self.command, self.path)
+        logging.log(level, ">>> Query params: %s", query)
+        logging.log(level, ">>> Headers: %s", dict(self.headers))
+        logging.log(level, ">>> Client: %s:%s", client_ip, client_port)
 
 
     def _send_response(self, code: int, content_bytes: bytes, content_type: str = "text/html; charset=UTF-8"):
         """Helper to send a complete response."""
         try:
-            response_preview = content_bytes.decode('utf-8', 'ignore')[:200] if content_bytes else ''
-            logging.debug(f"<<< RESPONSE: {code} | Length: {len(content_bytes)} | Content: {response_preview!r}")
+            if self._detail_level is not None:
+                response_preview = content_bytes[:200].decode('utf-8', 'ignore') if content_bytes else ''
+                logging.log(self._detail_level, "<<< RESPONSE: %s | Length: %d | Content: %r",
+                            code, len(content_bytes), response_preview)
 
             self.send_response(code)
             self.send_header("Content-Type", content_type)
@@ -82,51 +400,40 @@ class FakeEfergyServer(SimpleHTTPRequestHandler):
                 self.wfile.write(content_bytes)
                 self.wfile.flush()
             except (BrokenPipeError, ConnectionResetError, socket.error) as e:
-                logging.debug(
-                    f"Client disconnected while sending response "
-                    f"(BrokenPipe): {e} — path: {self.path}"
-                )
+                logging.debug("Client disconnected while sending response (BrokenPipe): %s — path: %s", e, self.path)
                 return
 
         except Exception as e:
             logging.error(f"Failed during response send: {e}")
 
 
+    def _read_capped_body(self, content_length: int, max_bytes: int) -> bytes:
+        """
+        Read a request body keeping at most `max_bytes`, discarding the rest
+        so the connection stays usable without buffering the whole body.
+        """
+        body = self.rfile.read(min(content_length, max_bytes))
+        remaining = content_length - len(body)
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 65536))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        return body
+
+
     def _handle_unknown_packet(self, post_data_bytes: bytes = None):
         try:
-            parsed_url = urlparse(self.path)
-            query = parse_qs(parsed_url.query)
+            capture = self.server.unknown_packets
             content_length = int(self.headers.get("Content-Length", 0))
 
             if post_data_bytes is None and content_length > 0:
-                post_data_bytes = self.rfile.read(content_length)
-
-            logging.warning("========== UNKNOWN PACKET ==========")
-            logging.warning("Method: %s", self.command)
-            logging.warning("Raw path: %s", self.path)
-            logging.warning("Path: %s", parsed_url.path)
-            logging.warning("Query: %s", query)
-            logging.warning("Content-Type: %s", self.headers.get("Content-Type"))
-            logging.warning("Content-Length: %d", content_length)
-            logging.warning("Headers: %s", dict(self.headers))
-
-            if not post_data_bytes:
-                logging.warning("No request body present")
-            else:
-                utf8 = post_data_bytes.decode("utf-8", "ignore")
-                hex_lines = []
-
-                for i in range(0, len(post_data_bytes), 16):
-                    chunk = post_data_bytes[i:i + 16]
-                    hex_bytes = " ".join(f"{b:02X}" for b in chunk)
-                    ascii_bytes = "".join(chr(b) if 32 <= b <= 126 else "." for b in chunk)
-                    hex_lines.append(f"{i:04X}  {hex_bytes:<48}  {ascii_bytes}")
-
-                logging.warning("Payload UTF8:\n%s", utf8)
-                logging.warning("Payload HEX:\n%s", "\n".join(hex_lines))
-
-            logging.warning("====================================")
+                post_data_bytes = self._read_capped_body(content_length, capture.max_bytes)
 
+            capture.record(
+                self._client_ip(), self.command, self.path, self.headers,
+                post_data_bytes or b"", content_length
+            )
 
         except Exception:
             logging.exception("Error in unknown HTTP handler")
@@ -136,11 +443,13 @@ class FakeEfergyServer(SimpleHTTPRequestHandler):
 
     def do_GET(self):
         """Handles GET requests for key checking."""
+        start = time.perf_counter()
         try:
-            self.log_request_info()
+            self._begin_request()
             parsed_url = urlparse(self.path)
 
             code = 200
+            content_type = "text/html; charset=UTF-8"
 
             if parsed_url.path == "/get_key.html":
                 content_bytes = b"TT|a1bCDEFGHa1zZ\n"
@@ -149,24 +458,32 @@ class FakeEfergyServer(SimpleHTTPRequestHandler):
                 # V2/V3 use: [MAC].[h2/h3].sensornet.info
                 host_header = self.headers.get("Host", "")
                 content_bytes = b"success"
-                logging.debug(f"Key check from: {host_header}")
+                logging.debug("Key check from: %s", host_header)
+            elif parsed_url.path in self.API_ROUTES:
+                handler = getattr(self, self.API_ROUTES[parsed_url.path])
+                code, payload = handler(parse_qs(parsed_url.query))
+                content_bytes = json.dumps(payload).encode("utf-8")
+                content_type = "application/json"
             else:
                 code = 404
                 content_bytes = b"Not Found"
                 self._handle_unknown_packet()
 
-            self._send_response(code, content_bytes)
+            self._send_response(code, content_bytes, content_type)
 
         except Exception as e:
             logging.error(f"Exception in GET: {e}")
             if not self.wfile.closed:
                 self._send_response(500, b"Internal Server Error")
+        finally:
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, self._metrics_path())
 
 
     def do_POST(self):
         """Handles POST requests with sensor data."""
+        start = time.perf_counter()
         try:
-            self.log_request_info()
+            self._begin_request()
             parsed_url = urlparse(self.path)
 
             content_length = int(self.headers.get("Content-Length", 0))
@@ -176,7 +493,8 @@ class FakeEfergyServer(SimpleHTTPRequestHandler):
                 return
 
             post_data_bytes = self.rfile.read(content_length)
-            logging.debug(f">>> POST body: {post_data_bytes.decode('utf-8', 'ignore')}")
+            if self._detail_level is not None:
+                logging.log(self._detail_level, ">>> POST body: %s", post_data_bytes.decode('utf-8', 'ignore'))
 
             db = getattr(self.server, "database", None)
             if not db:
@@ -187,7 +505,11 @@ class FakeEfergyServer(SimpleHTTPRequestHandler):
             content_type = self.headers.get("Content-Type", "")
             if content_type == "application/eh-ping":
                 sensor_ids = post_data_bytes.decode("utf-8").strip().split("|")
-                logging.debug(f"Received ping from sensors: {sensor_ids}")
+                logging.debug("Received ping from sensors: %s", sensor_ids)
+                hub_version = parsed_url.path.strip("/")
+                self.server.liveness.record_ping(
+                    self._hub_id(), hub_version if hub_version in ("h1", "h2", "h3") else None, sensor_ids
+                )
             elif parsed_url.path in ["/h2", "/h3"]:
                 hub_version = parsed_url.path.strip("/")
                 self.process_sensor_data(post_data_bytes, hub_version, db)
@@ -210,6 +532,8 @@ class FakeEfergyServer(SimpleHTTPRequestHandler):
             logging.error(f"Exception in POST: {e}")
             if not self.wfile.closed:
                 self._send_response(500, b"Internal Server Error")
+        finally:
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, self._metrics_path())
 
 
     def do_PUT(self):
@@ -247,33 +571,81 @@ class FakeEfergyServer(SimpleHTTPRequestHandler):
         self._send_response(200, b"success")
 
 
-    def process_sensor_data(self, post_data_bytes: bytes, hub_version: str, database: Database):
+    def _client_ip(self) -> str:
+        """The client's address, from X-Real-IP when the peer is a trusted proxy."""
+        peer = self.client_address[0]
+        real_ip = self.headers.get("X-Real-IP", "").strip()
+        if real_ip and is_trusted_proxy(peer):
+            return real_ip
+        return peer
+
+
+    def _hub_id(self) -> str:
+        """The posting hub's MAC from the Host header, else its address."""
+        return hub_id_from_host(self.headers.get("Host", ""), self._client_ip())
+
+
+    def process_sensor_data(self, post_data_bytes: bytes, hub_version: str, database: StorageBackend):
         """Parses and logs sensor data from the POST body."""
         parsed_results = parse_sensor_payload(post_data_bytes, hub_version)
+        level = self._detail_level
+        timestamp = int(time.time())
+        liveness = self.server.liveness
+        deduper = self.server.deduper
+        mqtt_manager = self.server.mqtt_manager
+        hub = self._hub_id()
+        liveness.record_post(hub, hub_version, timestamp)
+        # (label, sid, value) for the batched MQTT message
+        batch = []
 
         for data in parsed_results:
             try:
                 if data["type"] == "EFMS":
-                    sid = data["sid"]
-                    for key, num in data["metrics"]:
-                        logging.debug(f"[EFMS1] SID={sid}, Metric={key}, Value={num}")
-                    
-                    if data["rssi"] is not None:
-                        logging.debug(f"[EFMS1] SID={sid}, RSSI={data['rssi']}")
+                    if level is not None:
+                        sid = data["sid"]
+                        for key, num in data["metrics"]:
+                            logging.log(level, "[EFMS1] SID=%s, Metric=%s, Value=%s", sid, key, num)
+
+                        if data["rssi"] is not None:
+                            logging.log(level, "[EFMS1] SID=%s, RSSI=%s", sid, data["rssi"])
                 else:
                     sid = data["sid"]
                     label = data["label"]
                     value = data["value"]
-                    
-                    logging.debug(f"Logging sensor: {label}, raw: {value}")
-                    database.log_data(label, value)
+
+                    if deduper.is_duplicate(hub, label, data["line"], timestamp):
+                        INGEST_DUPLICATES.inc(hub_version)
+                        if level is not None:
+                            logging.log(level, "Dropping retried line: %s", data["line"])
+                        continue
+
+                    if level is not None:
+                        logging.log(level, "Logging sensor: %s, raw: %s", label, value)
+                    with self.server.ingest_lock:
+                        database.log_data(label, value, timestamp)
+                        record_reading(label, timestamp)
+                        self.server.hot_window.add(label, timestamp, value)
+                        if self.server.stream is not None:
+                            self.server.stream.publish(label, timestamp, value)
+                        if self.server.live_energy is not None:
+                            self.server.live_energy.add(label, timestamp, value)
 
                     # Publish power reading
-                    self.server.mqtt_manager.publish_power(label, sid, hub_version, value)
+                    if mqtt_manager.per_sensor_topics:
+                        mqtt_manager.publish_power(label, sid, hub_version, value)
+                    batch.append((label, sid, value))
+                    if liveness.record_reading(label, hub, hub_version, timestamp, value, data["rssi"]):
+                        mqtt_manager.publish_availability(label, True)
 
             except Exception as e:
                 logging.error(f"Unexpected error processing parsed data {data}: {e}")
 
+        # One message for the whole post in batched mode, a no-op otherwise
+        try:
+            mqtt_manager.publish_hub_power(hub, hub_version, batch, timestamp)
+        except Exception as e:
+            logging.error(f"Unexpected error publishing hub power for {hub}: {e}")
+
 
     def log_message(self, format, *args):
         """
@@ -282,40 +654,111 @@ class FakeEfergyServer(SimpleHTTPRequestHandler):
         return
 
 
-def run_server(database: Database, host: str = '0.0.0.0', port: int = 5000):
+def run_server(httpd: EfergyHTTPServer, journal: Optional[IngestJournal] = None,
+               startup: Optional[StartupStatus] = None, warmup: Iterable[tuple] = ()):
     """
-    Starts the HTTP server.
+    Serves on the already bound `httpd` and blocks until SIGTERM/SIGINT,
+    then shuts down in order: stop accepting and drain requests, flush the
+    journal, stop background threads, flush MQTT and checkpoint the database.
+
+    Requests are served straight away. The `warmup` phases, connecting to
+    MQTT, publishing startup discovery and catching up on missed hours then
+    run in the background and are reported as startup phases on /api/ready.
 
     Args:
-        database: The initialized Database instance.
-        host: The host address to bind to.
-        port: The port to listen on.
+        httpd: The bound server, holding the set-up database, MQTT manager,
+            hot window and live energy integrator.
+        journal: Opened ingest journal attached to the database, if any.
+        startup: Startup phases to report; the `warmup` phases, "mqtt",
+            "discovery" and "aggregation" are completed here.
+        warmup: (name, step) phases that load in-memory state while
+            requests are already being served, run before "mqtt".
     """
-    server_address = (host, port)
-
-    httpd = EfergyHTTPServer(
-        server_address,
-        FakeEfergyServer,
-        database=database,
-        mqtt_manager=mqtt_manager,
-    )
+    database = httpd.database
+    mqtt_manager = httpd.mqtt_manager
+    live_energy = httpd.live_energy
+    serve_thread = threading.Thread(target=httpd.serve_forever, name="http-server", daemon=True)
+    serve_thread.start()
+    logging.info(f"Serving HTTP on {describe_address(httpd.server_address)}...")
+
+    # Background services, stopped in reverse order on shutdown
+    services = []
+    if journal is not None:
+        journal.start()
+
+    if METRICS_ENABLED:
+        MQTT_QUEUE_DEPTH.set_function(mqtt_manager.queue_depth)
+        SENSORS_ONLINE.set_function(httpd.liveness.online_count)
+        if httpd.stream is not None:
+            STREAM_CLIENTS.set_function(httpd.stream.client_count)
+        try:
+            metrics_httpd = start_metrics_server(METRICS_PORT)
+            services.append(("stop metrics server", metrics_httpd.shutdown))
+        except OSError:
+            logging.exception(f"Failed to start metrics server on port {METRICS_PORT}")
 
-    logging.info(f"Serving HTTP on {host} port {port}...")
+    if httpd.stream is not None:
+        try:
+            stream_httpd = start_stream_server(httpd.stream, STREAM_PORT)
+            services.append(("disconnect stream clients", lambda: (httpd.stream.close(), stream_httpd.shutdown())))
+        except OSError:
+            logging.exception(f"Failed to start live stream server on port {STREAM_PORT}")
 
+    aggregator = Aggregator(database, mqtt_manager, live_energy=live_energy, startup=startup)
+    services.append(("stop aggregator", aggregator.stop))
     try:
-        aggregator = Aggregator(db_instance, mqtt_manager)
-        aggregator.start()
+        if isinstance(database, Database):
+            # WAL checkpoints and PRAGMA optimize
+            maintenance = DatabaseMaintenance(database)
+            maintenance.start()
+            services.append(("stop database maintenance", maintenance.stop))
+        backups = scheduler_from_config(database)
+        if backups is not None:
+            services.append(("stop backups", backups.stop))
+        httpd.deduper.start()
+        services.append(("flush ingest keys", httpd.deduper.stop))
+        liveness_monitor = LivenessMonitor(httpd.liveness, database, mqtt_manager)
+        liveness_monitor.start()
+        services.append(("checkpoint liveness", liveness_monitor.stop))
+        if live_energy is not None:
+            publisher = LiveEnergyPublisher(live_energy, mqtt_manager)
+            publisher.start()
+            services.append(("stop live energy publisher", publisher.stop))
     except Exception:
-        logging.exception("Failed to start aggregator thread")
-
-    # Publish startup discovery for all known sensors
-    mqtt_manager.publish_startup_discovery(database.get_all_labels())
-
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        logging.info("Server shutting down...")
-        httpd.server_close()
+        logging.exception("Failed to start background threads")
+
+    stopping = threading.Event()
+
+    def start_aggregator():
+        # After MQTT so the first pass publishes the caught-up energy total
+        if not stopping.is_set():
+            aggregator.start()
+
+    startup = startup or StartupStatus(["mqtt", "discovery", "aggregation"])
+    run_in_background(startup, [
+        *warmup,
+        ("mqtt", mqtt_manager.start),
+        # Publish startup discovery for all known sensors
+        ("discovery", lambda: mqtt_manager.publish_startup_discovery(
+            database.get_all_labels(), httpd.liveness.sensor_hubs()
+        )),
+    ], then=start_aggregator)
+
+    signal_name = wait_for_shutdown_signal()
+    stopping.set()
+    logging.info(f"Received {signal_name}, server shutting down...")
+
+    shutdown = ShutdownSequence()
+    shutdown.add("stop accepting and drain requests",
+                 lambda: stop_http_server(httpd, serve_thread, SHUTDOWN_TIMEOUT))
+    if journal is not None:
+        shutdown.add("flush journal", journal.stop)
+    for name, stop in reversed(services):
+        shutdown.add(name, stop)
+    shutdown.add("flush MQTT", mqtt_manager.stop)
+    shutdown.add("close unknown packet capture", httpd.unknown_packets.close)
+    shutdown.add("checkpoint and close database", database.close)
+    shutdown.run()
 
 
 if __name__ == '__main__':
@@ -332,13 +775,25 @@ if __name__ == '__main__':
     logging.info(f"  Version: {__version__}")
     logging.info("=" * 60)
     logging.info(f"  Python: {sys.version.split()[0]}")
-    logging.info(f"  Port: {SERVER_PORT}")
+    logging.info(f"  Listen: {f'unix:{SERVER_UNIX_SOCKET}' if SERVER_UNIX_SOCKET else f'port {SERVER_PORT}'}")
+    logging.info(f"  Idle timeout: {f'{SERVER_IDLE_TIMEOUT:g}s' if SERVER_IDLE_TIMEOUT > 0 else 'disabled'}")
     logging.info(f"  Logging level: {LOG_LEVEL}")
     logging.info(f"  MQTT: {'enabled' if MQTT_ENABLED else 'disabled'}")
     logging.info(f"  HA discovery: {'enabled' if HA_DISCOVERY else 'disabled'}")
     logging.info(f"  Monthly reset: {ENERGY_MONTHLY_RESET}")
+    logging.info(f"  Storage: {STORAGE_BACKEND}")
     logging.info(f"  Retention months: {HISTORY_RETENTION_MONTHS}")
+    logging.info(f"  Archive: {f'after {ARCHIVE_AFTER_MONTHS} months ({ARCHIVE_COMPRESSION})' if ARCHIVE_AFTER_MONTHS > 0 else 'disabled'}")
+    logging.info(f"  Backups: {f'{BACKUP_DIR} every {BACKUP_INTERVAL:g}s, keeping {BACKUP_KEEP}' if BACKUP_DIR else 'disabled'}")
+    logging.info(f"  SQLite profile: {SQLITE_PROFILE}")
+    logging.info(f"  Metrics: {f'port {METRICS_PORT}' if METRICS_ENABLED else 'disabled'}")
+    logging.info(f"  Ingest workers: {INGEST_WORKERS or 'disabled'}")
+    logging.info(f"  Ingest journal: {JOURNAL_FILE or 'disabled'}")
+    logging.info(f"  Live energy: {f'every {LIVE_ENERGY_INTERVAL}s' if live_energy_enabled() else 'disabled'}")
+    logging.info(f"  Live stream: {f'port {STREAM_PORT}' if STREAM_ENABLED else 'disabled'}")
     logging.info("=" * 60)
+    if LIVE_ENERGY_INTERVAL > 0 and not live_energy_enabled():
+        logging.warning("Live energy is disabled with ENERGY_INTEGRATION_SPLIT_HOURS, publishing completed hours only")
 
     logging.debug(f"  SQL timeout: {SQLITE_TIMEOUT}")
     logging.debug(f"  SQL retry (R|D): {SQLITE_RETRIES} | {SQLITE_RETRY_DELAY}")
@@ -353,16 +808,82 @@ if __name__ == '__main__':
     logging.debug("=" * 60)
 
     # Adjust this path as needed for your project structure
-    DB_FILE_PATH = Path(__file__).resolve().parent / "data/readings.db"
+    DATA_DIR = Path(__file__).resolve().parent / "data"
 
     # Initialize the database
-    db_instance = Database(DB_FILE_PATH)
-
-    # Create tables and indices
-    db_instance.setup()
-
-    # Initialize MQTT
-    mqtt_manager = MQTTManager()
+    db_instance = open_storage(STORAGE_BACKEND, DATA_DIR)
+
+    if INGEST_WORKERS > 0 and not isinstance(db_instance, Database):
+        logging.warning("Ingest workers need the sqlite storage backend, serving from one process")
+    elif INGEST_WORKERS > 0:
+        # Pre-forked HTTP workers with this process as the single DB writer
+        from ingest import run_ingest
+        db_instance.setup()
+        journal = None
+        if JOURNAL_FILE:
+            journal = IngestJournal(Path(__file__).resolve().parent / JOURNAL_FILE, db_instance)
+            journal.open()
+            db_instance.attach_journal(journal)
+        run_ingest(db_instance, port=SERVER_PORT, workers=INGEST_WORKERS, journal=journal,
+                   unix_socket=SERVER_UNIX_SOCKET or None)
+        sys.exit(0)
+
+    startup = StartupStatus([
+        "schema", "journal", "hot_window", "live_energy", "liveness", "ingest_keys", "mqtt", "discovery", "aggregation"
+    ])
+    hot_window = HotWindow()
+    liveness = LivenessRegistry()
+    deduper = IngestDeduper(db_instance)
+    live_energy = LiveEnergyIntegrator() if live_energy_enabled() else None
+    # MQTT connects in the background once the server is up
+    mqtt_manager = MQTTManager(connect=False)
+
+    # Bind first: hubs connecting while the schema is checked and the journal
+    # replayed wait in the listen backlog instead of being refused
+    httpd = EfergyHTTPServer(
+        SERVER_UNIX_SOCKET or ('0.0.0.0', SERVER_PORT),
+        FakeEfergyServer,
+        database=db_instance,
+        mqtt_manager=mqtt_manager,
+        hot_window=hot_window,
+        live_energy=live_energy,
+        startup=startup,
+        liveness=liveness,
+        deduper=deduper,
+        stream=ReadingStream(hot_window) if STREAM_ENABLED else None,
+    )
 
-    # Start the server, passing the database instance
-    run_server(db_instance, port=SERVER_PORT)
+    # Create tables and indices, skipped when the schema version is current
+    startup.run("schema", db_instance.setup)
+
+    # Replay and attach the write-ahead journal; its thread starts with the server
+    journal = IngestJournal(Path(__file__).resolve().parent / JOURNAL_FILE, db_instance) if JOURNAL_FILE else None
+
+    def open_journal():
+        if journal is not None:
+            journal.open()
+            db_instance.attach_journal(journal)
+
+    startup.run("journal", open_journal)
+
+    def seed_live_energy():
+        if live_energy is None:
+            return
+        # Posts are already being stored: seed from a database holding all of them,
+        # with no reading added in between
+        with httpd.ingest_lock:
+            if journal is not None:
+                journal.drain()
+            live_energy.seed_from_database(db_instance)
+
+    # Serve, then load in-memory state, connect MQTT, publish discovery and catch up in the background
+    run_server(httpd, journal=journal, startup=startup, warmup=[
+        # Warm the in-memory window of recent readings from the tail of the DB
+        ("hot_window", lambda: hot_window.load_from_database(db_instance)),
+        # Live energy total (completed hours + current partial hour)
+        ("live_energy", seed_live_energy),
+        # Last-seen hubs and sensors from the previous run
+        ("liveness", lambda: liveness.load_from_database(db_instance)),
+        # (hub, label, line) keys seen recently, so retries across the restart are still dropped
+        ("ingest_keys", deduper.load_from_database),
+    ])
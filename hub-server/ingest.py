@@ -0,0 +1,353 @@
+"""
+Multi-process ingest: pre-forked HTTP workers feeding a single writer.
+
+With INGEST_WORKERS > 0 the parent binds the listening socket and forks
+that many worker processes, which all accept connections from it and run
+the normal request handler. Request parsing, payload parsing and MQTT
+power publishing then spread over several cores. Workers do not write to
+SQLite; their readings are forwarded over a multiprocessing queue to the
+parent, the only writer, which commits them in batches with
+Database.log_many and runs aggregation, the energy publishers and the live
+stream of committed readings.
+
+Acknowledgement is best effort: a worker answers the hub once the readings
+are forwarded, not once they are committed, so a crash of the parent loses
+readings still in the queue or in the writer's pending batch. The journal
+only covers readings the writer has already received.
+
+In-memory views served by workers (/api/latest, /api/recent, /api/liveness)
+only see the readings that worker handled since it started, on top of what
+was in the database at fork time. For the same reason MQTT availability
+topics are not published in this mode: no single process sees every sensor.
+With DEDUPE_WINDOW set, retried posts are only deduplicated when the retry
+reaches the worker that handled the original, as each worker keeps its own
+recent keys.
+Request metrics are per worker too; the parent's /metrics covers the
+writer, database and aggregation.
+"""
+import logging
+import multiprocessing
+import queue
+import signal
+import socket
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+from aggregator import Aggregator
+from backup import scheduler_from_config
+from config import (
+    INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL, METRICS_ENABLED, METRICS_PORT,
+    SHUTDOWN_TIMEOUT, STREAM_ENABLED, STREAM_PORT
+)
+from database import Database, raw_to_watts
+from hot_window import HotWindow
+from journal import IngestJournal
+from live_energy import LiveEnergyIntegrator, LiveEnergyPublisher, live_energy_enabled
+from maintenance import DatabaseMaintenance
+from metrics import Counter, Gauge, MQTT_QUEUE_DEPTH, record_reading, start_metrics_server
+from mqtt_manager import MQTTManager
+from shutdown import ShutdownSequence, install_signal_handlers
+from startup import StartupStatus, run_in_background
+from stream import STREAM_CLIENTS, ReadingStream, start_stream_server
+
+INGEST_QUEUE_DEPTH = Gauge(
+    "efergy_ingest_queue_depth", "Readings batches waiting for the writer process."
+)
+INGEST_READINGS = Counter(
+    "efergy_ingest_readings_total", "Readings committed by the writer process."
+)
+
+
+class ForwardingDatabase(Database):
+    """
+    Database used inside ingest workers.
+
+    Reads use the worker's own connection to the shared SQLite file (WAL
+    allows concurrent readers); writes are forwarded to the writer process.
+
+    Args:
+        db_path: The file path to the sqlite database.
+        readings: Queue to the writer, receives lists of (label, value, timestamp).
+    """
+
+    def __init__(self, db_path, readings):
+        super().__init__(db_path)
+        self.readings = readings
+
+    def log_data(self, label: str, value: float, timestamp: Optional[int] = None) -> None:
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        self.readings.put([(label, value, timestamp)])
+        self._update_latest(label, timestamp, value, raw_to_watts(label, value))
+
+    def log_many(self, readings: Iterable[Tuple[str, float, Optional[int]]]) -> int:
+        now = int(time.time())
+        batch = [(label, value, int(now if ts is None else ts)) for label, value, ts in readings]
+        if batch:
+            self.readings.put(batch)
+        for label, value, timestamp in batch:
+            self._update_latest(label, timestamp, value, raw_to_watts(label, value))
+        return len(batch)
+
+
+class IngestWriter:
+    """
+    Drains forwarded readings into the database in batches.
+
+    Args:
+        database: The writer's Database.
+        readings: Queue the workers forward readings to.
+        batch_size: Max readings committed per transaction.
+        flush_interval: Seconds to wait for the first reading of a batch.
+        live_energy: Optional live energy integrator fed with committed readings.
+        stream: Optional live stream fed with committed readings; its hot
+            window, used for replay, is fed too.
+    """
+
+    def __init__(self, database: Database, readings, batch_size: int = INGEST_BATCH_SIZE,
+                 flush_interval: float = INGEST_FLUSH_INTERVAL,
+                 live_energy: Optional[LiveEnergyIntegrator] = None,
+                 stream: Optional[ReadingStream] = None):
+        self.database = database
+        self.readings = readings
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.live_energy = live_energy
+        self.stream = stream
+
+    def drain(self) -> int:
+        """
+        Commit one batch: block up to flush_interval for the first readings,
+        then take whatever else is queued, up to batch_size.
+
+        Returns:
+            The number of readings committed.
+        """
+        try:
+            batch = list(self.readings.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return 0
+        while len(batch) < self.batch_size:
+            try:
+                batch.extend(self.readings.get_nowait())
+            except queue.Empty:
+                break
+
+        committed = self.database.log_many(batch)
+        if committed:
+            INGEST_READINGS.inc(amount=committed)
+            for label, value, timestamp in batch:
+                record_reading(label, timestamp)
+                if self.live_energy is not None:
+                    self.live_energy.add(label, timestamp, value)
+                if self.stream is not None:
+                    if self.stream.hot_window is not None:
+                        self.stream.hot_window.add(label, timestamp, value)
+                    self.stream.publish(label, timestamp, value)
+        logging.debug("Writer committed %d of %d forwarded readings", committed, len(batch))
+        return committed
+
+    def drain_all(self) -> int:
+        """Drain until the queue stays empty for a flush interval."""
+        total = 0
+        while True:
+            committed = self.drain()
+            if not committed:
+                return total
+            total += committed
+
+
+def _worker_main(index: int, sock: socket.socket, readings, db_path: str):
+    """Entry point of a forked ingest worker."""
+    # Imported here: hub_server is usually __main__ in the parent
+    from hub_server import EfergyHTTPServer, FakeEfergyServer
+
+    database = ForwardingDatabase(db_path, readings)
+    database.load_latest_readings()
+    hot_window = HotWindow()
+    hot_window.load_from_database(database)
+    mqtt_manager = MQTTManager(connect=False, availability=False)
+
+    address = sock.getsockname() if sock.family == socket.AF_UNIX else sock.getsockname()[:2]
+    httpd = EfergyHTTPServer(
+        address,
+        FakeEfergyServer,
+        database=database,
+        mqtt_manager=mqtt_manager,
+        bind_and_activate=False,
+        hot_window=hot_window,
+    )
+    # Serve on the socket inherited from the parent
+    httpd.socket.close()
+    httpd.socket = sock
+    httpd.server_address = address
+
+    # shutdown() waits for serve_forever, so it must run on another thread;
+    # server_close() then lets the requests being handled finish
+    install_signal_handlers(
+        lambda signum: threading.Thread(target=httpd.shutdown, name="http-shutdown", daemon=True).start()
+    )
+
+    # Serve while MQTT connects
+    threading.Thread(target=mqtt_manager.start, name="mqtt-connect", daemon=True).start()
+
+    logging.info(f"Ingest worker {index} serving")
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        # Flush forwarded readings to the pipe before exiting
+        readings.close()
+        readings.join_thread()
+        logging.info(f"Ingest worker {index} stopped")
+
+
+def start_workers(sock: socket.socket, readings, db_path, count: int) -> List[multiprocessing.Process]:
+    """
+    Fork `count` workers serving `sock`. Call before starting any threads or
+    opening a SQLite connection in this process.
+    """
+    context = multiprocessing.get_context("fork")
+    processes = []
+    for index in range(count):
+        process = context.Process(
+            target=_worker_main, args=(index, sock, readings, str(db_path)),
+            name=f"ingest-worker-{index}", daemon=True
+        )
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def stop_workers(processes: List[multiprocessing.Process], timeout: float = SHUTDOWN_TIMEOUT):
+    """SIGTERM the workers and wait for them to drain, killing any still running after `timeout`."""
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            logging.warning(f"{process.name} did not stop within {timeout}s, killing it")
+            process.kill()
+            process.join()
+
+
+def run_ingest(database: Database, host: str = '0.0.0.0', port: int = 5000, workers: int = 2,
+               journal: Optional[IngestJournal] = None, unix_socket: Optional[str] = None):
+    """
+    Run the multi-process server: fork the HTTP workers, then act as the
+    single writer until SIGTERM/SIGINT.
+
+    Args:
+        database: The initialized Database instance, owned by this process.
+        host: The host address to bind to.
+        port: The port to listen on.
+        workers: Number of HTTP worker processes.
+        journal: Opened journal attached to `database`, started after forking.
+        unix_socket: Listen on this Unix domain socket path instead of
+            `host` and `port`.
+    """
+    # Imported here: hub_server is usually __main__
+    from hub_server import bind_unix_socket, describe_address, remove_stale_socket
+
+    if unix_socket:
+        sock = bind_unix_socket(unix_socket)
+    else:
+        sock = socket.create_server((host, port), backlog=128)
+    readings = multiprocessing.get_context("fork").Queue()
+    # Workers must not inherit an open SQLite connection; the writer reconnects on first use
+    database.close(checkpoint=False)
+    processes = start_workers(sock, readings, database.db_path, workers)
+    logging.info(f"Serving HTTP on {describe_address(unix_socket or (host, port))} with {workers} ingest workers...")
+
+    stop_event = threading.Event()
+    received = []
+
+    def on_signal(signum):
+        received.append(signal.Signals(signum).name)
+        stop_event.set()
+
+    install_signal_handlers(on_signal)
+
+    # Threads only after forking
+    if journal is not None:
+        journal.start()
+    mqtt_manager = MQTTManager(connect=False, availability=False)
+    live_energy = None
+    if live_energy_enabled():
+        live_energy = LiveEnergyIntegrator()
+        live_energy.seed_from_database(database)
+
+    # The live stream is served by this process, which sees every committed reading
+    stream = stream_httpd = None
+    if STREAM_ENABLED:
+        hot_window = HotWindow()
+        hot_window.load_from_database(database)
+        stream = ReadingStream(hot_window)
+        try:
+            stream_httpd = start_stream_server(stream, STREAM_PORT)
+        except OSError:
+            logging.exception(f"Failed to start live stream server on port {STREAM_PORT}")
+
+    metrics_httpd = None
+    if METRICS_ENABLED:
+        MQTT_QUEUE_DEPTH.set_function(mqtt_manager.queue_depth)
+        INGEST_QUEUE_DEPTH.set_function(readings.qsize)
+        if stream is not None:
+            STREAM_CLIENTS.set_function(stream.client_count)
+        try:
+            metrics_httpd = start_metrics_server(METRICS_PORT)
+        except OSError:
+            logging.exception(f"Failed to start metrics server on port {METRICS_PORT}")
+
+    startup = StartupStatus(["mqtt", "discovery", "aggregation"])
+    aggregator = Aggregator(database, mqtt_manager, live_energy=live_energy, startup=startup)
+    maintenance = DatabaseMaintenance(database)
+    maintenance.start()
+    backups = scheduler_from_config(database)
+    publisher = None
+    if live_energy is not None:
+        publisher = LiveEnergyPublisher(live_energy, mqtt_manager)
+        publisher.start()
+
+    # Connect, publish discovery and catch up while the writer drains
+    run_in_background(startup, [
+        ("mqtt", mqtt_manager.start),
+        ("discovery", lambda: mqtt_manager.publish_startup_discovery(database.get_all_labels())),
+    ], then=lambda: stop_event.is_set() or aggregator.start())
+
+    writer = IngestWriter(database, readings, live_energy=live_energy, stream=stream)
+    reported = set()
+    try:
+        while not stop_event.is_set():
+            writer.drain()
+            for process in processes:
+                if not process.is_alive() and process.name not in reported:
+                    reported.add(process.name)
+                    logging.error(f"{process.name} exited with code {process.exitcode}")
+            if len(reported) == len(processes):
+                logging.error("All ingest workers exited, stopping")
+                break
+        if received:
+            logging.info(f"Received {received[0]}, server shutting down...")
+    finally:
+        shutdown = ShutdownSequence()
+        shutdown.add("stop workers and drain requests", lambda: stop_workers(processes))
+        shutdown.add("commit forwarded readings", writer.drain_all)
+        if journal is not None:
+            shutdown.add("flush journal", journal.stop)
+        if publisher is not None:
+            shutdown.add("stop live energy publisher", publisher.stop)
+        if backups is not None:
+            shutdown.add("stop backups", backups.stop)
+        shutdown.add("stop database maintenance", maintenance.stop)
+        shutdown.add("stop aggregator", aggregator.stop)
+        if stream_httpd is not None:
+            shutdown.add("disconnect stream clients", lambda: (stream.close(), stream_httpd.shutdown()))
+        if metrics_httpd is not None:
+            shutdown.add("stop metrics server", metrics_httpd.shutdown)
+        shutdown.add("flush MQTT", mqtt_manager.stop)
+        shutdown.add("close listening socket",
+                     lambda: (sock.close(), unix_socket and remove_stale_socket(unix_socket)))
+        shutdown.add("checkpoint and close database", database.close)
+        shutdown.run()
@@ -0,0 +1,288 @@
+"""
+Write-ahead ingest journal.
+
+Readings are appended to a local file before the hub is acknowledged and
+committed to SQLite by a background drain in large transactions, so a
+stalled database (another process holding a lock, retries exhausted)
+delays commits instead of dropping readings.
+
+File format: a fixed-size header `EFJ1 <generation>\\n` followed by one
+`label<TAB>value<TAB>timestamp\\n` line per reading. Each drain commits its
+readings together with the (generation, byte offset) it read up to, in the
+same transaction, so on restart the journal replays exactly the readings
+that were not committed. Once the committed offset passes
+JOURNAL_COMPACT_BYTES the file is rewritten under a new generation with
+only the uncommitted tail.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import List, Optional, Tuple
+from config import JOURNAL_FSYNC_INTERVAL, JOURNAL_DRAIN_INTERVAL, JOURNAL_COMPACT_BYTES
+from metrics import Counter, Gauge, Histogram
+
+JOURNAL_MAGIC = b"EFJ1 "
+HEADER_SIZE = len(JOURNAL_MAGIC) + 32 + 1
+# Upper bound on bytes read (and readings committed) per drain
+DRAIN_MAX_BYTES = 1024 * 1024
+
+JOURNAL_PENDING_BYTES = Gauge(
+    "efergy_journal_pending_bytes", "Journal bytes not yet committed to the database."
+)
+JOURNAL_READINGS = Counter(
+    "efergy_journal_readings_total", "Readings committed from the journal, by source.", ["source"]
+)
+JOURNAL_FSYNC_DURATION = Histogram(
+    "efergy_journal_fsync_duration_seconds", "Time spent in journal fsyncs."
+)
+
+
+def _header(generation: str) -> bytes:
+    return JOURNAL_MAGIC + generation.encode("ascii") + b"\n"
+
+
+def _parse_lines(data: bytes) -> Tuple[List[Tuple[str, float, int]], int]:
+    """
+    Parse complete lines from `data`.
+
+    Returns:
+        The readings and the number of bytes consumed (up to the last newline).
+    """
+    end = data.rfind(b"\n") + 1
+    readings = []
+    for line in data[:end].splitlines():
+        try:
+            label, value, timestamp = line.decode("utf-8").split("\t")
+            readings.append((label, float(value), int(timestamp)))
+        except ValueError:
+            logging.warning("Skipping malformed journal line: %.200r", line)
+    return readings, end
+
+
+class IngestJournal:
+    """
+    Append-only journal in front of Database writes.
+
+    Args:
+        path: Journal file path.
+        database: Database the journal drains into; attach with
+            `database.attach_journal(journal)` to route writes through it.
+        fsync_interval: Seconds between batched fsyncs, 0 fsyncs every append.
+        drain_interval: Seconds between drains into the database.
+        compact_bytes: Rewrite the file once this many bytes are committed.
+    """
+
+    def __init__(self, path, database,
+                 fsync_interval: float = JOURNAL_FSYNC_INTERVAL,
+                 drain_interval: float = JOURNAL_DRAIN_INTERVAL,
+                 compact_bytes: int = JOURNAL_COMPACT_BYTES):
+        self.path = str(path)
+        self.database = database
+        self.fsync_interval = fsync_interval
+        self.drain_interval = drain_interval
+        self.compact_bytes = compact_bytes
+
+        self.generation = ""
+        self._fd: Optional[int] = None
+        self._offset = HEADER_SIZE
+        self._size = HEADER_SIZE
+        self._dirty = False
+        # Guards the file descriptor, generation and size (appends)
+        self._lock = threading.Lock()
+        # Serializes drains and compaction
+        self._drain_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        JOURNAL_PENDING_BYTES.set_function(lambda: self._size - self._offset)
+
+    # ---------------- File handling ----------------
+    def _new_file(self, tail: bytes = b""):
+        """Start a new generation holding `tail`. Must hold self._lock."""
+        generation = uuid.uuid4().hex
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+        if tail:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(_header(generation) + tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        else:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, _header(generation))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        self.generation = generation
+        self._offset = HEADER_SIZE
+        self._size = HEADER_SIZE + len(tail)
+        self._dirty = False
+
+    def open(self) -> int:
+        """
+        Open the journal, replaying anything not yet committed.
+
+        Returns:
+            The number of readings replayed.
+        """
+        with self._lock:
+            generation, start = None, HEADER_SIZE
+            if os.path.exists(self.path):
+                with open(self.path, "rb") as f:
+                    header = f.read(HEADER_SIZE)
+                if len(header) == HEADER_SIZE and header.startswith(JOURNAL_MAGIC) and header.endswith(b"\n"):
+                    generation = header[len(JOURNAL_MAGIC):-1].decode("ascii", "ignore")
+                else:
+                    logging.warning(f"Journal {self.path} has no valid header, replaying it in full")
+                    start = 0
+
+            if generation is None and start == HEADER_SIZE:
+                self._new_file()
+                return 0
+
+            checkpoint = self.database.get_journal_checkpoint()
+            if generation is not None and checkpoint and checkpoint[0] == generation:
+                start = max(start, checkpoint[1])
+
+            self.generation = generation or ""
+            self._offset = start
+            self._size = os.path.getsize(self.path)
+
+        replayed = self._drain("replay")
+
+        with self._drain_lock, self._lock:
+            # Keep whatever could not be committed; a partial last line is dropped
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                tail = f.read()
+            self._new_file(tail[:tail.rfind(b"\n") + 1])
+
+        if replayed or self._size > HEADER_SIZE:
+            logging.info(f"Journal replayed {replayed} readings, {self._size - HEADER_SIZE} bytes pending")
+        return replayed
+
+    def append(self, readings: List[Tuple[str, float, int]]):
+        """
+        Append readings. They survive a process crash once this returns,
+        and a power loss after the next fsync.
+        """
+        data = "".join(f"{label}\t{value!r}\t{int(timestamp)}\n" for label, value, timestamp in readings)
+        data = data.encode("utf-8")
+        with self._lock:
+            if self._fd is None:
+                raise OSError("journal is not open")
+            os.write(self._fd, data)
+            self._size += len(data)
+            if self.fsync_interval <= 0:
+                with JOURNAL_FSYNC_DURATION.time():
+                    os.fsync(self._fd)
+            else:
+                self._dirty = True
+
+    def sync(self):
+        """fsync pending appends."""
+        with self._lock:
+            if self._fd is None or not self._dirty:
+                return
+            self._dirty = False
+            with JOURNAL_FSYNC_DURATION.time():
+                os.fsync(self._fd)
+
+    # ---------------- Draining ----------------
+    def _drain(self, source: str) -> int:
+        committed = 0
+        with self._drain_lock:
+            while True:
+                with self._lock:
+                    generation, offset, size = self.generation, self._offset, self._size
+                if offset >= size:
+                    break
+
+                with open(self.path, "rb") as f:
+                    f.seek(offset)
+                    data = f.read(min(size - offset, DRAIN_MAX_BYTES))
+                readings, consumed = _parse_lines(data)
+                if not consumed:
+                    break
+
+                try:
+                    if readings:
+                        self.database.commit_journal_batch(readings, generation, offset + consumed)
+                except Exception as e:
+                    logging.warning(f"Journal drain failed, will retry: {e}")
+                    break
+
+                with self._lock:
+                    self._offset = offset + consumed
+                committed += len(readings)
+                JOURNAL_READINGS.inc(source, amount=len(readings))
+
+            if self._offset >= self.compact_bytes:
+                self._compact()
+        return committed
+
+    def drain(self) -> int:
+        """
+        Commit pending readings to the database.
+
+        Returns:
+            The number of readings committed.
+        """
+        if self._fd is None:
+            return 0
+        return self._drain("drain")
+
+    def _compact(self):
+        """Start a new generation with only the uncommitted tail. Must hold self._drain_lock."""
+        with self._lock:
+            if self._offset >= self._size:
+                self._new_file()
+            else:
+                with open(self.path, "rb") as f:
+                    f.seek(self._offset)
+                    tail = f.read()
+                self._new_file(tail)
+        logging.debug("Journal compacted to generation %s", self.generation)
+
+    # ---------------- Background thread ----------------
+    def drain_loop(self):
+        last_drain = time.monotonic()
+        wait = self.fsync_interval if self.fsync_interval > 0 else self.drain_interval
+        while not self._stop_event.wait(min(wait, self.drain_interval)):
+            try:
+                self.sync()
+                if time.monotonic() - last_drain >= self.drain_interval:
+                    self.drain()
+                    last_drain = time.monotonic()
+            except Exception:
+                logging.exception("Unhandled exception in journal thread")
+        logging.debug("Journal thread stopping")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.drain_loop, name='ingest-journal', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, then fsync, drain and close the journal."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.sync()
+        self.drain()
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
@@ -0,0 +1,194 @@
+"""
+Live energy total: completed hours plus the current partial hour.
+
+`aggregate_hours` only persists full hours, so the published energy total
+moves in hourly steps. LiveEnergyIntegrator integrates readings as they
+arrive, in exactly the order and with exactly the arithmetic of
+Database.aggregate_one_hour, and adds the running partial-hour sum to the
+persisted total. Readings of one second are ordered by rowid there, so
+callers must add readings in the order they were stored: the HTTP server
+stores and adds each reading under its ingest_lock, and the ingest writer
+adds them as it commits. When an hour is aggregated its partial sum is dropped and
+replaced by the stored `energy_hourly` value, so the live figure reconciles
+with the database.
+
+With ENERGY_INTEGRATION_SPLIT_HOURS an hour's stored kWh depends on the
+first reading of the next hour, which a running sum can't know, so the
+partial hour is not integrated and only completed hours are published.
+"""
+import logging
+import threading
+import time
+from typing import Dict, Optional
+from config import ENERGY_INTEGRATION_SPLIT_HOURS, LIVE_ENERGY_INTERVAL
+from database import raw_to_kw
+from storage import StorageBackend
+from energy_integration import interval_kwh
+from mqtt_manager import MQTTManager
+
+# Decreases smaller than this (relative) are float noise from reconciling a
+# Python running sum with SQL's SUM(), and are not published as a reset.
+RECONCILE_TOLERANCE = 1e-9
+
+
+def live_energy_enabled(interval: int = LIVE_ENERGY_INTERVAL,
+                        split_hours: bool = ENERGY_INTEGRATION_SPLIT_HOURS) -> bool:
+    """Whether the partial hour is integrated and published, see the module docstring."""
+    return interval > 0 and not split_hours
+
+
+class _HourState:
+    """Running left Riemann sum of one hour, all labels merged by timestamp."""
+    __slots__ = ("kwh", "last_ts", "last_kw", "count", "dirty")
+
+    def __init__(self):
+        self.kwh = 0.0
+        self.last_ts = 0
+        self.last_kw = 0.0
+        self.count = 0
+        self.dirty = False
+
+    def add(self, timestamp: int, kw: float):
+        if self.count:
+            self.kwh += interval_kwh(self.last_kw, kw, timestamp - self.last_ts)
+        self.last_ts = timestamp
+        self.last_kw = kw
+        self.count += 1
+
+
+class LiveEnergyIntegrator:
+    """
+    Incremental integrator behind the live energy total.
+
+    The partial hour only counts intervals that have been closed by a later
+    reading. aggregate_one_hour additionally extends the last reading by the
+    previous interval, which is added once the hour is persisted, so the
+    live total never runs ahead of what the database will store.
+    """
+
+    def __init__(self):
+        self._hours: Dict[int, _HourState] = {}
+        self._completed_kwh: Optional[float] = None
+        self._last_completed_hour: Optional[int] = None
+        self._published: Optional[float] = None
+        self._database: Optional[StorageBackend] = None
+        self._lock = threading.Lock()
+
+    def add(self, label: str, timestamp: int, value: float):
+        """Integrate one raw reading."""
+        timestamp = int(timestamp)
+        hour_start = timestamp - (timestamp % 3600)
+        kw = raw_to_kw(label, value)
+        with self._lock:
+            if self._last_completed_hour is not None and hour_start <= self._last_completed_hour:
+                return
+            state = self._hours.get(hour_start)
+            if state is None:
+                state = self._hours[hour_start] = _HourState()
+            if state.count and timestamp < state.last_ts:
+                # Out of order: the running sum can't be patched, rebuild from the database
+                state.dirty = True
+            if not state.dirty:
+                state.add(timestamp, kw)
+
+    def _seed_hour(self, hour_start: int):
+        """Rebuild one hour's state from stored readings."""
+        rows = self._database.get_hour_series(hour_start) if self._database else []
+        state = _HourState()
+        for timestamp, kw in rows:
+            state.add(timestamp, kw)
+        with self._lock:
+            if self._last_completed_hour is None or hour_start > self._last_completed_hour:
+                self._hours[hour_start] = state
+
+    def seed_from_database(self, database: StorageBackend, now: Optional[int] = None):
+        """
+        Load the readings of the previous and current hour, which may not be
+        aggregated yet. Later out-of-order readings are re-read from `database`.
+        """
+        self._database = database
+        now = int(time.time()) if now is None else now
+        current = now - (now % 3600)
+        for hour_start in (current - 3600, current):
+            self._seed_hour(hour_start)
+        logging.info(f"Live energy seeded {sum(s.count for s in self._hours.values())} readings")
+
+    def set_completed(self, total_kwh: float, last_hour: Optional[int]):
+        """
+        Record the persisted total and the last aggregated hour; partial sums
+        of that hour and earlier are dropped in favour of the stored values.
+        """
+        with self._lock:
+            self._completed_kwh = total_kwh
+            self._last_completed_hour = last_hour
+            if last_hour is not None:
+                for hour_start in [h for h in self._hours if h <= last_hour]:
+                    del self._hours[hour_start]
+
+    def partial_kwh(self) -> float:
+        """kWh integrated so far in hours that are not aggregated yet."""
+        with self._lock:
+            dirty = [hour_start for hour_start, state in self._hours.items() if state.dirty]
+        for hour_start in dirty:
+            self._seed_hour(hour_start)
+        with self._lock:
+            return sum(state.kwh for _, state in sorted(self._hours.items()))
+
+    def total(self) -> Optional[float]:
+        """
+        Completed hours plus the partial hour, or None until the first
+        set_completed. Never decreases by float noise alone; a genuine drop
+        (monthly reset, retention) is passed through.
+        """
+        partial = self.partial_kwh()
+        with self._lock:
+            if self._completed_kwh is None:
+                return None
+            value = self._completed_kwh + partial
+            published = self._published
+            if published is not None and value < published and \
+                    published - value <= RECONCILE_TOLERANCE * max(1.0, published):
+                value = published
+            self._published = value
+            return value
+
+
+class LiveEnergyPublisher:
+    """
+    Publishes LiveEnergyIntegrator.total() every `interval_sec` seconds.
+    """
+
+    def __init__(self, integrator: LiveEnergyIntegrator, mqtt_manager: MQTTManager,
+                 interval_sec: int = LIVE_ENERGY_INTERVAL):
+        self.integrator = integrator
+        self.mqtt_manager = mqtt_manager
+        self.interval_sec = interval_sec
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def publish_once(self) -> Optional[float]:
+        total = self.integrator.total()
+        if total is not None:
+            self.mqtt_manager.publish_energy(total)
+        return total
+
+    def publish_loop(self):
+        while not self._stop_event.wait(self.interval_sec):
+            try:
+                self.publish_once()
+            except Exception:
+                logging.exception("Unhandled exception in live energy publisher")
+        logging.debug("Live energy publisher thread stopping")
+
+    def start(self):
+        if self.interval_sec <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.publish_loop, name='live-energy', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
@@ -0,0 +1,299 @@
+"""
+Liveness registry: when each hub and sensor was last heard from.
+
+Every data post and eh-ping updates an in-memory entry per hub, keyed by
+the MAC in its Host header, and every reading updates an entry per sensor
+label: last-seen time, last value, post or reading count and RSSI. Updates
+are a dict lookup and a few attribute writes, so they run on every request.
+
+/api/liveness serves the registry. LivenessMonitor periodically writes
+changed entries to the liveness table, so last-seen times survive a
+restart, and publishes MQTT availability ("online"/"offline") when a
+sensor starts or stops reporting. Home Assistant follows it through the
+availability_topic in discovery instead of anything polling SQLite.
+"""
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from config import LIVENESS_INTERVAL, LIVENESS_TIMEOUT
+from storage import StorageBackend
+from mqtt_manager import MQTTManager
+
+HUB = "hub"
+SENSOR = "sensor"
+
+
+def hub_id_from_host(host: str, fallback: str = "") -> str:
+    """
+    The hub MAC from a Host header such as "41.0a.04.001ec0.h3.sensornet.info"
+    or "[MAC].keys.sensornet.info", else `fallback` (e.g. the client address).
+    """
+    name = host.split(":", 1)[0]
+    if not name.endswith(".sensornet.info"):
+        return fallback
+    prefix = name[:-len(".sensornet.info")]
+    mac, _, service = prefix.rpartition(".")
+    if mac and service in ("h1", "h2", "h3", "keys"):
+        return mac
+    return prefix or fallback
+
+
+class _Entry:
+    """A hub or sensor. `available` is the availability last published for it."""
+    __slots__ = ("hub", "hub_version", "last_seen", "last_value", "count", "rssi", "last_ping", "sensors",
+                 "available")
+
+    def __init__(self, hub: str, hub_version: Optional[str]):
+        self.hub = hub
+        self.hub_version = hub_version
+        self.last_seen: Optional[int] = None
+        self.last_value: Optional[float] = None
+        self.count = 0
+        self.rssi: Optional[float] = None
+        self.last_ping: Optional[int] = None
+        self.sensors: Tuple[str, ...] = ()
+        self.available = False
+
+
+class LivenessRegistry:
+    """
+    Thread-safe last-seen state of hubs and sensors.
+
+    Args:
+        timeout: Seconds without a post or reading after which a hub or
+            sensor counts as offline.
+    """
+
+    def __init__(self, timeout: int = LIVENESS_TIMEOUT):
+        self.timeout = timeout
+        self._entries: Dict[Tuple[str, str], _Entry] = {}
+        # Keys changed since the last checkpoint
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _entry(self, kind: str, key: str, hub: str, hub_version: Optional[str]) -> _Entry:
+        entry = self._entries.get((kind, key))
+        if entry is None:
+            entry = self._entries[(kind, key)] = _Entry(hub, hub_version)
+        self._dirty.add((kind, key))
+        return entry
+
+    def record_post(self, hub: str, hub_version: Optional[str], timestamp: Optional[int] = None):
+        """A data post from `hub`."""
+        timestamp = int(time.time()) if timestamp is None else timestamp
+        with self._lock:
+            entry = self._entry(HUB, hub, hub, hub_version)
+            entry.hub_version = hub_version or entry.hub_version
+            entry.last_seen = timestamp
+            entry.count += 1
+
+    def record_ping(self, hub: str, hub_version: Optional[str], sensor_ids: Sequence[str],
+                    timestamp: Optional[int] = None):
+        """
+        An eh-ping from `hub` listing the sensor IDs paired with it. A ping
+        doesn't mark sensors online: a dead CT clamp is still listed.
+        """
+        timestamp = int(time.time()) if timestamp is None else timestamp
+        sensor_ids = tuple(sid for sid in sensor_ids if sid)
+        with self._lock:
+            entry = self._entry(HUB, hub, hub, hub_version)
+            entry.hub_version = hub_version or entry.hub_version
+            entry.last_seen = timestamp
+            entry.last_ping = timestamp
+            entry.sensors = sensor_ids
+            if entry.hub_version:
+                for sid in sensor_ids:
+                    label = f"efergy_{entry.hub_version}_{sid}"
+                    self._entry(SENSOR, label, hub, entry.hub_version).last_ping = timestamp
+
+    def record_reading(self, label: str, hub: str, hub_version: Optional[str], timestamp: int, value: float,
+                       rssi: Optional[float] = None) -> bool:
+        """
+        A reading for `label` posted by `hub`.
+
+        Returns:
+            True if the sensor was not available before, so its availability
+            should be published as online.
+        """
+        with self._lock:
+            entry = self._entry(SENSOR, label, hub, hub_version)
+            entry.hub = hub
+            entry.hub_version = hub_version
+            entry.last_seen = timestamp
+            entry.last_value = value
+            entry.count += 1
+            if rssi is not None:
+                entry.rssi = rssi
+            came_online = not entry.available
+            entry.available = True
+        return came_online
+
+    def expire(self, now: Optional[float] = None) -> List[str]:
+        """
+        Mark sensors without a reading for `timeout` seconds unavailable.
+
+        Returns:
+            Labels that went offline since the last call.
+        """
+        cutoff = (time.time() if now is None else now) - self.timeout
+        expired = []
+        with self._lock:
+            for (kind, key), entry in self._entries.items():
+                if kind == SENSOR and entry.available and (entry.last_seen or 0) < cutoff:
+                    entry.available = False
+                    expired.append(key)
+        return expired
+
+    def availability(self) -> Dict[str, bool]:
+        """Current availability per sensor label."""
+        with self._lock:
+            return {key: entry.available for (kind, key), entry in self._entries.items() if kind == SENSOR}
+
+    def sensor_hubs(self) -> Dict[str, str]:
+        """The hub each sensor last reported through."""
+        with self._lock:
+            return {key: entry.hub for (kind, key), entry in self._entries.items() if kind == SENSOR and entry.hub}
+
+    def online_count(self) -> int:
+        """Sensors currently available."""
+        with self._lock:
+            return sum(1 for (kind, _), entry in self._entries.items() if kind == SENSOR and entry.available)
+
+    def snapshot(self, now: Optional[float] = None) -> dict:
+        """
+        Returns:
+            {"timeout": seconds, "hubs": {hub: {...}}, "sensors": {label: {...}}}
+            where each entry has last_seen, age and online, plus the post
+            count and last ping for hubs, or the reading count, last value
+            and RSSI for sensors.
+        """
+        now = time.time() if now is None else now
+        result = {"timeout": self.timeout, "hubs": {}, "sensors": {}}
+        with self._lock:
+            for (kind, key), entry in self._entries.items():
+                age = None if entry.last_seen is None else round(now - entry.last_seen, 3)
+                item = {
+                    "hub_version": entry.hub_version,
+                    "last_seen": entry.last_seen,
+                    "age": age,
+                    "online": age is not None and age <= self.timeout,
+                    "last_ping": entry.last_ping,
+                }
+                if kind == HUB:
+                    item.update(posts=entry.count, sensors=list(entry.sensors))
+                    result["hubs"][key] = item
+                else:
+                    item.update(hub=entry.hub, readings=entry.count, last_value=entry.last_value, rssi=entry.rssi)
+                    result["sensors"][key] = item
+        return result
+
+    def checkpoint_rows(self) -> List[tuple]:
+        """
+        Entries changed since the last call, as rows for Database.save_liveness.
+        Pass them to restore_dirty if saving fails.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = []
+            for kind, key in dirty:
+                entry = self._entries[(kind, key)]
+                rows.append((kind, key, entry.hub, entry.hub_version, entry.last_seen, entry.last_value,
+                             entry.count, entry.rssi, entry.last_ping))
+            return rows
+
+    def restore_dirty(self, rows: Iterable[tuple]):
+        with self._lock:
+            self._dirty.update((row[0], row[1]) for row in rows)
+
+    def load(self, rows: Iterable[tuple]):
+        """
+        Restore entries from Database.get_liveness rows. Sensors come back
+        as available so the first expire() publishes offline for those that
+        stopped reporting while the server was down.
+        """
+        count = 0
+        with self._lock:
+            for kind, key, hub, hub_version, last_seen, last_value, readings, rssi, last_ping in rows:
+                if (kind, key) in self._entries:
+                    continue
+                entry = self._entries[(kind, key)] = _Entry(hub, hub_version)
+                entry.last_seen = last_seen
+                entry.last_value = last_value
+                entry.count = readings or 0
+                entry.rssi = rssi
+                entry.last_ping = last_ping
+                entry.available = kind == SENSOR
+                count += 1
+        logging.debug(f"Loaded liveness of {count} hubs and sensors")
+
+    def load_from_database(self, database: StorageBackend):
+        self.load(database.get_liveness())
+
+
+class LivenessMonitor:
+    """
+    Every `interval_sec` seconds publishes offline availability for sensors
+    that stopped reporting and checkpoints the registry to the database.
+    Once MQTT has started, the availability of every known sensor is
+    published once, so sensors that came online before the connection
+    aren't left unavailable in Home Assistant.
+    """
+
+    def __init__(self, registry: LivenessRegistry, database: StorageBackend, mqtt_manager: MQTTManager,
+                 interval_sec: int = LIVENESS_INTERVAL):
+        self.registry = registry
+        self.database = database
+        self.mqtt_manager = mqtt_manager
+        self.interval_sec = interval_sec
+        self._announced = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def checkpoint(self) -> int:
+        """Save changed entries. Returns the number of rows written."""
+        rows = self.registry.checkpoint_rows()
+        if not rows:
+            return 0
+        try:
+            self.database.save_liveness(rows)
+        except Exception:
+            # Retried with the next checkpoint
+            self.registry.restore_dirty(rows)
+            raise
+        return len(rows)
+
+    def run_once(self, now: Optional[float] = None):
+        if not self._announced and self.mqtt_manager.started:
+            for label, available in self.registry.availability().items():
+                self.mqtt_manager.publish_availability(label, available)
+            self._announced = True
+
+        for label in self.registry.expire(now):
+            logging.info(f"Sensor {label} offline, no reading for {self.registry.timeout}s")
+            self.mqtt_manager.publish_availability(label, False)
+
+        self.checkpoint()
+
+    def monitor_loop(self):
+        while not self._stop_event.wait(self.interval_sec):
+            try:
+                self.run_once()
+            except Exception:
+                logging.exception("Unhandled exception in liveness monitor")
+        logging.debug("Liveness monitor thread stopping")
+
+    def start(self):
+        if self.interval_sec <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.monitor_loop, name='liveness', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread and write a final checkpoint."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.checkpoint()
@@ -0,0 +1,618 @@
+"""
+Load generator for the hub endpoints.
+
+Synthesizes realistic /h2, /h3 and /recjson sensor posts and
+application/eh-ping bodies for N hubs x M sensors, or replays a capture
+file, and drives a hub server over loopback. At the end it reports
+requests/s, p50/p99 latency, the DB commit rate and how the MQTT
+publish queue behaved against a local stand-in broker.
+
+Usage:
+    python loadgen.py --hubs 10 --sensors 3 --interval 6 --duration 60
+    python loadgen.py --hubs 50 --sensors 3 --duration 600 --speed 0
+    python loadgen.py --replay capture.jsonl --target 127.0.0.1:5000
+"""
+import argparse
+import base64
+import http.client
+import json
+import logging
+import math
+import random
+import socketserver
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+
+# ---------------- Traffic synthesis ----------------
+def hub_mac(hub_index: int) -> str:
+    """Return a stable fake MAC address for a hub, e.g. '41.0a.04.000001'."""
+    return f"41.0a.04.{hub_index + 1:06x}"
+
+
+def sensor_id(hub_index: int, sensor_index: int) -> str:
+    """Return a stable six digit sensor ID for a hub's sensor."""
+    return str(100000 + hub_index * 100 + sensor_index)
+
+
+def make_request(method: str, path: str, host: str, body: bytes, content_type: str, ts: float = 0.0) -> dict:
+    """
+    Build a request record in the capture format used by `load_capture`.
+
+    Args:
+        method: HTTP method.
+        path: Request path, including any query string.
+        host: Value of the Host header.
+        body: Raw request body.
+        content_type: Value of the Content-Type header.
+        ts: Offset in seconds from the start of the run.
+    """
+    return {
+        "ts": ts,
+        "method": method,
+        "path": path,
+        "headers": {"Host": host, "Content-Type": content_type},
+        "body": body,
+    }
+
+
+class SyntheticHub:
+    """
+    A simulated Efergy hub with a fixed set of CT sensors.
+
+    Sensor values follow a bounded random walk so consecutive posts look
+    like real household load.
+    """
+
+    def __init__(self, hub_index: int, hub_version: str, sensors: int, rng: random.Random):
+        self.hub_index = hub_index
+        self.hub_version = hub_version
+        self.mac = hub_mac(hub_index)
+        self.rng = rng
+        self.counter = 0
+
+        # V1 hubs report a single sensor keyed by the hub MAC
+        if hub_version == "h1":
+            self.sids = [self.mac.replace(".", "").upper()]
+        else:
+            self.sids = [sensor_id(hub_index, i) for i in range(sensors)]
+
+        self.values = {sid: rng.uniform(200.0, 3000.0) for sid in self.sids}
+
+    @property
+    def host(self) -> str:
+        if self.hub_version == "h1":
+            return f"{self.mac}.sensornet.info"
+        return f"{self.mac}.{self.hub_version}.sensornet.info"
+
+    def _next_value(self, sid: str) -> float:
+        value = self.values[sid] + self.rng.uniform(-150.0, 150.0)
+        value = min(max(value, 0.0), 10000.0)
+        self.values[sid] = value
+        return value
+
+    def data_request(self, ts: float = 0.0) -> dict:
+        """Return the next sensor data POST for this hub."""
+        self.counter += 1
+
+        if self.hub_version == "h1":
+            sid = self.sids[0]
+            milliamps = int(self._next_value(sid) * 10)
+            jdata = json.dumps({"data": [[610965, "mA", "E1", milliamps, 0, 0, 65535]]}, separators=(",", ":"))
+            line = f"{sid}|{self.counter:08X}|v1.0.1|{jdata}|{self.rng.getrandbits(128):032x}"
+            return make_request(
+                "POST", "/recjson", self.host, f"json={line}".encode("utf-8"),
+                "application/x-www-form-urlencoded", ts
+            )
+
+        lines = []
+        for sid in self.sids:
+            value = self._next_value(sid)
+            line = f"{sid}|{self.counter}|EFCT|P1,{value:.2f}"
+            if self.hub_version == "h3":
+                line += f"|{self.rng.randint(-90, -40)}"
+            lines.append(line)
+
+        body = "\r\n".join(lines).encode("utf-8")
+        return make_request("POST", f"/{self.hub_version}", self.host, body, "text/plain", ts)
+
+    def ping_request(self, ts: float = 0.0) -> dict:
+        """Return an application/eh-ping POST listing this hub's sensors."""
+        body = "|".join(self.sids).encode("utf-8")
+        return make_request("POST", f"/{self.hub_version}", self.host, body, "application/eh-ping", ts)
+
+    def key_check_request(self, ts: float = 0.0) -> dict:
+        """Return the key check GET a hub sends when it (re)connects."""
+        return make_request("GET", "/check_key.html", self.host, b"", "text/plain", ts)
+
+
+def synthesize_traffic(hubs: int, sensors: int, interval: float, duration: float,
+                       versions: Iterable[str] = ("h2", "h3"), ping_every: int = 10,
+                       seed: int = 0) -> List[dict]:
+    """
+    Build a time-ordered request schedule for `hubs` x `sensors`.
+
+    Each hub starts with a key check, then posts sensor data every
+    `interval` seconds (hubs are staggered evenly across the interval)
+    and sends an eh-ping every `ping_every` posts.
+
+    Args:
+        hubs: Number of simulated hubs.
+        sensors: Number of CT sensors per hub (V1 hubs always have one).
+        interval: Seconds between data posts from a single hub.
+        duration: Length of the schedule in seconds.
+        versions: Hub versions assigned to hubs round-robin.
+        ping_every: Send an eh-ping after this many data posts, 0 disables pings.
+        seed: Random seed so runs are repeatable.
+
+    Returns:
+        A list of request records sorted by their `ts` offset.
+    """
+    rng = random.Random(seed)
+    versions = list(versions)
+    requests = []
+
+    for h in range(hubs):
+        hub = SyntheticHub(h, versions[h % len(versions)], sensors, rng)
+        offset = interval * h / max(hubs, 1)
+        requests.append(hub.key_check_request(offset))
+
+        posts = 0
+        ts = offset
+        while ts < duration:
+            requests.append(hub.data_request(ts))
+            posts += 1
+            if ping_every and posts % ping_every == 0:
+                requests.append(hub.ping_request(ts))
+            ts += interval
+
+    requests.sort(key=lambda r: r["ts"])
+    return requests
+
+
+# ---------------- Capture files ----------------
+def write_capture(path: Union[str, Path], requests: Iterable[dict]) -> int:
+    """
+    Write request records to a JSON lines capture file.
+
+    Bodies are stored base64 encoded so binary payloads survive unchanged.
+
+    Returns:
+        The number of records written.
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for req in requests:
+            record = dict(req)
+            record["body"] = base64.b64encode(req["body"]).decode("ascii")
+            f.write(json.dumps(record) + "\n")
+            count += 1
+    return count
+
+
+def load_capture(path: Union[str, Path]) -> List[dict]:
+    """
+    Load request records from a JSON lines capture file.
+
+    Each line is an object with `ts` (seconds, absolute or relative),
+    `method`, `path`, `headers` and a base64 encoded `body`. Timestamps
+    are rebased so the first request starts at offset 0.
+    """
+    requests = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            record["body"] = base64.b64decode(record.get("body", ""))
+            record.setdefault("headers", {})
+            record["ts"] = float(record.get("ts", 0.0))
+            requests.append(record)
+
+    requests.sort(key=lambda r: r["ts"])
+    if requests:
+        start = requests[0]["ts"]
+        for record in requests:
+            record["ts"] -= start
+    return requests
+
+
+# ---------------- Stand-in MQTT broker ----------------
+class _BrokerHandler(socketserver.BaseRequestHandler):
+    """Speaks just enough MQTT 3.1.1 to accept QoS 0/1 publishes from paho."""
+
+    def _read_exact(self, n: int) -> bytes:
+        buf = b""
+        while len(buf) < n:
+            chunk = self.request.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("client closed")
+            buf += chunk
+        return buf
+
+    def _read_packet(self):
+        header = self._read_exact(1)[0]
+        multiplier, length = 1, 0
+        while True:
+            byte = self._read_exact(1)[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        return header, self._read_exact(length) if length else b""
+
+    def handle(self):
+        broker: "StandInBroker" = self.server.broker
+        try:
+            while True:
+                header, body = self._read_packet()
+                packet_type = header >> 4
+
+                if packet_type == 1:  # CONNECT
+                    self.request.sendall(b"\x20\x02\x00\x00")
+                elif packet_type == 3:  # PUBLISH
+                    if broker.delay:
+                        time.sleep(broker.delay)
+                    broker.record_publish(len(body))
+                    qos = (header >> 1) & 0x03
+                    if qos:
+                        topic_len = int.from_bytes(body[:2], "big")
+                        packet_id = body[2 + topic_len:4 + topic_len]
+                        self.request.sendall(b"\x40\x02" + packet_id)
+                elif packet_type == 8:  # SUBSCRIBE
+                    self.request.sendall(b"\x90\x03" + body[:2] + b"\x00")
+                elif packet_type == 12:  # PINGREQ
+                    self.request.sendall(b"\xd0\x00")
+                elif packet_type == 14:  # DISCONNECT
+                    return
+        except (ConnectionError, OSError):
+            return
+
+
+class _BrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StandInBroker:
+    """
+    A minimal in-process MQTT broker that counts received publishes.
+
+    It does not route messages to subscribers; it only exists so the
+    real MQTTManager/paho client can be exercised end to end. An optional
+    per-message `delay` simulates a slow broker to observe client-side
+    queueing.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0.0):
+        self.delay = delay
+        self.received = 0
+        self.received_bytes = 0
+        self._lock = threading.Lock()
+        self._server = _BrokerServer((host, port), _BrokerHandler)
+        self._server.broker = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def record_publish(self, size: int):
+        with self._lock:
+            self.received += 1
+            self.received_bytes += size
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="standin-broker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+
+# ---------------- Driver ----------------
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of `values` (0 when empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class _QueueSampler:
+    """Periodically samples the paho client's outgoing packet queue."""
+
+    def __init__(self, mqtt_manager, interval: float = 0.05):
+        self.client = getattr(mqtt_manager, "client", None)
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mqtt-queue-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append(len(getattr(self.client, "_out_packet", ())))
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self.client is not None:
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=1)
+
+
+class LoadGenerator:
+    """
+    Sends a request schedule to a hub server and collects latency stats.
+
+    Args:
+        host: Server address.
+        port: Server port.
+        speed: Time compression factor for the schedule. 1 replays in real
+            time, 10 runs ten times faster, 0 sends as fast as possible.
+        concurrency: Number of concurrent client connections.
+        keepalive: Reuse one connection per worker instead of connecting
+            per request (the hubs and nginx connect per request).
+    """
+
+    def __init__(self, host: str, port: int, speed: float = 1.0, concurrency: int = 8, keepalive: bool = False):
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.concurrency = concurrency
+        self.keepalive = keepalive
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.status_counts: Dict[int, int] = {}
+        self.errors = 0
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or not self.keepalive:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def _send(self, req: dict):
+        headers = dict(req.get("headers", {}))
+        body = req.get("body") or None
+        if body is not None:
+            headers["Content-Length"] = str(len(body))
+        if not self.keepalive:
+            headers["Connection"] = "close"
+
+        start = time.perf_counter()
+        try:
+            conn = self._connection()
+            conn.request(req["method"], req["path"], body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.latencies.append(elapsed)
+                self.status_counts[resp.status] = self.status_counts.get(resp.status, 0) + 1
+        except (OSError, http.client.HTTPException) as e:
+            logging.debug(f"Request {req['method']} {req['path']} failed: {e}")
+            with self._lock:
+                self.errors += 1
+            self._local.conn = None
+        finally:
+            if not self.keepalive and getattr(self._local, "conn", None) is not None:
+                self._local.conn.close()
+                self._local.conn = None
+
+    def run(self, requests: List[dict]) -> float:
+        """
+        Send all requests following their `ts` offsets.
+
+        Returns:
+            Wall clock seconds the run took.
+        """
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="loadgen") as pool:
+            for req in requests:
+                if self.speed > 0:
+                    due = start + req["ts"] / self.speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                pool.submit(self._send, req)
+        return time.perf_counter() - start
+
+
+def count_readings(db_path: Union[str, Path]) -> int:
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+
+
+def build_report(generator: LoadGenerator, elapsed: float, readings: Optional[int] = None,
+                 broker: Optional[StandInBroker] = None, mqtt_published: Optional[int] = None,
+                 queue_samples: Optional[List[int]] = None) -> dict:
+    """
+    Summarize a finished run into a flat dictionary.
+
+    `readings` is the number of readings the run added to the database.
+    """
+    total = len(generator.latencies) + generator.errors
+    report = {
+        "requests": total,
+        "errors": generator.errors,
+        "status_counts": dict(sorted(generator.status_counts.items())),
+        "elapsed_sec": round(elapsed, 3),
+        "requests_per_sec": round(total / elapsed, 1) if elapsed else 0.0,
+        "latency_p50_ms": round(percentile(generator.latencies, 50) * 1000, 3),
+        "latency_p99_ms": round(percentile(generator.latencies, 99) * 1000, 3),
+        "latency_max_ms": round(max(generator.latencies, default=0.0) * 1000, 3),
+    }
+
+    if readings is not None:
+        report["db_readings"] = readings
+        report["db_readings_per_sec"] = round(readings / elapsed, 1) if elapsed else 0.0
+
+    if broker is not None:
+        report["mqtt_published"] = mqtt_published
+        report["mqtt_broker_received"] = broker.received
+        report["mqtt_queue_max"] = max(queue_samples or [0])
+        report["mqtt_queue_mean"] = round(sum(queue_samples) / len(queue_samples), 2) if queue_samples else 0.0
+
+    return report
+
+
+def run_local(requests: List[dict], speed: float = 1.0, concurrency: int = 8, keepalive: bool = False,
+              mqtt: bool = True, broker_delay: float = 0.0, db_path: Optional[Union[str, Path]] = None) -> dict:
+    """
+    Start a hub server (and stand-in broker) on loopback, drive it and report.
+
+    Args:
+        requests: Request schedule from `synthesize_traffic` or `load_capture`.
+        speed: See `LoadGenerator`.
+        concurrency: See `LoadGenerator`.
+        keepalive: See `LoadGenerator`.
+        mqtt: Publish readings to a stand-in broker through MQTTManager.
+        broker_delay: Seconds the stand-in broker sleeps per publish.
+        db_path: Database file to write to. A temporary file is used if None.
+    """
+    from database import Database
+    from hub_server import EfergyHTTPServer, FakeEfergyServer
+    from mqtt_manager import MQTTManager
+
+    with tempfile.TemporaryDirectory(prefix="loadgen-") as tmp_dir:
+        db_path = Path(db_path) if db_path else Path(tmp_dir) / "readings.db"
+        database = Database(db_path)
+        database.setup()
+        # An existing --db may already hold readings
+        readings_before = count_readings(db_path)
+
+        broker = None
+        if mqtt:
+            broker = StandInBroker(delay=broker_delay)
+            broker.start()
+            mqtt_manager = MQTTManager(retry_interval=1, enabled=True, broker=broker.address[0], port=broker.address[1])
+
+            # Don't let the initial CONNACK wait show up as request latency
+            deadline = time.monotonic() + 5
+            while mqtt_manager.enabled and not mqtt_manager.connected and time.monotonic() < deadline:
+                time.sleep(0.01)
+        else:
+            mqtt_manager = MQTTManager(enabled=False)
+
+        published = {"count": 0}
+        if mqtt_manager.enabled:
+            original_publish = mqtt_manager.publish
+
+            def counting_publish(*args, **kwargs):
+                published["count"] += 1
+                return original_publish(*args, **kwargs)
+
+            mqtt_manager.publish = counting_publish
+
+        httpd = EfergyHTTPServer(("127.0.0.1", 0), FakeEfergyServer, database, mqtt_manager)
+        server_thread = threading.Thread(target=httpd.serve_forever, name="loadgen-server", daemon=True)
+        server_thread.start()
+
+        sampler = _QueueSampler(mqtt_manager)
+        sampler.start()
+
+        generator = LoadGenerator("127.0.0.1", httpd.server_port, speed, concurrency, keepalive)
+        try:
+            elapsed = generator.run(requests)
+
+            # Give the paho network loop a moment to flush its queue
+            if broker is not None:
+                deadline = time.monotonic() + 5
+                while broker.received < published["count"] and time.monotonic() < deadline:
+                    time.sleep(0.05)
+        finally:
+            sampler.stop()
+            httpd.shutdown()
+            httpd.server_close()
+            server_thread.join(timeout=5)
+            if mqtt_manager.enabled:
+                mqtt_manager.client.loop_stop()
+                mqtt_manager.client.disconnect()
+            if broker is not None:
+                broker.stop()
+
+        return build_report(
+            generator, elapsed, readings=count_readings(db_path) - readings_before, broker=broker,
+            mqtt_published=published["count"], queue_samples=sampler.samples
+        )
+
+
+def run_remote(requests: List[dict], host: str, port: int, speed: float = 1.0,
+               concurrency: int = 8, keepalive: bool = False) -> dict:
+    """Drive an already running hub server. DB and MQTT stats are not available."""
+    generator = LoadGenerator(host, port, speed, concurrency, keepalive)
+    elapsed = generator.run(requests)
+    return build_report(generator, elapsed)
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description="Load generator for the Efergy hub server")
+    parser.add_argument("--hubs", type=int, default=4, help="number of simulated hubs")
+    parser.add_argument("--sensors", type=int, default=3, help="CT sensors per hub")
+    parser.add_argument("--interval", type=float, default=6.0, help="seconds between posts per hub")
+    parser.add_argument("--duration", type=float, default=60.0, help="schedule length in seconds")
+    parser.add_argument("--versions", default="h2,h3", help="comma separated hub versions (h1,h2,h3)")
+    parser.add_argument("--ping-every", type=int, default=10, help="send an eh-ping every N posts, 0 disables")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", help="replay a JSON lines capture file instead of synthesizing")
+    parser.add_argument("--record", help="write the request schedule to a capture file")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression, 0 = as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--keepalive", action="store_true", help="reuse client connections")
+    parser.add_argument("--target", help="host:port of a running server instead of an in-process one")
+    parser.add_argument("--no-mqtt", action="store_true", help="disable the stand-in broker")
+    parser.add_argument("--broker-delay", type=float, default=0.0, help="seconds the stand-in broker waits per publish")
+    parser.add_argument("--db", help="database file for the in-process server (default: temporary)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    if args.replay:
+        requests = load_capture(args.replay)
+    else:
+        requests = synthesize_traffic(
+            args.hubs, args.sensors, args.interval, args.duration,
+            versions=[v.strip() for v in args.versions.split(",") if v.strip()],
+            ping_every=args.ping_every, seed=args.seed
+        )
+
+    if args.record:
+        write_capture(args.record, requests)
+
+    if args.target:
+        host, _, port = args.target.rpartition(":")
+        report = run_remote(requests, host, int(port), args.speed, args.concurrency, args.keepalive)
+    else:
+        report = run_local(
+            requests, args.speed, args.concurrency, args.keepalive,
+            mqtt=not args.no_mqtt, broker_delay=args.broker_delay, db_path=args.db
+        )
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:>24}: {value}")
+
+    return report
+
+
+if __name__ == "__main__":
+    main()
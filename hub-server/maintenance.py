@@ -0,0 +1,65 @@
+"""
+Background SQLite maintenance: periodic PASSIVE WAL checkpoints and
+PRAGMA optimize, run off the ingest path on their own thread.
+"""
+import logging
+import threading
+import time
+from typing import Optional
+from database import Database
+
+
+class DatabaseMaintenance:
+    """
+    Args:
+        database: The Database to maintain.
+        checkpoint_interval: Seconds between PASSIVE checkpoints, 0 disables.
+            Defaults to the database's profile.
+        optimize_interval: Seconds between PRAGMA optimize runs, 0 disables.
+            Defaults to the database's profile.
+    """
+
+    def __init__(self, database: Database, checkpoint_interval: Optional[float] = None,
+                 optimize_interval: Optional[float] = None):
+        self.database = database
+        if checkpoint_interval is None:
+            checkpoint_interval = database.profile["checkpoint_interval"]
+        if optimize_interval is None:
+            optimize_interval = database.profile["optimize_interval"]
+        self.checkpoint_interval = checkpoint_interval
+        self.optimize_interval = optimize_interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def maintenance_loop(self):
+        intervals = [i for i in (self.checkpoint_interval, self.optimize_interval) if i > 0]
+        tick = min(intervals)
+        last_checkpoint = last_optimize = time.monotonic()
+        while not self._stop_event.wait(tick):
+            now = time.monotonic()
+            try:
+                if self.checkpoint_interval > 0 and now - last_checkpoint >= self.checkpoint_interval:
+                    self.database.checkpoint("PASSIVE")
+                    last_checkpoint = now
+                if self.optimize_interval > 0 and now - last_optimize >= self.optimize_interval:
+                    self.database.optimize()
+                    last_optimize = now
+            except Exception:
+                logging.exception("Unhandled exception in database maintenance")
+        logging.debug("Database maintenance thread stopping")
+
+    def start(self):
+        """Start the thread, unless both intervals are disabled."""
+        if self.checkpoint_interval <= 0 and self.optimize_interval <= 0:
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.maintenance_loop, name='db-maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
@@ -0,0 +1,282 @@
+"""
+Lightweight Prometheus-style metrics.
+
+Instruments are module-level objects updated from the hot paths and
+rendered in the Prometheus text exposition format by a small HTTP server
+on a separate port. Updates are a dict lookup and an add under an
+uncontended lock, so they are cheap enough to leave on in production.
+"""
+import bisect
+import logging
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    """Holds metrics and renders them in registration order."""
+
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A monotonically increasing value, optionally split by label values."""
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """
+    A value that can go up and down.
+
+    Either set explicitly, or computed at scrape time by a function that
+    returns a float (unlabelled) or a dict of {labelvalues tuple: float}.
+    """
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable] = None
+
+    def set(self, value: float, *labelvalues: str):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def set_function(self, function: Optional[Callable]):
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                result = self._function()
+            except Exception:
+                logging.exception(f"Failed to collect gauge {self.name}")
+                return
+            items = sorted(result.items()) if isinstance(result, dict) else [((), result)]
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        for labelvalues, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Counts observations into fixed buckets and tracks their sum."""
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def count(self, *labelvalues: str) -> int:
+        state = self._values.get(labelvalues)
+        return int(sum(state[:-1])) if state else 0
+
+    def time(self, *labelvalues: str) -> "_Timer":
+        """Context manager observing the elapsed wall time of its block."""
+        return _Timer(self, labelvalues)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for labelvalues, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_value(state[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labelvalues", "start")
+
+    def __init__(self, histogram: Histogram, labelvalues: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+        return False
+
+
+# ---------------- Instruments ----------------
+HTTP_REQUEST_DURATION = Histogram(
+    "efergy_http_request_duration_seconds", "Hub request handling time by path.", ["path"]
+)
+PARSER_LINES = Counter(
+    "efergy_parser_lines_total", "Sensor lines seen by the payload parser.", ["hub_version", "result"]
+)
+DB_COMMIT_DURATION = Histogram(
+    "efergy_db_commit_duration_seconds", "Time spent in SQLite commits."
+)
+DB_LOCK_WAIT = Histogram(
+    "efergy_db_lock_wait_seconds", "Time spent waiting for the shared DB connection lock."
+)
+DB_CHECKPOINT_DURATION = Histogram(
+    "efergy_db_checkpoint_duration_seconds", "Time spent in background WAL checkpoints."
+)
+DB_WAL_FRAMES = Gauge(
+    "efergy_db_wal_frames", "Frames in the WAL at the last background checkpoint."
+)
+AGGREGATION_HOUR_DURATION = Histogram(
+    "efergy_aggregation_hour_duration_seconds", "Time to aggregate a single hour into energy_hourly."
+)
+MQTT_PUBLISH_DURATION = Histogram(
+    "efergy_mqtt_publish_duration_seconds", "Time to hand a message to the MQTT client."
+)
+MQTT_PUBLISH_SKIPPED = Counter(
+    "efergy_mqtt_publish_skipped_total", "Messages dropped because MQTT was not connected."
+)
+MQTT_QUEUE_DEPTH = Gauge(
+    "efergy_mqtt_queue_depth", "Packets waiting in the MQTT client's outgoing queue."
+)
+SENSORS_ONLINE = Gauge(
+    "efergy_sensors_online", "Sensors that reported within LIVENESS_TIMEOUT."
+)
+SENSOR_LAST_READING_AGE = Gauge(
+    "efergy_sensor_last_reading_age_seconds", "Seconds since the last reading from each sensor.", ["label"]
+)
+
+# label -> unix time of the last accepted reading, feeds SENSOR_LAST_READING_AGE
+_last_reading_ts: Dict[str, float] = {}
+
+
+def record_reading(label: str, timestamp: Optional[float] = None):
+    """Note that a reading for `label` was accepted."""
+    _last_reading_ts[label] = time.time() if timestamp is None else timestamp
+
+
+def _last_reading_ages() -> Dict[Tuple[str, ...], float]:
+    now = time.time()
+    return {(label,): round(now - ts, 3) for label, ts in list(_last_reading_ts.items())}
+
+
+SENSOR_LAST_READING_AGE.set_function(_last_reading_ages)
+
+
+# ---------------- Exposition server ----------------
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve /metrics on a background thread.
+
+    Returns:
+        The running server; call `shutdown()` to stop it.
+    """
+    httpd = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logging.info(f"Serving metrics on {host} port {httpd.server_port}...")
+    return httpd
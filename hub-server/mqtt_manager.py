@@ -1,10 +1,11 @@
 import json
 import logging
 import time
+from typing import Dict, List, Optional, Tuple, Union
 import paho.mqtt.client as mqtt
 from config import (
     MQTT_ENABLED, MQTT_BROKER, MQTT_PORT, MQTT_USER, MQTT_PASS,
-    MQTT_BASE_TOPIC, HA_DISCOVERY, HA_DISCOVERY_PREFIX,
+    MQTT_BASE_TOPIC, MQTT_AVAILABILITY, MQTT_BATCHED, MQTT_BATCHED_PER_SENSOR, HA_DISCOVERY, HA_DISCOVERY_PREFIX,
     POWER_NAME, POWER_ICON, POWER_DEVICE_CLASS, POWER_STATE_CLASS,
     POWER_UNIT_OF_MEASUREMENT_H1, POWER_VALUE_TEMPLATE_H1,
     POWER_UNIT_OF_MEASUREMENT_H2, POWER_VALUE_TEMPLATE_H2,
@@ -13,6 +14,7 @@ from config import (
     ENERGY_UNIT_OF_MEASUREMENT, ENERGY_VALUE_TEMPLATE,
     DEVICE_NAME, DEVICE_MODEL, DEVICE_IDENTIFIERS, DEVICE_MANUFACTURER
 )
+from metrics import MQTT_PUBLISH_DURATION, MQTT_PUBLISH_SKIPPED
 
 ENERGY_SENSOR_LABEL = "energy_consumption"
 
@@ -20,18 +22,54 @@ ENERGY_SENSOR_LABEL = "energy_consumption"
 def get_topic(label, sensor_type="power"):
     if sensor_type == "power":
         return f"{MQTT_BASE_TOPIC}/{label}/power"
+    elif sensor_type == "availability":
+        return f"{MQTT_BASE_TOPIC}/{label}/availability"
     else:
         return f"{MQTT_BASE_TOPIC}/{label}/energy"
 
 
+def get_hub_topic(hub):
+    """Batched power topic of a hub, its MAC without separators, e.g. home/efergy/hub_410a04001ec0/power."""
+    slug = "".join(c for c in hub if c.isalnum()).lower()
+    return f"{MQTT_BASE_TOPIC}/hub_{slug}/power"
+
+
+def batched_value_template(label: str, value_template: str) -> str:
+    """
+    Wrap a power value template written for a per-sensor message
+    (`value_json.value`) so it reads `label` from the hub's batched message.
+    value_json is rebound to this sensor's value, so any template works, and a
+    post without the sensor keeps the current state instead of rendering
+    undefined.
+    """
+    return (
+        f"{{% if '{label}' in value_json.sensors %}}"
+        f"{{% set value_json = {{'value': value_json.sensors['{label}']}} %}}{value_template}"
+        f"{{% else %}}{{{{ this.state }}}}{{% endif %}}"
+    )
+
+
 class MQTTManager:
-    def __init__(self, max_retries: int = 10, retry_interval: int = 5):
-        self.enabled = MQTT_ENABLED
+    def __init__(self, max_retries: int = 10, retry_interval: int = 5,
+                 enabled: bool = MQTT_ENABLED, broker: str = MQTT_BROKER, port: int = MQTT_PORT,
+                 connect: bool = True, availability: bool = MQTT_AVAILABILITY, batched: bool = MQTT_BATCHED,
+                 batched_per_sensor: bool = MQTT_BATCHED_PER_SENSOR):
+        self.enabled = enabled
+        # One message per hub post; per-sensor topics only if also asked for
+        self.batched = batched
+        self.per_sensor_topics = not batched or batched_per_sensor
+        # label -> state topic its discovery config was published with
+        self.discovery_topics: Dict[str, str] = {}
+        # Per-sensor online/offline topics, published by the liveness monitor
+        self.availability_enabled = availability
+        self.broker = broker
+        self.port = port
         self.discovery_enabled = HA_DISCOVERY
         self.discovery_sent = set()
         self.max_retries = max_retries
         self.retry_interval = retry_interval
         self.connected = False
+        self.started = False
 
         if not self.enabled:
             logging.debug("MQTT disabled via config.")
@@ -50,19 +88,32 @@ class MQTTManager:
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
 
+        if connect:
+            self.start()
+
+
+    def start(self):
+        """
+        Connect to the broker, retrying, and start the network loop.
+        Publishes before this are skipped.
+        """
+        if not self.enabled or self.started:
+            return
+
         # Attempt initial connection with retries
         self._connect_with_retry()
 
         # Start network loop in background
         self.client.loop_start()
+        self.started = True
 
 
     def _connect_with_retry(self):
         retries = 0
         while retries < self.max_retries:
             try:
-                self.client.connect(MQTT_BROKER, MQTT_PORT)
-                logging.debug(f"Connected to MQTT broker at {MQTT_BROKER}:{MQTT_PORT}")
+                self.client.connect(self.broker, self.port)
+                logging.debug(f"Connected to MQTT broker at {self.broker}:{self.port}")
                 return
             except Exception as e:
                 retries += 1
@@ -87,10 +138,16 @@ class MQTTManager:
 
 
     # Generic publishing
-    def publish(self, topic: str, payload: dict, retain: bool = False):
+    def publish(self, topic: str, payload: Union[dict, str], retain: bool = False):
+        """Publish `payload` as JSON, or as is if it's a string."""
         if not self.enabled:
             return
 
+        if not self.started:
+            # Still starting up, don't hold the request waiting for a connection
+            MQTT_PUBLISH_SKIPPED.inc()
+            return
+
         # Wait until MQTT is connected
         wait_count = 0
         while not self.connected and wait_count < 50:
@@ -100,17 +157,57 @@ class MQTTManager:
 
         if not self.connected:
             logging.warning(f"MQTT not connected, skipping publish: {topic}")
+            MQTT_PUBLISH_SKIPPED.inc()
             return
 
         try:
-            json_payload = json.dumps(payload)
-            self.client.publish(topic, json_payload, retain=retain)
-            logging.debug(f"MQTT published to {topic}: {json_payload[:400]}")
+            with MQTT_PUBLISH_DURATION.time():
+                json_payload = payload if isinstance(payload, str) else json.dumps(payload)
+                self.client.publish(topic, json_payload, retain=retain)
+            logging.debug("MQTT published to %s: %.400s", topic, json_payload)
         except Exception as e:
             logging.error(f"MQTT publish failed: {topic} — {e}")
 
 
-    def publish_power_discovery(self, label: str, sid: str, topic: str, hub_version: str):
+    def stop(self, timeout: float = 2.0):
+        """
+        Wait up to `timeout` seconds for queued messages to be sent, then
+        disconnect and stop the network loop. Later publishes are no-ops.
+        """
+        if not self.enabled:
+            return
+
+        deadline = time.monotonic() + timeout
+        while self.connected and self.queue_depth() > 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        pending = self.queue_depth()
+        if pending:
+            logging.warning(f"MQTT stopping with {pending} unsent packets")
+
+        self.enabled = False
+        try:
+            self.client.disconnect()
+        except Exception as e:
+            logging.debug(f"MQTT disconnect failed: {e}")
+        self.client.loop_stop()
+        self.connected = False
+        logging.debug("MQTT stopped.")
+
+
+    def queue_depth(self) -> int:
+        """Number of packets waiting in paho's outgoing queue."""
+        if not self.enabled:
+            return 0
+        return len(getattr(self.client, "_out_packet", ()))
+
+
+    def publish_power_discovery(self, label: str, sid: str, topic: str, hub_version: str, batched: bool = False):
+        """
+        Home Assistant discovery for a power sensor reading `topic`. With
+        `batched`, `topic` is the hub's batched topic: the value template
+        picks this sensor's value out of it, and the post timestamp and hub
+        become entity attributes.
+        """
         if not self.enabled or not HA_DISCOVERY:
             return
 
@@ -149,8 +246,18 @@ class MQTTManager:
             }
         }
 
+        if batched:
+            payload["value_template"] = batched_value_template(label, value_template)
+            payload["json_attributes_topic"] = topic
+            payload["json_attributes_template"] = \
+                "{{ {'timestamp': value_json.timestamp, 'hub': value_json.hub} | tojson }}"
+
+        if self.availability_enabled:
+            payload["availability_topic"] = get_topic(label, sensor_type="availability")
+
         self.publish(config_topic, payload, retain=True)
         self.discovery_sent.add(label)
+        self.discovery_topics[label] = topic
 
 
     def publish_energy_discovery(self, topic: str):
@@ -188,18 +295,60 @@ class MQTTManager:
         if not self.enabled:
             return
 
-        logging.debug(f"Publishing power for {label} with value {value}")
+        logging.debug("Publishing power for %s with value %s", label, value)
         topic = get_topic(label, sensor_type="power")
 
         # Publish actual reading
         self.publish(topic, {"value": value})
 
-        # Publish discovery ONLY once
-        if self.discovery_enabled and label not in self.discovery_sent:
+        # Publish discovery ONLY once; batched discovery points at the hub topic instead
+        if self.discovery_enabled and not self.batched and label not in self.discovery_sent:
             self.publish_power_discovery(label, sid, topic, hub_version)
             self.discovery_sent.add(label)
 
 
+    def publish_hub_power(self, hub: str, hub_version: str, readings: List[Tuple[str, str, float]], timestamp: int):
+        """
+        Batched mode: publish every reading of one hub post as a single
+        message, {"hub", "hub_version", "timestamp", "sensors": {label: value}}.
+        Discovery is published for sensors not yet discovered on this hub's topic.
+
+        Args:
+            hub: The hub's MAC.
+            hub_version: h1, h2 or h3.
+            readings: (label, sid, raw value) per sensor line.
+            timestamp: Time the post was received.
+        """
+        if not self.enabled or not self.batched or not readings:
+            return
+
+        topic = get_hub_topic(hub)
+        self.publish(topic, {
+            "hub": hub,
+            "hub_version": hub_version,
+            "timestamp": timestamp,
+            "sensors": {label: value for label, _, value in readings},
+        })
+
+        if self.discovery_enabled:
+            for label, sid, _ in readings:
+                # Again if the sensor moved to another hub
+                if self.discovery_topics.get(label) != topic:
+                    self.publish_power_discovery(label, sid, topic, hub_version, batched=True)
+
+
+    def publish_availability(self, label: str, online: bool):
+        """
+        Publish "online" or "offline" for a sensor, retained so Home
+        Assistant gets the current state when it (re)subscribes.
+        """
+        if not self.enabled or not self.availability_enabled:
+            return
+
+        logging.debug("Publishing availability for %s: %s", label, "online" if online else "offline")
+        self.publish(get_topic(label, sensor_type="availability"), "online" if online else "offline", retain=True)
+
+
     def publish_energy(self, value_kwh: float):
         """
         Publish energy consumption (kWh).
@@ -218,9 +367,15 @@ class MQTTManager:
             self.publish_energy_discovery(topic)
 
 
-    def publish_startup_discovery(self, labels):
+    def publish_startup_discovery(self, labels, hubs: Optional[Dict[str, str]] = None):
         """
         Publish HA discovery for all stored sensors at startup.
+
+        Args:
+            labels: Stored sensor labels.
+            hubs: Last hub of each label, needed in batched mode to point
+                discovery at the hub topic. Labels without a known hub are
+                discovered when they next report.
         """
         if not self.enabled or not HA_DISCOVERY:
             return
@@ -241,6 +396,12 @@ class MQTTManager:
             hub_version = parts[1]
             sid = parts[2]
 
+            if self.batched:
+                hub = (hubs or {}).get(label)
+                if hub:
+                    self.publish_power_discovery(label, sid, get_hub_topic(hub), hub_version, batched=True)
+                continue
+
             power_topic = get_topic(label, sensor_type="power")
             self.publish_power_discovery(label, sid, power_topic, hub_version)
 
@@ -0,0 +1,173 @@
+"""
+Bounded, rate-limited capture of unrecognized requests.
+
+Unknown packets are kept in a fixed-size ring buffer with their bodies
+truncated to a byte cap, logged as a single line per admitted packet
+(per-client rate limited), and optionally appended to a rotating JSON
+lines capture file in the same format `loadgen.py --replay` reads.
+Everything else is folded into counters and a periodic summary line.
+"""
+import base64
+import json
+import logging
+import logging.handlers
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import List, Mapping, Optional
+from metrics import Counter
+from config import (
+    UNKNOWN_PACKET_BUFFER, UNKNOWN_PACKET_MAX_BYTES, UNKNOWN_PACKET_RATE_LIMIT, UNKNOWN_PACKET_RATE_WINDOW,
+    UNKNOWN_PACKET_CAPTURE_FILE, UNKNOWN_PACKET_CAPTURE_MAX_BYTES, UNKNOWN_PACKET_CAPTURE_BACKUPS,
+    UNKNOWN_PACKET_SUMMARY_INTERVAL
+)
+
+UNKNOWN_PACKETS = Counter(
+    "efergy_unknown_packets_total", "Unrecognized requests, by whether they were logged or rate limited.", ["result"]
+)
+
+# Upper bound on the number of clients tracked for rate limiting
+MAX_TRACKED_CLIENTS = 1024
+
+
+class UnknownPacketCapture:
+    """
+    Records unrecognized requests without letting them cost unbounded CPU,
+    memory or disk.
+
+    Args:
+        buffer_size: Number of recent packets kept in memory.
+        max_bytes: Bodies are truncated to this many bytes in the buffer,
+            logs and capture file.
+        rate_limit: Packets logged per client per `rate_window` seconds,
+            the rest are only counted.
+        rate_window: Rate limiting window in seconds.
+        capture_file: Optional path of a rotating JSON lines capture file.
+        capture_max_bytes: Rotate the capture file at this size.
+        capture_backups: Number of rotated capture files to keep.
+        summary_interval: Seconds between summary log lines.
+    """
+
+    def __init__(self,
+                 buffer_size: int = UNKNOWN_PACKET_BUFFER,
+                 max_bytes: int = UNKNOWN_PACKET_MAX_BYTES,
+                 rate_limit: int = UNKNOWN_PACKET_RATE_LIMIT,
+                 rate_window: float = UNKNOWN_PACKET_RATE_WINDOW,
+                 capture_file: Optional[str] = UNKNOWN_PACKET_CAPTURE_FILE,
+                 capture_max_bytes: int = UNKNOWN_PACKET_CAPTURE_MAX_BYTES,
+                 capture_backups: int = UNKNOWN_PACKET_CAPTURE_BACKUPS,
+                 summary_interval: float = UNKNOWN_PACKET_SUMMARY_INTERVAL):
+        self.max_bytes = max_bytes
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.summary_interval = summary_interval
+
+        self._buffer = deque(maxlen=buffer_size)
+        self._clients: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.total = 0
+        self.suppressed = 0
+        self._summary_total = 0
+        self._summary_suppressed = 0
+        self._last_summary = time.monotonic()
+
+        self._capture_logger = None
+        if capture_file:
+            self._capture_logger = logging.getLogger(f"efergy.capture.{id(self)}")
+            self._capture_logger.propagate = False
+            self._capture_logger.setLevel(logging.INFO)
+            handler = logging.handlers.RotatingFileHandler(
+                capture_file, maxBytes=capture_max_bytes, backupCount=capture_backups, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._capture_logger.addHandler(handler)
+
+    def _admit(self, client: str, now: float) -> bool:
+        """Fixed-window rate limit per client. Must hold self._lock."""
+        state = self._clients.get(client)
+        if state is None or now - state[0] >= self.rate_window:
+            state = [now, 0]
+            self._clients[client] = state
+            self._clients.move_to_end(client)
+            while len(self._clients) > MAX_TRACKED_CLIENTS:
+                self._clients.popitem(last=False)
+        state[1] += 1
+        return state[1] <= self.rate_limit
+
+    def record(self, client: str, method: str, path: str, headers: Mapping[str, str],
+               body: bytes = b"", content_length: Optional[int] = None) -> bool:
+        """
+        Record an unrecognized request.
+
+        Args:
+            client: Client IP address, used for rate limiting.
+            method: HTTP method.
+            path: Raw request path.
+            headers: Request headers.
+            body: Request body, at most `max_bytes` are kept.
+            content_length: Declared body length if the body was not read in full.
+
+        Returns:
+            True if the packet was logged, False if it was rate limited.
+        """
+        now = time.monotonic()
+        body = body[:self.max_bytes] if body else b""
+        length = len(body) if content_length is None else content_length
+
+        with self._lock:
+            self.total += 1
+            self._summary_total += 1
+            admitted = self._admit(client, now)
+            if not admitted:
+                self.suppressed += 1
+                self._summary_suppressed += 1
+
+            summary = None
+            if now - self._last_summary >= self.summary_interval:
+                summary = (self._summary_total, self._summary_suppressed, now - self._last_summary)
+                self._summary_total = self._summary_suppressed = 0
+                self._last_summary = now
+
+        if summary:
+            logging.warning("Unknown packets: %d in the last %.0fs (%d rate limited)", summary[0], summary[2],
+                            summary[1])
+
+        if not admitted:
+            UNKNOWN_PACKETS.inc("suppressed")
+            return False
+
+        UNKNOWN_PACKETS.inc("logged")
+        record = {
+            "ts": time.time(),
+            "client": client,
+            "method": method,
+            "path": path,
+            "headers": dict(headers),
+            "content_length": length,
+            "body": body,
+        }
+        self._buffer.append(record)
+
+        logging.warning("Unknown packet from %s: %s %s (Content-Type: %s, %d bytes)",
+                        client, method, path, headers.get("Content-Type"), length)
+        if body and logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Unknown packet body (first %d bytes) HEX: %s", len(body), body.hex(" "))
+
+        if self._capture_logger is not None:
+            try:
+                self._capture_logger.info(json.dumps({**record, "body": base64.b64encode(body).decode("ascii")}))
+            except Exception:
+                logging.exception("Failed to write unknown packet capture")
+
+        return True
+
+    def recent(self) -> List[dict]:
+        """Return the buffered packets, oldest first."""
+        return list(self._buffer)
+
+    def close(self):
+        if self._capture_logger is not None:
+            for handler in list(self._capture_logger.handlers):
+                handler.close()
+                self._capture_logger.removeHandler(handler)
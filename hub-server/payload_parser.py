@@ -1,6 +1,7 @@
 import json
 import logging
 from typing import List, Optional
+from metrics import PARSER_LINES
 
 def parse_sensor_line(line: str, hub_version: str) -> Optional[dict]:
     """
@@ -15,6 +16,7 @@ def parse_sensor_line(line: str, hub_version: str) -> Optional[dict]:
         data = line.split("|")
         if len(data) < 4:
             logging.warning(f"Malformed line, skipping: '{line}'")
+            PARSER_LINES.inc(hub_version, "rejected")
             return None
 
         sid = data[0]
@@ -44,18 +46,19 @@ def parse_sensor_line(line: str, hub_version: str) -> Optional[dict]:
                     key = key.strip().upper()
                     num = float(val)
                     metrics_list.append((key, num))
-                    logging.debug(f"[EFMS1] SID={sid}, Metric={key}, Value={num}")
+                    logging.debug("[EFMS1] SID=%s, Metric=%s, Value=%s", sid, key, num)
                 except Exception as e:
                     logging.warning(f"[EFMS1] Failed to parse metric '{metric}': {e}")
 
             if rssi_val is not None:
-                logging.debug(f"[EFMS1] SID={sid}, RSSI={rssi_val}")
+                logging.debug("[EFMS1] SID=%s, RSSI=%s", sid, rssi_val)
             
             return {
                 "type": "EFMS",
                 "sid": sid,
                 "metrics": metrics_list,
-                "rssi": rssi_val
+                "rssi": rssi_val,
+                "line": line.strip()
             }
 
         if hub_version == 'h1':
@@ -90,14 +93,17 @@ def parse_sensor_line(line: str, hub_version: str) -> Optional[dict]:
             "label": label,
             "value": value,
             "hub_version": hub_version,
-            "rssi": rssi_val
+            "rssi": rssi_val,
+            "line": line.strip()
         }
 
     except (IndexError, ValueError, TypeError, json.JSONDecodeError) as e:
         logging.warning(f"Failed to parse line '{line}': {e}")
+        PARSER_LINES.inc(hub_version, "rejected")
         return None
     except Exception as e:
         logging.error(f"Unexpected error processing line '{line}': {e}")
+        PARSER_LINES.inc(hub_version, "rejected")
         return None
 
 
@@ -118,4 +124,7 @@ def parse_sensor_payload(post_data_bytes: bytes, hub_version: str) -> List[dict]
         if parsed:
             results.append(parsed)
 
+    if results:
+        PARSER_LINES.inc(hub_version, "parsed", amount=len(results))
+
     return results
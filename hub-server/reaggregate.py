@@ -0,0 +1,236 @@
+"""
+Recompute energy_hourly for a time range, e.g. after a calibration change.
+
+Hours already in energy_hourly are never recomputed by the server, so
+correcting POWER_FACTOR, MAINS_VOLTAGE or a per-sensor SENSOR_CALIBRATION
+entry only affects new hours. This command re-integrates the stored readings
+of a range: the range is cut into time slices, each integrated by a worker
+process on its own read-only connection, and the results replace the range
+in energy_hourly in a single write transaction. Archived months are read
+from their compressed chunks like any other.
+
+Usage:
+    python reaggregate.py --start 2025-01-01 --end 2025-07-01
+    python reaggregate.py --calibration calibration.json --workers 4
+    python reaggregate.py --labels efergy_h2_741459,efergy_h3_815751 --dry-run
+
+The server can keep running; its live energy total jumps to the recomputed
+value at its next aggregation pass.
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from config import (
+    ENERGY_INTEGRATION_METHOD, ENERGY_INTEGRATION_MAX_GAP, ENERGY_INTEGRATION_SPLIT_HOURS, SENSOR_CALIBRATION
+)
+import archive
+from database import Database, raw_to_kw
+from energy_integration import METHODS, integrate_rows
+
+DEFAULT_DB_PATH = Path(__file__).resolve().parent / "data/readings.db"
+# Hours per worker task
+DEFAULT_SLICE_HOURS = 24 * 7
+
+
+def parse_time(text: str) -> int:
+    """Epoch seconds from an integer or an ISO date/time in local time."""
+    if text.isdigit():
+        return int(text)
+    return int(datetime.fromisoformat(text).timestamp())
+
+
+def _connect_read_only(db_path) -> sqlite3.Connection:
+    return sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+
+
+def _query_one(db_path, sql: str, params: tuple = ()):
+    conn = _connect_read_only(db_path)
+    try:
+        return conn.execute(sql, params).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def aggregate_slice(db_path: str, start: int, end: int, labels: Sequence[str] = (),
+                    calibration: Optional[Dict[str, dict]] = None, method: str = ENERGY_INTEGRATION_METHOD,
+                    max_gap: int = ENERGY_INTEGRATION_MAX_GAP,
+                    split_hours: bool = ENERGY_INTEGRATION_SPLIT_HOURS) -> Tuple[int, int, Dict[int, float], int]:
+    """
+    Integrate the hours in [start, end) on a read-only connection. Runs in a
+    worker process.
+
+    Returns:
+        (start, end, {hour_start: kWh}, readings read).
+    """
+    labels = list(labels)
+    conn = _connect_read_only(db_path)
+    try:
+        # Archived chunks decoded for the slice, reused for its neighbours
+        decoded: archive.Decoded = {}
+        rows = archive.read_range(conn, start, end, labels, decoded)
+        count = len(rows)
+        # Like aggregate_one_hour, only hours with readings of their own are stored
+        own_hours = {timestamp - timestamp % 3600 for timestamp, _, _ in rows}
+        if split_hours and rows:
+            # Intervals crossing into and out of the slice
+            rows = archive.read_previous(conn, start, labels, decoded) + rows
+            rows += archive.read_next(conn, end, labels, decoded)
+    finally:
+        conn.close()
+
+    kw_rows = [(timestamp, raw_to_kw(label, value, calibration)) for timestamp, label, value in rows]
+    hours = integrate_rows(kw_rows, method=method, max_gap=max_gap, split_hours=split_hours)
+    return start, end, {hour: kwh for hour, kwh in hours.items() if hour in own_hours}, count
+
+
+def time_slices(start: int, end: int, slice_hours: int = DEFAULT_SLICE_HOURS) -> List[Tuple[int, int]]:
+    step = max(1, slice_hours) * 3600
+    return [(slice_start, min(slice_start + step, end)) for slice_start in range(start, end, step)]
+
+
+def reaggregate(database: Database, start: int, end: int, labels: Sequence[str] = (),
+                calibration: Optional[Dict[str, dict]] = None, workers: int = 1,
+                slice_hours: int = DEFAULT_SLICE_HOURS, dry_run: bool = False, **options) -> dict:
+    """
+    Recompute energy_hourly for the hours in [start, end).
+
+    Args:
+        database: The Database whose file is read and written.
+        start: First hour_start to recompute.
+        end: Hour_start after the last one to recompute.
+        labels: Only integrate readings of these labels; all if empty. The
+            hours would then hold only these sensors' energy, so this needs
+            `dry_run`.
+        calibration: Per-sensor overrides, SENSOR_CALIBRATION if None.
+        workers: Worker processes, 1 runs the slices in this process.
+        slice_hours: Hours per worker task.
+        dry_run: Compute and report without writing.
+        **options: method, max_gap and split_hours for integrate_hours.
+
+    Returns:
+        A summary with hour and reading counts and the old and new kWh.
+    """
+    if labels and not dry_run:
+        raise ValueError("Re-aggregating some labels only would overwrite the all-sensor totals, use dry_run")
+    calibration = SENSOR_CALIBRATION if calibration is None else calibration
+    slices = time_slices(start, end, slice_hours)
+    total_hours = (end - start) // 3600
+    hours: Dict[int, float] = {}
+    readings = 0
+    done_hours = 0
+    started = time.monotonic()
+
+    def collect(result):
+        nonlocal readings, done_hours
+        slice_start, slice_end, slice_hours_kwh, count = result
+        hours.update(slice_hours_kwh)
+        readings += count
+        done_hours += (slice_end - slice_start) // 3600
+        elapsed = time.monotonic() - started
+        eta = elapsed / done_hours * (total_hours - done_hours)
+        logging.info(f"Re-aggregated {done_hours}/{total_hours} hours ({done_hours / total_hours:.0%}), "
+                     f"{readings} readings, ETA {eta:.0f}s")
+
+    args = (str(database.db_path),)
+    if workers <= 1:
+        for slice_start, slice_end in slices:
+            collect(aggregate_slice(*args, slice_start, slice_end, labels, calibration, **options))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(aggregate_slice, *args, slice_start, slice_end, labels, calibration, **options)
+                for slice_start, slice_end in slices
+            ]
+            for future in as_completed(futures):
+                collect(future.result())
+
+    old_kwh = _query_one(
+        database.db_path, "SELECT COALESCE(SUM(kwh), 0) FROM energy_hourly WHERE hour_start >= ? AND hour_start < ?",
+        (start, end)
+    )
+
+    written = 0
+    if not dry_run:
+        written = database.replace_hours(hours, start, end)
+
+    return {
+        "hours": total_hours,
+        "hours_with_readings": len(hours),
+        "readings": readings,
+        "old_kwh": old_kwh,
+        "new_kwh": sum(hours[hour] for hour in sorted(hours)),
+        "written": written,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description="Recompute hourly energy from stored readings")
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH), help="database file")
+    parser.add_argument("--start", help="first hour, epoch seconds or ISO local time (default: first reading)")
+    parser.add_argument("--end", help="end of the range, exclusive (default: start of the current hour)")
+    parser.add_argument("--labels", default="",
+                        help="comma separated labels to integrate (default: all), only with --dry-run")
+    parser.add_argument("--calibration", help="JSON file of per-sensor overrides, merged over SENSOR_CALIBRATION")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--slice-hours", type=int, default=DEFAULT_SLICE_HOURS, help="hours per worker task")
+    parser.add_argument("--method", choices=METHODS, default=ENERGY_INTEGRATION_METHOD)
+    parser.add_argument("--max-gap", type=int, default=ENERGY_INTEGRATION_MAX_GAP,
+                        help="max seconds a reading is held, 0 = no cap")
+    parser.add_argument("--split-hours", action=argparse.BooleanOptionalAction,
+                        default=ENERGY_INTEGRATION_SPLIT_HOURS, help="split intervals at hour boundaries")
+    parser.add_argument("--dry-run", action="store_true", help="report without writing")
+    args = parser.parse_args(argv)
+    if args.labels and not args.dry_run:
+        parser.error("--labels only works with --dry-run, energy_hourly holds the total of every sensor")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    calibration = dict(SENSOR_CALIBRATION)
+    if args.calibration:
+        with open(args.calibration, encoding="utf-8") as f:
+            calibration.update(json.load(f))
+
+    database = Database(args.db)
+    database.setup()
+
+    now = int(time.time())
+    end = parse_time(args.end) if args.end else now
+    # Never the current, partial hour
+    end = min(end - (end % 3600), now - (now % 3600))
+    if args.start:
+        start = parse_time(args.start)
+    else:
+        first = _query_one(database.db_path, """
+            SELECT MIN(first) FROM (
+                SELECT MIN(timestamp) AS first FROM readings UNION ALL SELECT MIN(start_ts) FROM archive_chunks
+            )
+        """)
+        start = end if first is None else int(first)
+    start -= start % 3600
+
+    if start >= end:
+        logging.info("Nothing to re-aggregate")
+        return {}
+
+    labels = [label.strip() for label in args.labels.split(",") if label.strip()]
+    summary = reaggregate(
+        database, start, end, labels=labels, calibration=calibration, workers=args.workers,
+        slice_hours=args.slice_hours, dry_run=args.dry_run,
+        method=args.method, max_gap=args.max_gap, split_hours=args.split_hours
+    )
+
+    for key, value in summary.items():
+        print(f"{key:>20}: {value}")
+    return summary
+
+
+if __name__ == "__main__":
+    main()
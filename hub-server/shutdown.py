@@ -0,0 +1,95 @@
+"""
+Coordinated shutdown on SIGTERM/SIGINT.
+
+Docker stops containers with SIGTERM and kills them after a grace period,
+so the server turns both signals into an ordered sequence: stop accepting
+connections, let in-flight requests finish, flush buffered readings and
+MQTT messages, stop background threads and checkpoint the database, with
+each step timed in the log.
+"""
+import logging
+import signal
+import socketserver
+import threading
+import time
+from typing import Callable, List, Tuple
+
+
+def install_signal_handlers(callback: Callable[[int], None]):
+    """Call `callback(signum)` on SIGTERM and SIGINT. Main thread only."""
+    def handler(signum, frame):
+        callback(signum)
+
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+
+
+def wait_for_shutdown_signal() -> str:
+    """
+    Block until SIGTERM or SIGINT arrives.
+
+    Returns:
+        The signal name.
+    """
+    received = []
+    event = threading.Event()
+
+    def on_signal(signum):
+        received.append(signal.Signals(signum).name)
+        event.set()
+
+    install_signal_handlers(on_signal)
+    # Wake up periodically so signal handlers run promptly on every platform
+    while not event.wait(1.0):
+        pass
+    return received[0]
+
+
+def stop_http_server(httpd: socketserver.BaseServer, serve_thread: threading.Thread, timeout: float) -> bool:
+    """
+    Stop `httpd.serve_forever()` running on `serve_thread`, waiting up to
+    `timeout` seconds for the request being handled to finish, then close
+    the listening socket.
+
+    Returns:
+        True if the server drained within the deadline.
+    """
+    stopper = threading.Thread(target=httpd.shutdown, name="http-shutdown", daemon=True)
+    stopper.start()
+    deadline = time.monotonic() + timeout
+    stopper.join(timeout)
+    serve_thread.join(max(0.0, deadline - time.monotonic()))
+    drained = not serve_thread.is_alive()
+    httpd.server_close()
+    if not drained:
+        logging.warning(f"HTTP server did not drain within {timeout}s, continuing shutdown")
+    return drained
+
+
+class ShutdownSequence:
+    """Runs named shutdown steps in order, logging how long each one took."""
+
+    def __init__(self):
+        self.steps: List[Tuple[str, Callable[[], object]]] = []
+
+    def add(self, name: str, step: Callable[[], object]):
+        self.steps.append((name, step))
+
+    def run(self) -> float:
+        """
+        Run every step; a failing step is logged and the rest still run.
+
+        Returns:
+            Total seconds taken.
+        """
+        start = time.perf_counter()
+        for name, step in self.steps:
+            step_start = time.perf_counter()
+            try:
+                step()
+            except Exception:
+                logging.exception(f"Shutdown step '{name}' failed")
+            logging.info(f"Shutdown: {name} ({time.perf_counter() - step_start:.3f}s)")
+        total = time.perf_counter() - start
+        logging.info(f"Shutdown complete in {total:.3f}s")
+        return total
@@ -0,0 +1,105 @@
+"""
+Startup phase tracking for the readiness endpoint.
+
+The HTTP listener binds before the slower startup work, so hubs are
+accepted as soon as the process is up, and requests are served once the
+schema is checked and the journal replayed. Loading the hot window, live
+energy, liveness and ingest keys from the database, Home Assistant
+discovery and the catch-up aggregation of hours missed while the server
+was down then run in the background. StartupStatus records when each phase starts and ends;
+/api/ready reports it and answers 200 once every phase is done.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class StartupStatus:
+    """
+    Thread-safe state of the named startup phases.
+
+    Args:
+        phases: Phase names, in the order they run.
+    """
+
+    def __init__(self, phases: Iterable[str]):
+        self._started = time.time()
+        self._phases: Dict[str, dict] = {name: {"state": PENDING} for name in phases}
+        self._lock = threading.Lock()
+
+    def start(self, name: str):
+        with self._lock:
+            self._phases[name] = {"state": RUNNING, "started": time.time()}
+
+    def finish(self, name: str, error: Optional[str] = None):
+        with self._lock:
+            phase = self._phases.setdefault(name, {"started": time.time()})
+            phase["state"] = FAILED if error else DONE
+            phase["seconds"] = round(time.time() - phase.get("started", time.time()), 3)
+            if error:
+                phase["error"] = error
+        logging.info(f"Startup: {name} {'failed' if error else 'done'} ({phase['seconds']:.3f}s)")
+
+    def run(self, name: str, step: Callable[[], object]):
+        """Run `step` as phase `name`; an exception marks the phase failed and is re-raised."""
+        self.start(name)
+        try:
+            step()
+        except Exception as e:
+            self.finish(name, error=str(e))
+            raise
+        self.finish(name)
+
+    @property
+    def ready(self) -> bool:
+        """True once no phase is pending or running. Failed phases don't block readiness."""
+        with self._lock:
+            return all(phase["state"] in (DONE, FAILED) for phase in self._phases.values())
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            phases = {name: dict(phase) for name, phase in self._phases.items()}
+        for phase in phases.values():
+            phase.pop("started", None)
+        return {
+            "ready": all(phase["state"] in (DONE, FAILED) for phase in phases.values()),
+            "uptime_seconds": round(time.time() - self._started, 3),
+            "phases": phases,
+        }
+
+
+def run_in_background(status: StartupStatus, steps: Iterable[tuple],
+                      then: Optional[Callable[[], object]] = None) -> threading.Thread:
+    """
+    Run (name, step) phases one after another on a daemon thread. A failed
+    phase is logged and the following ones still run.
+
+    Args:
+        status: Where the phases are recorded.
+        steps: (name, step) pairs.
+        then: Called after the last phase, e.g. to start a thread that
+            depends on them.
+
+    Returns:
+        The started thread.
+    """
+    steps = list(steps)
+
+    def run_steps():
+        for name, step in steps:
+            try:
+                status.run(name, step)
+            except Exception:
+                logging.exception(f"Startup phase '{name}' failed")
+        if then is not None:
+            then()
+
+    thread = threading.Thread(target=run_steps, name="startup", daemon=True)
+    thread.start()
+    return thread
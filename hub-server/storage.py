@@ -0,0 +1,637 @@
+"""
+Storage backends.
+
+The server, the aggregator and the background threads store readings,
+hourly energy and their own state through a StorageBackend:
+
+- writes: log_data, log_many and the journal's commit_journal_batch;
+- range queries: get_readings, get_recent_readings, get_hour_series,
+  get_hourly_energy and summarize_readings (count/min/max/mean per bucket);
+- aggregation: aggregate_hours, replace_hours and get_total_energy;
+- retention: truncate_old_data and archive_old_data.
+
+STORAGE_BACKEND selects the implementation:
+
+- "sqlite" (default): Database, data/readings.db. The only backend for
+  multi-process ingest, backups and background maintenance, which rely on
+  SQLite's WAL, backup API and PRAGMAs.
+- "duckdb": DuckDBStorage, data/readings.duckdb, with `pip install duckdb`.
+  DuckDB keeps each column compressed and scans them in parallel, so
+  summaries and range queries over years of readings are much faster than
+  on row-oriented SQLite; single small writes are slower.
+
+Every backend passes tests/test_storage_conformance.py.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Protocol, Sequence, Tuple, Union, runtime_checkable
+from config import ARCHIVE_COMPRESSION, ENERGY_INTEGRATION_SPLIT_HOURS, ENERGY_MONTHLY_RESET, STORAGE_BACKEND
+from database import Database, months_ago, raw_to_kw, raw_to_watts
+from energy_integration import integrate_rows
+from metrics import AGGREGATION_HOUR_DURATION, DB_COMMIT_DURATION, DB_LOCK_WAIT
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+HAS_DUCKDB = duckdb is not None
+
+BACKENDS = ("sqlite", "duckdb")
+DATA_DIR = Path(__file__).resolve().parent / "data"
+
+
+@runtime_checkable
+class StorageBackend(Protocol):
+    """What the server needs from storage; see Database for the reference behaviour."""
+
+    def setup(self) -> None: ...
+
+    def close(self, checkpoint: bool = True) -> None: ...
+
+    # Writes
+    def log_data(self, label: str, value: float, timestamp: Optional[int] = None) -> None: ...
+
+    def log_many(self, readings: Iterable[Tuple[str, float, Optional[int]]]) -> int: ...
+
+    def attach_journal(self, journal) -> None: ...
+
+    def commit_journal_batch(self, readings: List[Tuple[str, float, int]], generation: str, offset: int) -> int: ...
+
+    def get_journal_checkpoint(self) -> Optional[Tuple[str, int]]: ...
+
+    # Range queries
+    def get_all_labels(self) -> List[str]: ...
+
+    def load_latest_readings(self) -> None: ...
+
+    def get_latest_readings(self) -> Dict[str, dict]: ...
+
+    def get_recent_readings(self, since_ts: int) -> Dict[str, List[Tuple[int, float]]]: ...
+
+    def get_readings(self, start: int, end: int, labels: Sequence[str] = ()) -> List[Tuple[int, str, float]]: ...
+
+    def summarize_readings(self, start: int, end: int, bucket: int = 86400,
+                           labels: Sequence[str] = ()) -> List[Tuple[int, str, int, float, float, float]]: ...
+
+    def get_hour_series(self, hour_start: int) -> List[Tuple[int, float]]: ...
+
+    def get_hourly_energy(self, start: int, end: int) -> List[Tuple[int, float]]: ...
+
+    # Aggregation
+    def aggregate_hours(self, limit_hours: int = 1000) -> int: ...
+
+    def get_last_aggregated_hour(self) -> Optional[int]: ...
+
+    def get_total_energy(self) -> float: ...
+
+    def replace_hours(self, hours: Dict[int, float], start: int, end: int) -> int: ...
+
+    # Retention
+    def truncate_old_data(self, months: int) -> int: ...
+
+    def archive_old_data(self, months: int, compression: str = ARCHIVE_COMPRESSION) -> int: ...
+
+    # Server state
+    def save_liveness(self, rows: List[tuple]) -> int: ...
+
+    def get_liveness(self) -> List[tuple]: ...
+
+    def save_ingest_keys(self, keys: List[Tuple[str, str, str, int]], prune_before: int) -> int: ...
+
+    def get_ingest_keys(self, since: int) -> List[Tuple[str, str, str, int]]: ...
+
+
+# ---------------- DuckDB ----------------
+# No indices on readings: DuckDB skips row groups by their min/max
+# timestamps, and readings arrive in roughly time order
+DUCKDB_SCHEMA = (
+    "CREATE SEQUENCE IF NOT EXISTS readings_seq",
+    """
+    CREATE TABLE IF NOT EXISTS labels (
+        label_id INTEGER PRIMARY KEY,
+        label VARCHAR UNIQUE
+    )
+    """,
+    # seq orders readings with the same timestamp by insertion, like SQLite's rowid
+    """
+    CREATE TABLE IF NOT EXISTS readings (
+        label_id INTEGER,
+        timestamp BIGINT,
+        value DOUBLE,
+        seq BIGINT DEFAULT nextval('readings_seq')
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS energy_hourly (
+        hour_start BIGINT PRIMARY KEY,
+        kwh DOUBLE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS journal_checkpoint (
+        id INTEGER PRIMARY KEY,
+        generation VARCHAR,
+        journal_offset BIGINT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS liveness (
+        kind VARCHAR,
+        key VARCHAR,
+        hub VARCHAR,
+        hub_version VARCHAR,
+        last_seen BIGINT,
+        last_value DOUBLE,
+        count BIGINT,
+        rssi DOUBLE,
+        last_ping BIGINT,
+        PRIMARY KEY (kind, key)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ingest_keys (
+        hub VARCHAR,
+        label VARCHAR,
+        line VARCHAR,
+        timestamp BIGINT,
+        PRIMARY KEY (hub, label, line)
+    )
+    """,
+)
+DUCKDB_READINGS_FROM = """
+    FROM readings
+    INNER JOIN labels ON labels.label_id = readings.label_id
+"""
+DUCKDB_RANGE_SQL = """
+    SELECT timestamp, labels.label, readings.value
+""" + DUCKDB_READINGS_FROM + """
+    WHERE timestamp >= ? AND timestamp < ? {labels}
+    ORDER BY timestamp, seq
+"""
+DUCKDB_PREVIOUS_SQL = """
+    SELECT timestamp, labels.label, readings.value
+""" + DUCKDB_READINGS_FROM + """
+    WHERE timestamp < ?
+    ORDER BY timestamp DESC, seq DESC LIMIT 1
+"""
+DUCKDB_NEXT_SQL = """
+    SELECT timestamp, labels.label, readings.value
+""" + DUCKDB_READINGS_FROM + """
+    WHERE timestamp >= ?
+    ORDER BY timestamp, seq LIMIT 1
+"""
+DUCKDB_SUMMARY_SQL = """
+    SELECT timestamp - timestamp % ? AS bucket, labels.label,
+           COUNT(*), MIN(readings.value), MAX(readings.value), AVG(readings.value)
+""" + DUCKDB_READINGS_FROM + """
+    WHERE timestamp >= ? AND timestamp < ? {labels}
+    GROUP BY bucket, labels.label
+    ORDER BY bucket, labels.label
+"""
+# The last reading per label, later insertions winning ties like Database's latest_readings upsert
+DUCKDB_LATEST_SQL = """
+    SELECT labels.label, MAX(timestamp), ARG_MAX(readings.value, (timestamp, seq))
+""" + DUCKDB_READINGS_FROM + """
+    GROUP BY labels.label
+"""
+DUCKDB_UPSERT_LIVENESS_SQL = """
+    INSERT OR REPLACE INTO liveness(kind, key, hub, hub_version, last_seen, last_value, count, rssi, last_ping)
+    VALUES (?,?,?,?,?,?,?,?,?)
+"""
+# Rows per INSERT statement
+DUCKDB_INSERT_CHUNK = 1000
+
+
+def _labels_filter(labels: Sequence[str]) -> str:
+    return "AND list_contains(?::VARCHAR[], labels.label)" if labels else ""
+
+
+def _reading_values(rows: Sequence[Tuple[int, int, float]]) -> str:
+    """
+    VALUES list for (label_id, timestamp, value) rows. Bound parameters cost
+    DuckDB about half a millisecond a row, literals a few microseconds. The
+    numbers are formatted here, so nothing else reaches the SQL, and values
+    are cast from their repr so they round-trip exactly.
+    """
+    return ",".join(f"({int(label_id)},{int(timestamp)},'{float(value)!r}'::DOUBLE)"
+                    for label_id, timestamp, value in rows)
+
+
+def _hour_values(rows: Sequence[Tuple[int, float]]) -> str:
+    """VALUES list for (hour_start, kWh) rows, formatted like _reading_values."""
+    return ",".join(f"({int(hour_start)},'{float(kwh)!r}'::DOUBLE)" for hour_start, kwh in rows)
+
+
+class DuckDBStorage:
+    """
+    Storage in an embedded DuckDB file, for analytics-heavy deployments.
+
+    Holds the same data as Database. There is no archive (DuckDB already
+    stores readings as compressed columns) and one process at a time may
+    open the file, so ingest workers are not supported.
+
+    Args:
+        db_path: The file path to the DuckDB database.
+    """
+
+    def __init__(self, db_path: Union[str, Path]):
+        if duckdb is None:
+            raise RuntimeError("STORAGE_BACKEND=duckdb needs the duckdb package: pip install duckdb")
+        self.db_path = Path(db_path)
+        if not self.db_path.parent.exists():
+            logging.info(f"Creating database directory: {self.db_path.parent}")
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._conn = None
+        # DuckDB connections aren't safe to share between threads without it
+        self._conn_lock = threading.Lock()
+        # label -> label_id, only used under _conn_lock
+        self._label_ids: Dict[str, int] = {}
+        # label -> (timestamp, raw value, watts)
+        self._latest: Dict[str, Tuple[int, float, float]] = {}
+        self._journal = None
+        logging.info(f"DuckDB storage initialized at path: {self.db_path}")
+
+    @contextmanager
+    def _connection(self):
+        """The shared connection, held under the lock."""
+        wait_start = time.perf_counter()
+        with self._conn_lock:
+            DB_LOCK_WAIT.observe(time.perf_counter() - wait_start)
+            if self._conn is None:
+                self._conn = duckdb.connect(str(self.db_path))
+            yield self._conn
+
+    @contextmanager
+    def _transaction(self):
+        with self._connection() as conn:
+            conn.begin()
+            try:
+                yield conn
+                with DB_COMMIT_DURATION.time():
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def setup(self) -> None:
+        with self._transaction() as conn:
+            for statement in DUCKDB_SCHEMA:
+                conn.execute(statement)
+        with self._connection() as conn:
+            self._label_ids = dict(conn.execute("SELECT label, label_id FROM labels").fetchall())
+            self._load_latest(conn)
+        logging.debug("DuckDB storage setup complete.")
+
+    def close(self, checkpoint: bool = True) -> None:
+        with self._conn_lock:
+            if self._conn is None:
+                return
+            try:
+                if checkpoint:
+                    self._conn.execute("CHECKPOINT")
+            except duckdb.Error as e:
+                logging.warning(f"Final checkpoint failed: {e}")
+            finally:
+                self._conn.close()
+                self._conn = None
+        logging.info("Database closed.")
+
+    # ---------------- Writes ----------------
+    def log_data(self, label: str, value: float, timestamp: Optional[int] = None) -> None:
+        if timestamp is None:
+            timestamp = int(time.time())
+        if self._journal is not None:
+            self.log_many([(label, value, timestamp)])
+            return
+        try:
+            self._write_many([(label, value, timestamp)])
+        except Exception as e:
+            logging.error(f"Failed to log data for label '{label}': {e}")
+
+    def log_many(self, readings: Iterable[Tuple[str, float, Optional[int]]]) -> int:
+        if self._journal is not None:
+            now = int(time.time())
+            batch = [(label, value, int(now if ts is None else ts)) for label, value, ts in readings]
+            try:
+                self._journal.append(batch)
+                for label, value, timestamp in batch:
+                    self._update_latest(label, timestamp, value)
+                return len(batch)
+            except OSError as e:
+                logging.error(f"Journal append failed, writing directly: {e}")
+                readings = batch
+
+        try:
+            return self._write_many(readings)
+        except Exception as e:
+            logging.error(f"Failed to log batch of readings: {e}")
+            return 0
+
+    def _label_ids_for(self, conn, labels: Iterable[str]) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """Ids of `labels`, creating missing ones. Returns (all ids, new ids) for publishing after commit."""
+        ids = self._label_ids
+        missing = sorted(label for label in set(labels) if label not in ids)
+        new = {}
+        if missing:
+            next_id = conn.execute("SELECT COALESCE(MAX(label_id), 0) + 1 FROM labels").fetchone()[0]
+            new = {label: next_id + i for i, label in enumerate(missing)}
+            conn.executemany("INSERT INTO labels(label_id, label) VALUES (?, ?)",
+                             [(label_id, label) for label, label_id in new.items()])
+        return {**ids, **new}, new
+
+    def _write_many(self, readings: Iterable[Tuple[str, float, Optional[int]]],
+                    checkpoint: Optional[Tuple[str, int]] = None) -> int:
+        """
+        Insert a batch in one transaction, optionally recording a journal
+        (generation, offset) checkpoint in the same transaction. Raises on failure.
+        """
+        now = int(time.time())
+        batch = [(label, value, int(now if ts is None else ts)) for label, value, ts in readings]
+        if not batch and checkpoint is None:
+            return 0
+
+        with self._transaction() as conn:
+            ids, new = self._label_ids_for(conn, (label for label, _, _ in batch))
+            rows = [(ids[label], timestamp, value) for label, value, timestamp in batch]
+            for start in range(0, len(rows), DUCKDB_INSERT_CHUNK):
+                conn.execute("INSERT INTO readings(label_id, timestamp, value) VALUES "
+                             + _reading_values(rows[start:start + DUCKDB_INSERT_CHUNK]))
+            if checkpoint is not None:
+                conn.execute("INSERT OR REPLACE INTO journal_checkpoint(id, generation, journal_offset) VALUES (1, ?, ?)",
+                             checkpoint)
+        if new:
+            self._label_ids = ids
+
+        for label, value, timestamp in batch:
+            self._update_latest(label, timestamp, value)
+        return len(batch)
+
+    def attach_journal(self, journal) -> None:
+        """Route log_data/log_many through a write-ahead IngestJournal."""
+        self._journal = journal
+
+    def commit_journal_batch(self, readings: List[Tuple[str, float, int]], generation: str, offset: int) -> int:
+        return self._write_many(readings, (generation, offset))
+
+    def get_journal_checkpoint(self) -> Optional[Tuple[str, int]]:
+        with self._connection() as conn:
+            row = conn.execute("SELECT generation, journal_offset FROM journal_checkpoint WHERE id = 1").fetchone()
+            return (row[0], int(row[1])) if row else None
+
+    # ---------------- Range queries ----------------
+    def get_all_labels(self) -> List[str]:
+        try:
+            with self._connection() as conn:
+                return [row[0] for row in conn.execute("SELECT label FROM labels ORDER BY label").fetchall()]
+        except Exception as e:
+            logging.error(f"Failed to fetch labels: {e}")
+            return []
+
+    def _load_latest(self, conn) -> None:
+        self._latest = {
+            label: (int(timestamp), value, raw_to_watts(label, value))
+            for label, timestamp, value in conn.execute(DUCKDB_LATEST_SQL).fetchall()
+        }
+
+    def load_latest_readings(self) -> None:
+        try:
+            with self._connection() as conn:
+                self._load_latest(conn)
+        except Exception as e:
+            logging.error(f"Failed to load latest readings: {e}")
+
+    def _update_latest(self, label: str, timestamp: int, value: float) -> None:
+        current = self._latest.get(label)
+        if current is None or timestamp >= current[0]:
+            self._latest[label] = (timestamp, value, raw_to_watts(label, value))
+
+    def get_latest_readings(self) -> Dict[str, dict]:
+        return {
+            label: {"timestamp": ts, "value": value, "watts": watts}
+            for label, (ts, value, watts) in list(self._latest.items())
+        }
+
+    def get_recent_readings(self, since_ts: int) -> Dict[str, List[Tuple[int, float]]]:
+        recent: Dict[str, List[Tuple[int, float]]] = {}
+        for timestamp, label, value in self.get_readings(since_ts, 2 ** 62):
+            recent.setdefault(label, []).append((timestamp, value))
+        return recent
+
+    def get_readings(self, start: int, end: int, labels: Sequence[str] = ()) -> List[Tuple[int, str, float]]:
+        labels = list(labels)
+        params = (int(start), int(end)) + ((labels,) if labels else ())
+        try:
+            with self._connection() as conn:
+                return conn.execute(DUCKDB_RANGE_SQL.format(labels=_labels_filter(labels)), params).fetchall()
+        except Exception as e:
+            logging.error(f"Failed to fetch readings: {e}")
+            return []
+
+    def summarize_readings(self, start: int, end: int, bucket: int = 86400,
+                           labels: Sequence[str] = ()) -> List[Tuple[int, str, int, float, float, float]]:
+        labels = list(labels)
+        params = (int(bucket), int(start), int(end)) + ((labels,) if labels else ())
+        try:
+            with self._connection() as conn:
+                return conn.execute(DUCKDB_SUMMARY_SQL.format(labels=_labels_filter(labels)), params).fetchall()
+        except Exception as e:
+            logging.error(f"Failed to summarize readings: {e}")
+            return []
+
+    def get_hour_series(self, hour_start: int) -> List[Tuple[int, float]]:
+        return [(timestamp, raw_to_kw(label, value))
+                for timestamp, label, value in self.get_readings(hour_start, hour_start + 3600)]
+
+    def get_hourly_energy(self, start: int, end: int) -> List[Tuple[int, float]]:
+        try:
+            with self._connection() as conn:
+                return conn.execute(
+                    "SELECT hour_start, kwh FROM energy_hourly WHERE hour_start >= ? AND hour_start < ? "
+                    "ORDER BY hour_start", (int(start), int(end))
+                ).fetchall()
+        except Exception as e:
+            logging.error(f"Failed to fetch hourly energy: {e}")
+            return []
+
+    # ---------------- Aggregation ----------------
+    def get_last_aggregated_hour(self) -> Optional[int]:
+        try:
+            with self._connection() as conn:
+                row = conn.execute("SELECT MAX(hour_start) FROM energy_hourly").fetchone()
+                return int(row[0]) if row and row[0] is not None else None
+        except Exception as e:
+            logging.error(f"Failed to fetch last aggregated hour: {e}")
+            return None
+
+    def get_total_energy(self) -> float:
+        query = "SELECT SUM(kwh) FROM energy_hourly"
+        params = ()
+        if ENERGY_MONTHLY_RESET:
+            query += " WHERE hour_start >= ?"
+            params = (int(months_ago(0).timestamp()),)
+        try:
+            with self._connection() as conn:
+                row = conn.execute(query, params).fetchone()
+                return float(row[0]) if row and row[0] else 0.0
+        except Exception as e:
+            logging.error(f"Failed to compute total energy: {e}")
+            return 0.0
+
+    def aggregate_hours(self, limit_hours: int = 1000) -> int:
+        """
+        Aggregate up to `limit_hours` past unprocessed full hours, with the
+        same results as Database.aggregate_hours. The readings are read in
+        one scan and integrated without holding the connection.
+
+        Returns the number of hours processed.
+        """
+        now = int(time.time())
+        if self._journal is not None:
+            # Commit journaled readings first so closed hours are complete
+            self._journal.drain()
+
+        try:
+            with self._connection() as conn:
+                first = conn.execute("SELECT MIN(timestamp) FROM readings").fetchone()[0]
+                if not first:
+                    return 0
+                last_done = conn.execute("SELECT MAX(hour_start) FROM energy_hourly").fetchone()[0]
+                start = first - first % 3600 if last_done is None else last_done + 3600
+                # Don't aggregate the current partial hour
+                end = min(now - now % 3600, start + limit_hours * 3600)
+                if end <= start:
+                    return 0
+                rows = conn.execute(DUCKDB_RANGE_SQL.format(labels=""), (start, end)).fetchall()
+                if ENERGY_INTEGRATION_SPLIT_HOURS:
+                    # Include the intervals crossing into the first and out of the last hour
+                    rows = (conn.execute(DUCKDB_PREVIOUS_SQL, (start,)).fetchall() + rows
+                            + conn.execute(DUCKDB_NEXT_SQL, (end,)).fetchall())
+
+            series = [(timestamp, raw_to_kw(label, value)) for timestamp, label, value in rows]
+            hours = self._integrate_hours(series, start, end)
+
+            rows = sorted(hours.items())
+            with self._transaction() as conn:
+                for chunk in range(0, len(rows), DUCKDB_INSERT_CHUNK):
+                    conn.execute("INSERT OR REPLACE INTO energy_hourly(hour_start, kwh) VALUES "
+                                 + _hour_values(rows[chunk:chunk + DUCKDB_INSERT_CHUNK]))
+            for hour_start, kwh in rows:
+                readable = time.strftime('%Y-%m-%d %H:%M', time.localtime(hour_start))
+                logging.info(f"[AGG] Hour {readable} => {kwh:.5f} kWh")
+            return (end - start) // 3600
+        except Exception:
+            logging.exception("Error during aggregation")
+            return 0
+
+    @staticmethod
+    def _integrate_hours(series: List[Tuple[int, float]], start: int, end: int) -> Dict[int, float]:
+        """
+        kWh of each hour in [start, end) with readings, integrated on its own
+        (plus its neighbouring readings with ENERGY_INTEGRATION_SPLIT_HOURS)
+        exactly as Database.aggregate_one_hour does.
+        """
+        hours = {}
+        i = 0
+        while i < len(series):
+            timestamp = series[i][0]
+            hour_start = timestamp - timestamp % 3600
+            j = i + 1
+            while j < len(series) and series[j][0] - series[j][0] % 3600 == hour_start:
+                j += 1
+            if start <= hour_start < end:
+                with AGGREGATION_HOUR_DURATION.time():
+                    if ENERGY_INTEGRATION_SPLIT_HOURS:
+                        window = series[max(i - 1, 0):j + 1]
+                    else:
+                        window = series[i:j]
+                    hours[hour_start] = integrate_rows(window, split_hours=ENERGY_INTEGRATION_SPLIT_HOURS)[hour_start]
+            i = j
+        return hours
+
+    def replace_hours(self, hours: Dict[int, float], start: int, end: int) -> int:
+        rows = sorted((hour_start, kwh) for hour_start, kwh in hours.items() if start <= hour_start < end)
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM energy_hourly WHERE hour_start >= ? AND hour_start < ?", (start, end))
+            for chunk in range(0, len(rows), DUCKDB_INSERT_CHUNK):
+                conn.execute("INSERT INTO energy_hourly(hour_start, kwh) VALUES "
+                             + _hour_values(rows[chunk:chunk + DUCKDB_INSERT_CHUNK]))
+        return len(rows)
+
+    # ---------------- Retention ----------------
+    def truncate_old_data(self, months: int) -> int:
+        if months <= 0:
+            return 0
+        try:
+            cutoff_date = months_ago(months)
+            cutoff_ts = int(cutoff_date.timestamp())
+            with self._transaction() as conn:
+                deleted = conn.execute("DELETE FROM readings WHERE timestamp < ?", (cutoff_ts,)).fetchone()[0]
+                deleted += conn.execute("DELETE FROM energy_hourly WHERE hour_start < ?", (cutoff_ts,)).fetchone()[0]
+            if deleted > 0:
+                logging.info(f"Truncated {deleted} old records (older than {cutoff_date.strftime('%Y-%m-%d')})")
+            return deleted
+        except Exception as e:
+            logging.error(f"Failed to truncate old data: {e}")
+            return 0
+
+    def archive_old_data(self, months: int, compression: str = ARCHIVE_COMPRESSION) -> int:
+        """Nothing to do: DuckDB already stores readings as compressed columns."""
+        return 0
+
+    # ---------------- Server state ----------------
+    def save_liveness(self, rows: List[tuple]) -> int:
+        with self._transaction() as conn:
+            if rows:
+                conn.executemany(DUCKDB_UPSERT_LIVENESS_SQL, rows)
+        return len(rows)
+
+    def get_liveness(self) -> List[tuple]:
+        try:
+            with self._connection() as conn:
+                return conn.execute("""
+                    SELECT kind, key, hub, hub_version, last_seen, last_value, count, rssi, last_ping FROM liveness
+                """).fetchall()
+        except Exception as e:
+            logging.error(f"Failed to load liveness: {e}")
+            return []
+
+    def save_ingest_keys(self, keys: List[Tuple[str, str, str, int]], prune_before: int) -> int:
+        with self._transaction() as conn:
+            if keys:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO ingest_keys(hub, label, line, timestamp) VALUES (?,?,?,?)", keys
+                )
+            conn.execute("DELETE FROM ingest_keys WHERE timestamp < ?", (prune_before,))
+        return len(keys)
+
+    def get_ingest_keys(self, since: int) -> List[Tuple[str, str, str, int]]:
+        try:
+            with self._connection() as conn:
+                return conn.execute(
+                    "SELECT hub, label, line, timestamp FROM ingest_keys WHERE timestamp >= ? ORDER BY timestamp",
+                    (since,)
+                ).fetchall()
+        except Exception as e:
+            logging.error(f"Failed to load ingest keys: {e}")
+            return []
+
+
+def open_storage(backend: str = STORAGE_BACKEND, directory: Union[str, Path] = DATA_DIR) -> StorageBackend:
+    """
+    The `backend` storage in `directory`, not yet set up.
+
+    Raises:
+        ValueError: Unknown backend.
+        RuntimeError: The backend's package isn't installed.
+    """
+    directory = Path(directory)
+    if backend == "sqlite":
+        return Database(directory / "readings.db")
+    if backend == "duckdb":
+        return DuckDBStorage(directory / "readings.duckdb")
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}', expected one of {', '.join(BACKENDS)}")
@@ -0,0 +1,280 @@
+"""
+Live stream of incoming readings over Server-Sent Events.
+
+Every accepted reading is fanned out to the connected subscribers, so
+dashboards and Home Assistant can follow live power without polling
+SQLite. Clients connect to GET /stream on its own port:
+
+    curl -N "http://hub-server:5002/stream?label=efergy_h3_815751&since=1700000000"
+
+Each reading is sent as an SSE "reading" event whose id is its timestamp
+and a sequence number unique to the reading:
+
+    id: 1700000006-1700000000123
+    event: reading
+    data: {"label": "efergy_h3_815751", "timestamp": 1700000006, "value": 391.86, "watts": 39.186}
+
+?label= (repeatable) filters the labels. ?since= (epoch seconds) first
+replays the readings from that time that are still in the hot window; their
+ids are the bare timestamp. A Last-Event-ID header on reconnect resumes
+right after that event while it is among the last RESUME_BUFFER readings,
+and otherwise replays from the start of its second, so readings of that
+second may be sent twice but none is skipped.
+
+Publishing never blocks ingest: each client has a bounded queue, and a
+client that falls further behind than STREAM_CLIENT_BUFFER readings is
+disconnected and can reconnect with Last-Event-ID to catch up.
+"""
+import heapq
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+from config import STREAM_CLIENT_BUFFER, STREAM_MAX_CLIENTS
+from database import raw_to_watts
+from hot_window import HotWindow
+from metrics import Counter, Gauge
+
+STREAM_CLIENTS = Gauge(
+    "efergy_stream_clients", "Connected live stream clients."
+)
+STREAM_DROPPED = Counter(
+    "efergy_stream_dropped_clients_total", "Live stream clients disconnected for falling behind."
+)
+
+# Seconds between keep-alive comments on an idle stream
+KEEPALIVE_INTERVAL = 15
+
+# Recent readings kept so a reconnecting client resumes exactly after its Last-Event-ID
+RESUME_BUFFER = 4096
+
+# Queued to wake a client up when the stream closes
+_CLOSED = object()
+
+
+class _Subscription:
+    __slots__ = ("labels", "queue", "dropped")
+
+    def __init__(self, labels: Optional[Set[str]], buffer: int):
+        self.labels = labels
+        self.queue: "queue.Queue" = queue.Queue(maxsize=buffer)
+        self.dropped = False
+
+
+class ReadingStream:
+    """
+    Fans readings out to subscribers' bounded queues.
+
+    Args:
+        hot_window: Recent readings, used for replay.
+        buffer: Readings queued per client before it is dropped.
+        max_clients: Subscribers allowed at once.
+    """
+
+    def __init__(self, hot_window: Optional[HotWindow] = None, buffer: int = STREAM_CLIENT_BUFFER,
+                 max_clients: int = STREAM_MAX_CLIENTS):
+        self.hot_window = hot_window
+        self.buffer = buffer
+        self.max_clients = max_clients
+        self._subscriptions: List[_Subscription] = []
+        self._lock = threading.Lock()
+        # Sequence numbers start at the stream's start time in milliseconds, so they keep
+        # increasing across restarts and an id from a previous run never matches a new reading
+        self._seq = int(time.time() * 1000)
+        self._recent: "deque[Tuple[str, int, float, int]]" = deque(maxlen=RESUME_BUFFER)
+        # Orders publishers, so every queue receives readings in sequence order
+        self._publish_lock = threading.Lock()
+
+    def client_count(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self, labels: Optional[Iterable[str]] = None) -> Optional[_Subscription]:
+        """A new subscription to `labels` (all if None), or None if max_clients are connected."""
+        subscription = _Subscription(set(labels) if labels else None, self.buffer)
+        with self._lock:
+            if len(self._subscriptions) >= self.max_clients:
+                return None
+            # Copy on write, so publish iterates without the lock
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: _Subscription):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+
+    def publish(self, label: str, timestamp: int, value: float):
+        """
+        Number a reading and queue (label, timestamp, value, seq) for every
+        interested subscriber. Never blocks on a subscriber.
+        """
+        dropped = []
+        with self._publish_lock:
+            self._seq += 1
+            event = (label, int(timestamp), value, self._seq)
+            self._recent.append(event)
+            for subscription in self._subscriptions:
+                if subscription.labels is not None and label not in subscription.labels:
+                    continue
+                try:
+                    subscription.queue.put_nowait(event)
+                except queue.Full:
+                    if not subscription.dropped:
+                        subscription.dropped = True
+                        dropped.append(subscription)
+        for subscription in dropped:
+            STREAM_DROPPED.inc()
+            self.unsubscribe(subscription)
+
+    def resume(self, after_seq: int, labels: Optional[Iterable[str]] = None
+               ) -> Optional[List[Tuple[str, int, float, int]]]:
+        """
+        Readings published after sequence number `after_seq`, oldest first,
+        or None if readings after it have already left the resume buffer (or
+        it is from a previous run).
+        """
+        with self._publish_lock:
+            recent = list(self._recent)
+            current = self._seq
+        oldest = recent[0][3] if recent else current + 1
+        if not oldest - 1 <= after_seq <= current:
+            return None
+        labels = set(labels) if labels else None
+        return [event for event in recent if event[3] > after_seq and (labels is None or event[0] in labels)]
+
+    def replay(self, since: int, labels: Optional[Iterable[str]] = None,
+               now: Optional[int] = None) -> List[Tuple[str, int, float]]:
+        """Readings at or after `since` still in the hot window, oldest first."""
+        if self.hot_window is None:
+            return []
+        now = int(time.time()) if now is None else now
+        seconds = max(0, now - since) + 1
+        series = []
+        for label in (labels or self.hot_window.labels()):
+            rows = [(ts, label, value) for ts, value in self.hot_window.window(label, seconds, now) if ts >= since]
+            if rows:
+                series.append(rows)
+        return [(label, ts, value) for ts, label, value in heapq.merge(*series)]
+
+    def close(self):
+        """Disconnect every subscriber."""
+        with self._lock:
+            subscriptions, self._subscriptions = self._subscriptions, []
+        for subscription in subscriptions:
+            subscription.dropped = True
+            try:
+                subscription.queue.put_nowait(_CLOSED)
+            except queue.Full:
+                pass
+
+
+def format_event(label: str, timestamp: int, value: float, seq: Optional[int] = None) -> bytes:
+    """An SSE event; readings replayed from the hot window have no `seq` and are identified by timestamp only."""
+    data = json.dumps({"label": label, "timestamp": timestamp, "value": value, "watts": raw_to_watts(label, value)})
+    event_id = timestamp if seq is None else f"{timestamp}-{seq}"
+    return f"id: {event_id}\nevent: reading\ndata: {data}\n\n".encode("utf-8")
+
+
+class StreamRequestHandler(BaseHTTPRequestHandler):
+    server: "StreamHTTPServer"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parsed_url = urlparse(self.path)
+        if parsed_url.path != "/stream":
+            self.send_error(404)
+            return
+
+        query = parse_qs(parsed_url.query)
+        labels = query.get("label") or None
+        since = after_seq = None
+        try:
+            if "since" in query:
+                since = int(query["since"][0])
+            elif self.headers.get("Last-Event-ID"):
+                # "<timestamp>-<seq>", or a bare timestamp for a replayed reading
+                timestamp, _, seq = self.headers["Last-Event-ID"].strip().partition("-")
+                since = int(timestamp)
+                after_seq = int(seq) if seq else None
+        except ValueError:
+            self.send_error(400, "since must be epoch seconds")
+            return
+
+        stream = self.server.stream
+        subscription = stream.subscribe(labels)
+        if subscription is None:
+            self.send_error(503, "Too many stream clients")
+            return
+
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            # Subscribed first, so nothing is missed between the replay and the live readings
+            replayed = set()
+            last_seq = 0
+            resumed = stream.resume(after_seq, labels) if after_seq is not None else None
+            if resumed is not None:
+                for event in resumed:
+                    self.wfile.write(format_event(*event))
+                last_seq = resumed[-1][3] if resumed else after_seq
+            elif since is not None:
+                # From the start of the second: a reading may be sent twice, but none is skipped
+                for label, timestamp, value in stream.replay(since, labels):
+                    self.wfile.write(format_event(label, timestamp, value))
+                    replayed.add((label, timestamp))
+            self.wfile.flush()
+
+            while not subscription.dropped:
+                try:
+                    event = subscription.queue.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    continue
+                if event is _CLOSED:
+                    break
+                label, timestamp, value, seq = event
+                if seq <= last_seq or (label, timestamp) in replayed:
+                    continue
+                self.wfile.write(format_event(label, timestamp, value, seq))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, OSError) as e:
+            logging.debug("Stream client %s disconnected: %s", self.client_address[0], e)
+        finally:
+            stream.unsubscribe(subscription)
+
+    def log_message(self, format, *args):
+        return
+
+
+class StreamHTTPServer(ThreadingHTTPServer):
+    """One thread per client, so a slow client never holds up the others or ingest."""
+    daemon_threads = True
+
+    def __init__(self, server_address, stream: ReadingStream):
+        self.stream = stream
+        super().__init__(server_address, StreamRequestHandler)
+
+
+def start_stream_server(stream: ReadingStream, port: int, host: str = "0.0.0.0") -> StreamHTTPServer:
+    """
+    Serve /stream on a background thread.
+
+    Returns:
+        The running server; call `shutdown()` to stop it and `stream.close()`
+        to disconnect the clients.
+    """
+    httpd = StreamHTTPServer((host, port), stream)
+    thread = threading.Thread(target=httpd.serve_forever, name="stream-server", daemon=True)
+    thread.start()
+    logging.info(f"Serving live stream on {host} port {httpd.server_port}...")
+    return httpd
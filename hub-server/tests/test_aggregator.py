@@ -52,6 +52,19 @@ def test_aggregator_no_truncation_when_disabled(mock_db, mock_mqtt):
         assert mock_mqtt.publish_energy.called
 
 
+def test_aggregator_archives_old_months(mock_db, mock_mqtt):
+    with patch('aggregator.ARCHIVE_AFTER_MONTHS', 3), patch('aggregator.HISTORY_RETENTION_MONTHS', 0):
+        aggregator = Aggregator(mock_db, mock_mqtt, interval_sec=0.1)
+        mock_db.aggregate_hours.side_effect = lambda **kwargs: aggregator._stop_event.set() or 1
+
+        aggregator.start()
+        time.sleep(0.3)
+        aggregator.stop()
+
+        mock_db.archive_old_data.assert_called_once_with(3)
+        assert not mock_db.truncate_old_data.called
+
+
 def test_aggregator_truncation_interval(mock_db, mock_mqtt):
     # Re-testing logic by calling aggregate_loop once and checking state
     with patch('aggregator.HISTORY_RETENTION_MONTHS', 1):
@@ -90,3 +103,21 @@ def test_aggregator_truncation_interval(mock_db, mock_mqtt):
             
             assert mock_db.truncate_old_data.call_count == 2
             assert aggregator._last_truncation_ts == 186401
+
+
+def test_aggregator_catches_up_without_waiting(mock_db, mock_mqtt):
+    from aggregator import AGGREGATE_LIMIT_HOURS
+    from startup import StartupStatus
+
+    startup = StartupStatus(["aggregation"])
+    aggregator = Aggregator(mock_db, mock_mqtt, interval_sec=300, startup=startup)
+    aggregator._stop_event.wait = MagicMock(side_effect=lambda timeout: aggregator._stop_event.set())
+    # Two full passes of missed hours, then caught up
+    mock_db.aggregate_hours.side_effect = [AGGREGATE_LIMIT_HOURS, AGGREGATE_LIMIT_HOURS, 3]
+    mock_db.get_total_energy.return_value = 1.0
+
+    aggregator.aggregate_loop()
+
+    assert mock_db.aggregate_hours.call_count == 3
+    aggregator._stop_event.wait.assert_called_once_with(300)
+    assert startup.snapshot()["phases"]["aggregation"]["state"] == "done"
@@ -0,0 +1,125 @@
+import random
+import sqlite3
+import time
+import pytest
+import archive
+from database import Database, months_ago
+from reaggregate import aggregate_slice
+
+# Three whole months well before the current one
+START = int(months_ago(5).timestamp())
+END = int(months_ago(2).timestamp())
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(tmp_path / "archive.db")
+    database.setup()
+    readings = []
+    for ts in range(START, END, 600):
+        readings.append(("efergy_h3_1", 3918.6 + (ts // 3600) % 5, ts))
+        readings.append(("efergy_h2_2", 2479.98 if ts % 1800 else 120.5, ts))
+    database.log_many(readings)
+    # Aggregated up to the current hour, as the running server keeps it
+    now = int(time.time())
+    with database._get_connection() as conn:
+        conn.execute("INSERT INTO energy_hourly(hour_start, kwh) VALUES (?, 0)", (now - now % 3600 - 3600,))
+        conn.commit()
+    return database
+
+
+def _count(database, table):
+    with database._get_connection() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+@pytest.mark.parametrize("compression", archive.COMPRESSIONS)
+def test_chunk_round_trip(compression):
+    rows = []
+    ts, rowid = 1_700_000_000, 1
+    for i in range(2000):
+        ts += 6 if i % 50 else 7
+        rowid += 2
+        rows.append((ts, rowid, round(391.86 + (i % 13) * 0.01, 2)))
+    data = archive.encode_chunk(rows, compression)
+    assert list(archive.decode_chunk(data, compression)) == rows
+    # Regular timestamps, rowids and repeating values compress to well under 2 bytes a reading
+    assert len(data) < 2 * len(rows)
+
+
+def test_chunk_keeps_values_exact():
+    values = [random.uniform(-1e6, 1e6) for _ in range(100)] + [0.1, 1e-9, float("nan")]
+    rows = [(1000 + i, i + 1, value) for i, value in enumerate(values)]
+    decoded = archive.decode_chunk(archive.encode_chunk(rows), "zlib")
+    assert [row[:2] for row in decoded] == [row[:2] for row in rows]
+    assert str([row[2] for row in decoded]) == str(values)
+
+
+def test_unknown_compression():
+    with pytest.raises(ValueError):
+        archive.encode_chunk([(1, 1, 1.0)], "bz2")
+
+
+def test_archive_old_data(db):
+    readings = _count(db, "readings")
+    series = {hour: db.get_hour_series(hour) for hour in range(START, END, 3600 * 97)}
+    bounds = [(which, bound) for which in ("previous", "next") for bound in (START, START + 7, END - 7, END)]
+    with db._get_connection() as conn:
+        nearest = {key: db._fetch_kw(conn.cursor(), *key) for key in bounds}
+
+    assert db.archive_old_data(2) == readings
+    assert _count(db, "readings") == 0
+    # One chunk per label and month
+    assert _count(db, "archive_chunks") == 6
+
+    # Reads are unchanged, including the readings either side of an hour
+    for hour, rows in series.items():
+        assert db.get_hour_series(hour) == rows
+    with db._get_connection() as conn:
+        assert {key: db._fetch_kw(conn.cursor(), *key) for key in bounds} == nearest
+
+    # Nothing left to archive
+    assert db.archive_old_data(2) == 0
+
+
+def test_reaggregation_reads_archive(db):
+    before = aggregate_slice(str(db.db_path), START, START + 48 * 3600, split_hours=True)
+    db.archive_old_data(2)
+    assert aggregate_slice(str(db.db_path), START, START + 48 * 3600, split_hours=True) == before
+
+
+def test_slice_decodes_each_chunk_once(db, monkeypatch):
+    db.archive_old_data(2)
+    decoded = []
+    decode_chunk = archive.decode_chunk
+    monkeypatch.setattr(archive, "decode_chunk", lambda data, codec: decoded.append(data) or decode_chunk(data, codec))
+
+    aggregate_slice(str(db.db_path), START + 24 * 3600, START + 48 * 3600, split_hours=True)
+    # One chunk per label, reused for the readings before and after the slice
+    assert len(decoded) == len(set(decoded)) == 2
+
+
+def test_late_readings_merged_into_chunk(db):
+    db.archive_old_data(2)
+    db.log_data("efergy_h3_1", 4000.0, timestamp=START + 5)
+    assert db.archive_old_data(2) == 1
+    assert _count(db, "archive_chunks") == 6
+    with db._get_connection() as conn:
+        rows = archive.read_range(conn.cursor(), START, START + 601, ["efergy_h3_1"])
+    assert [row[0] for row in rows] == [START, START + 5, START + 600]
+
+
+def test_unaggregated_months_are_not_archived(db):
+    with db._get_connection() as conn:
+        conn.execute("DELETE FROM energy_hourly")
+        conn.commit()
+    assert db.archive_old_data(2) == 0
+
+
+def test_truncate_deletes_archived_months(db):
+    db.archive_old_data(2)
+    deleted = db.truncate_old_data(3)
+    # Two labels, every 10 minutes, in the two months before the cutoff
+    assert deleted == 2 * len(range(START, int(months_ago(3).timestamp()), 600))
+    assert _count(db, "archive_chunks") == 2
+
@@ -0,0 +1,125 @@
+import gzip
+import os
+import sqlite3
+import threading
+import time
+import pytest
+import backup
+from backup import BackupCancelled, BackupScheduler
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(tmp_path / "readings.db")
+    database.setup()
+    database.log_many([("efergy_h3_1", float(i), 1_700_000_000 + i) for i in range(20000)])
+    yield database
+    database.close(checkpoint=False)
+
+
+def _readings(path):
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        return conn.execute("SELECT COUNT(*), MAX(timestamp) FROM readings").fetchone()
+    finally:
+        conn.close()
+
+
+def test_backup_with_concurrent_writes(db, tmp_path):
+    target = sqlite3.connect(tmp_path / "copy.db")
+    stop = threading.Event()
+
+    def write():
+        ts = 1_800_000_000
+        while not stop.is_set():
+            db.log_data("efergy_h3_1", 1.0, timestamp=ts)
+            ts += 1
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        stats = db.backup(target, pages=16, sleep=0.001)
+    finally:
+        stop.set()
+        writer.join()
+        target.close()
+
+    # Writes on the shared connection are carried into the copy rather than restarting it
+    assert stats["restarts"] == 0
+    assert stats["steps"] > 1
+    assert stats["pages"] > 0
+    count, _ = _readings(tmp_path / "copy.db")
+    assert count >= 20000
+
+
+def test_gzip_backup(db, tmp_path):
+    scheduler = BackupScheduler(db, tmp_path / "backups", compress=True, pages=64, step_sleep=0)
+    path = scheduler.run_once()
+    assert path.name.startswith("readings-") and path.name.endswith(".db.gz")
+    assert [p.name for p in path.parent.iterdir()] == [path.name]
+
+    restored = tmp_path / "restored.db"
+    with gzip.open(path, "rb") as src:
+        restored.write_bytes(src.read())
+    assert _readings(restored) == (20000, 1_700_000_000 + 19999)
+
+
+def test_uncompressed_backup(db, tmp_path):
+    path = BackupScheduler(db, tmp_path / "backups", compress=False).run_once()
+    assert path.suffix == ".db"
+    assert _readings(path)[0] == 20000
+
+
+def test_rotation_keeps_newest(db, tmp_path):
+    directory = tmp_path / "backups"
+    directory.mkdir()
+    for day in range(1, 6):
+        (directory / f"readings-2025010{day}-030000.db.gz").write_bytes(b"")
+    (directory / "other-20250101-030000.db.gz").write_bytes(b"")
+
+    scheduler = BackupScheduler(db, directory, keep=3)
+    removed = scheduler.rotate()
+    assert [p.name for p in removed] == ["readings-20250101-030000.db.gz", "readings-20250102-030000.db.gz"]
+    assert [p.name for p in scheduler.backup_files()] == [
+        "readings-20250103-030000.db.gz", "readings-20250104-030000.db.gz", "readings-20250105-030000.db.gz"
+    ]
+    assert (directory / "other-20250101-030000.db.gz").exists()
+
+
+def test_stop_cancels_backup(db, tmp_path):
+    scheduler = BackupScheduler(db, tmp_path / "backups", pages=1, step_sleep=0)
+    scheduler._stop_event.set()
+    failures = backup.BACKUP_FAILURES.value()
+    with pytest.raises(BackupCancelled):
+        scheduler.run_once()
+    assert list((tmp_path / "backups").iterdir()) == []
+    assert backup.BACKUP_FAILURES.value() == failures + 1
+
+
+def test_seconds_until_due(db, tmp_path):
+    scheduler = BackupScheduler(db, tmp_path / "backups", interval=3600)
+    assert scheduler.seconds_until_due() == 0
+
+    path = tmp_path / "backups" / "readings-20250101-030000.db.gz"
+    path.parent.mkdir()
+    path.write_bytes(b"")
+    os.utime(path, (1_000_000, 1_000_000))
+    assert scheduler.seconds_until_due(now=1_000_600) == 3000
+    assert scheduler.seconds_until_due(now=1_010_000) == 0
+
+
+def test_scheduler_thread_backs_up_and_records_metrics(db, tmp_path):
+    pages = backup.BACKUP_PAGES.value()
+    scheduler = BackupScheduler(db, tmp_path / "backups", interval=3600, step_sleep=0)
+    scheduler.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not scheduler.backup_files() and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        scheduler.stop()
+    assert len(scheduler.backup_files()) == 1
+    assert backup.BACKUP_PAGES.value() > pages
+    assert backup.BACKUP_SIZE._values[()] == scheduler.backup_files()[0].stat().st_size
@@ -177,3 +177,145 @@ def test_connection_error_recovery(db, caplog):
 
     # Restore original method
     db._connect = original_connect
+
+
+def test_log_many(db):
+    inserted = db.log_many([
+        ("batch_label", 1.0, 1000),
+        ("batch_label", 2.0, 1006),
+        ("other_batch_label", 3.0, 1012),
+    ])
+    assert inserted == 3
+    assert db.get_all_labels() == ["batch_label", "other_batch_label"]
+
+    with sqlite3.connect(db.db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT timestamp, value FROM readings ORDER BY timestamp")
+        assert cursor.fetchall() == [(1000, 1.0), (1006, 2.0), (1012, 3.0)]
+
+
+def test_log_many_resolves_labels_in_batch(db):
+    db.log_data("existing_label", 1.0, timestamp=1000)
+    db._label_cache.clear()
+
+    labels = ["existing_label"] + [f"new_label_{i}" for i in range(600)]
+    assert db.log_many([(label, 2.0, 2000) for label in labels]) == 601
+
+    with sqlite3.connect(db.db_path) as conn:
+        stored = dict(conn.execute("SELECT label, label_id FROM labels").fetchall())
+        assert conn.execute("SELECT COUNT(*) FROM readings WHERE label_id = ?",
+                            (stored["existing_label"],)).fetchone()[0] == 2
+    assert len(stored) == 601
+    assert db._label_cache == stored
+
+
+def test_label_cache_preloaded_on_setup(db_path):
+    first = Database(db_path)
+    first.setup()
+    first.log_many([("efergy_h3_1", 1.0, 1000), ("efergy_h3_2", 2.0, 1000)])
+
+    second = Database(db_path)
+    second.setup()
+    assert second._label_cache == first._label_cache
+    assert len(second._label_cache) == 2
+
+
+def test_label_created_by_another_connection(db):
+    db.log_data("efergy_h3_1", 1.0, timestamp=1000)
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute("INSERT INTO labels(label) VALUES ('efergy_h3_2')")
+        other_id = conn.execute("SELECT label_id FROM labels WHERE label = 'efergy_h3_2'").fetchone()[0]
+
+    db.log_data("efergy_h3_2", 2.0, timestamp=1000)
+    assert db._label_cache["efergy_h3_2"] == other_id
+
+
+def test_rolled_back_label_is_not_cached(db, monkeypatch):
+    db.log_data("efergy_h3_1", 1.0, timestamp=1000)
+    cache = db._label_cache
+
+    monkeypatch.setattr("database.UPSERT_LATEST_SQL", "INSERT INTO no_such_table VALUES (?,?,?,?)")
+    db.log_data("efergy_h3_new", 1.0, timestamp=1000)
+    assert "efergy_h3_new" not in db._label_cache
+    # Readers keep a consistent snapshot: the cache dict is replaced, never mutated
+    assert db._label_cache is cache
+
+    monkeypatch.undo()
+    db.log_data("efergy_h3_new", 1.0, timestamp=1000)
+    assert "efergy_h3_new" in db._label_cache
+    assert db._label_cache is not cache
+    assert "efergy_h3_new" not in cache
+
+
+def test_latest_readings(db):
+    db.log_data("efergy_h3_815751", 391.86, timestamp=1000)
+    db.log_data("efergy_h3_815751", 400.0, timestamp=1006)
+    db.log_data("efergy_h2_741459", 1000.0, timestamp=1003)
+    db.log_many([("efergy_h2_741459", 2000.0, 1009), ("efergy_h2_741459", 1500.0, 1008)])
+
+    latest = db.get_latest_readings()
+    assert latest["efergy_h3_815751"] == {"timestamp": 1006, "value": 400.0, "watts": 40.0}
+    assert latest["efergy_h2_741459"]["value"] == 2000.0
+    assert latest["efergy_h2_741459"]["watts"] == pytest.approx(0.6 * 230 * 2000.0 / 1000)
+
+    with sqlite3.connect(db.db_path) as conn:
+        rows = conn.execute("""
+            SELECT labels.label, latest_readings.timestamp, latest_readings.watts
+            FROM latest_readings JOIN labels ON labels.label_id = latest_readings.label_id
+            ORDER BY labels.label
+        """).fetchall()
+    assert rows == [("efergy_h2_741459", 1009, pytest.approx(276.0)), ("efergy_h3_815751", 1006, 40.0)]
+
+
+def test_latest_readings_backfilled_on_setup(db_path):
+    # A database from before latest_readings existed
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE labels (label_id INTEGER PRIMARY KEY AUTOINCREMENT, label STRING UNIQUE)")
+        conn.execute("CREATE TABLE readings (label_id INTEGER, timestamp INTEGER, value REAL)")
+        conn.execute("INSERT INTO labels(label) VALUES ('efergy_h3_1')")
+        conn.executemany("INSERT INTO readings VALUES (1, ?, ?)", [(1000, 10.0), (2000, 20.0), (1500, 15.0)])
+
+    db = Database(db_path)
+    db.setup()
+
+    assert db.get_latest_readings() == {"efergy_h3_1": {"timestamp": 2000, "value": 20.0, "watts": 2.0}}
+
+
+def test_setup_skips_schema_when_version_current(db_path):
+    from database import SCHEMA_VERSION
+
+    db = Database(db_path)
+    db.setup()
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        conn.execute("DROP INDEX idx_energy_hourly_hour")
+
+    # Current version: the dropped index is not recreated
+    Database(db_path).setup()
+    with sqlite3.connect(db_path) as conn:
+        indices = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        assert "idx_energy_hourly_hour" not in indices
+        conn.execute("PRAGMA user_version = 0")
+
+    # Older version: the schema is brought up to date
+    Database(db_path).setup()
+    with sqlite3.connect(db_path) as conn:
+        indices = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        assert "idx_energy_hourly_hour" in indices
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+
+def test_setup_leaves_newer_schema_alone(db_path, caplog):
+    from database import SCHEMA_VERSION
+
+    Database(db_path).setup()
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+
+    db = Database(db_path)
+    db.setup()
+    db.log_data("efergy_h3_1", 10.0, 1000)
+    db.close()
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION + 1
+    assert any("newer than this release" in record.getMessage() for record in caplog.records)
@@ -0,0 +1,91 @@
+from unittest.mock import MagicMock
+import pytest
+from database import Database
+from dedupe import IngestDeduper
+
+
+def test_duplicate_within_window():
+    deduper = IngestDeduper(window=60)
+    line = "1|1|EFCT|P1,2479.98"
+    assert not deduper.is_duplicate("hub", "efergy_h2_1", line, 1000)
+    assert deduper.is_duplicate("hub", "efergy_h2_1", line, 1010)
+    # Other sensor, hub or line
+    assert not deduper.is_duplicate("hub", "efergy_h2_2", line, 1010)
+    assert not deduper.is_duplicate("other", "efergy_h2_1", line, 1010)
+    assert not deduper.is_duplicate("hub", "efergy_h2_1", "1|1|EFCT|P1,2480.00", 1010)
+
+
+def test_keys_expire_after_window():
+    deduper = IngestDeduper(window=60)
+    deduper.is_duplicate("hub", "efergy_h2_1", "1", 1000)
+    # The same line is accepted again once the key expired
+    assert not deduper.is_duplicate("hub", "efergy_h2_1", "1", 1061)
+    assert len(deduper) == 1
+
+
+def test_bounded_key_set():
+    deduper = IngestDeduper(window=60, max_keys=3)
+    for counter in range(5):
+        deduper.is_duplicate("hub", "efergy_h2_1", str(counter), 1000)
+    assert len(deduper) == 3
+    # Evicted oldest first
+    assert not deduper.is_duplicate("hub", "efergy_h2_1", "0", 1000)
+    assert deduper.is_duplicate("hub", "efergy_h2_1", "4", 1000)
+
+
+def test_disabled_or_empty_line():
+    assert not IngestDeduper(window=0).is_duplicate("hub", "efergy_h2_1", "1", 1000)
+    deduper = IngestDeduper(window=60)
+    deduper.is_duplicate("hub", "efergy_h2_1", "", 1000)
+    assert not deduper.is_duplicate("hub", "efergy_h2_1", "", 1000)
+
+
+def test_keys_survive_restart(tmp_path):
+    import time
+    now = int(time.time())
+    database = Database(tmp_path / "dedupe.db")
+    database.setup()
+
+    deduper = IngestDeduper(database, window=60)
+    deduper.is_duplicate("hub", "efergy_h3_1", "7", now - 120)
+    deduper.is_duplicate("hub", "efergy_h3_1", "8", now)
+    deduper.is_duplicate("hub", "efergy_h3_1", "8", now)
+    assert deduper.flush() == 2
+    assert deduper.flush() == 0
+
+    # Expired keys are pruned from the table
+    assert database.get_ingest_keys(0) == [("hub", "efergy_h3_1", "8", now)]
+
+    restarted = IngestDeduper(database, window=60)
+    restarted.load_from_database()
+    assert restarted.is_duplicate("hub", "efergy_h3_1", "8", now + 1)
+    assert not restarted.is_duplicate("hub", "efergy_h3_1", "7", now + 1)
+
+
+def test_loading_keeps_lines_seen_since_startup(tmp_path):
+    import time
+    now = int(time.time())
+    database = Database(tmp_path / "dedupe.db")
+    database.setup()
+    database.save_ingest_keys([("hub", "efergy_h3_1", "8", now - 30), ("hub", "efergy_h3_1", "9", now - 20)], 0)
+
+    deduper = IngestDeduper(database, window=60, max_keys=2)
+    deduper.is_duplicate("hub", "efergy_h3_1", "9", now)
+    deduper.load_from_database()
+    # The stored key is older than the live one, so it is evicted first
+    assert len(deduper) == 2
+    assert not deduper.is_duplicate("hub", "efergy_h3_1", "7", now + 1)
+    assert deduper.is_duplicate("hub", "efergy_h3_1", "9", now + 50)
+    assert not deduper.is_duplicate("hub", "efergy_h3_1", "8", now + 1)
+
+
+def test_failed_flush_is_retried():
+    database = MagicMock()
+    database.save_ingest_keys.side_effect = [RuntimeError("locked"), 1]
+    deduper = IngestDeduper(database, window=60)
+    deduper.is_duplicate("hub", "efergy_h2_1", "1", 1000)
+
+    with pytest.raises(RuntimeError):
+        deduper.flush()
+    assert deduper.flush() == 1
+    assert database.save_ingest_keys.call_args[0][0] == [("hub", "efergy_h2_1", "1", 1000)]
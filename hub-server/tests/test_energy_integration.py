@@ -0,0 +1,118 @@
+import random
+import sqlite3
+import pytest
+from unittest.mock import patch
+from database import Database
+from energy_integration import HAS_NUMPY, integrate_hours, integrate_rows, interval_kwh
+
+HOUR = 1_700_000_000 - (1_700_000_000 % 3600)
+
+requires_numpy = pytest.mark.skipif(not HAS_NUMPY, reason="NumPy not installed")
+
+
+def _random_series(seed, hours=5, gap_chance=0.01):
+    rng = random.Random(seed)
+    timestamps, kw = [], []
+    ts = HOUR + rng.randrange(3600)
+    end = HOUR + hours * 3600
+    while ts < end:
+        timestamps.append(ts)
+        kw.append(rng.uniform(0.0, 5.0))
+        ts += rng.randrange(1, 5000) if rng.random() < gap_chance else rng.randrange(0, 12)
+    return timestamps, kw
+
+
+def _reference_hour(rows):
+    """The loop aggregate_one_hour used before the integration engine."""
+    kwh_total = 0.0
+    for i in range(len(rows) - 1):
+        kwh_total += rows[i][1] * ((rows[i + 1][0] - rows[i][0]) / 3600)
+    if len(rows) > 1:
+        kwh_total += rows[-1][1] * ((rows[-1][0] - rows[-2][0]) / 3600)
+    return kwh_total
+
+
+@pytest.mark.parametrize("use_numpy", [False, pytest.param(True, marks=requires_numpy)])
+def test_default_matches_per_hour_loop(use_numpy):
+    timestamps, kw = _random_series(1)
+    result = integrate_hours(timestamps, kw, method="left", max_gap=0, split_hours=False, use_numpy=use_numpy)
+
+    for hour_start, kwh in result.items():
+        rows = [(ts, value) for ts, value in zip(timestamps, kw) if hour_start <= ts < hour_start + 3600]
+        assert kwh == _reference_hour(rows)
+
+
+@requires_numpy
+@pytest.mark.parametrize("method", ["left", "trapezoid"])
+@pytest.mark.parametrize("max_gap", [0, 30, 7200])
+@pytest.mark.parametrize("split_hours", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_numpy_and_python_identical(method, max_gap, split_hours, seed):
+    timestamps, kw = _random_series(seed, gap_chance=0.05)
+    options = dict(method=method, max_gap=max_gap, split_hours=split_hours)
+
+    assert integrate_hours(timestamps, kw, use_numpy=True, **options) == \
+        integrate_hours(timestamps, kw, use_numpy=False, **options)
+
+
+@pytest.mark.parametrize("use_numpy", [False, pytest.param(True, marks=requires_numpy)])
+def test_methods_and_gap_cap(use_numpy):
+    # 1 kW for 10 minutes, 3 kW for 20 minutes, then a 3 kW sample after a 20 minute outage
+    timestamps = [HOUR, HOUR + 600, HOUR + 1800, HOUR + 3000]
+    kw = [1.0, 3.0, 3.0, 3.0]
+
+    left = integrate_hours(timestamps, kw, method="left", max_gap=0, split_hours=False, use_numpy=use_numpy)
+    assert left[HOUR] == pytest.approx((600 * 1 + 1200 * 3 + 1200 * 3 + 1200 * 3) / 3600)
+
+    trapezoid = integrate_hours(timestamps, kw, method="trapezoid", max_gap=0, split_hours=False,
+                                use_numpy=use_numpy)
+    assert trapezoid[HOUR] == pytest.approx((600 * 2 + 1200 * 3 + 1200 * 3 + 1200 * 3) / 3600)
+
+    capped = integrate_hours(timestamps, kw, method="left", max_gap=300, split_hours=False, use_numpy=use_numpy)
+    assert capped[HOUR] == pytest.approx(4 * 300 * kw[0] / 3600 + 3 * 300 * 2 / 3600)
+
+
+@pytest.mark.parametrize("use_numpy", [False, pytest.param(True, marks=requires_numpy)])
+def test_split_hours(use_numpy):
+    # 2 kW from 30 minutes before the hour until 15 minutes after, then 1 kW
+    timestamps = [HOUR - 1800, HOUR + 900, HOUR + 1800]
+    kw = [2.0, 1.0, 1.0]
+
+    per_hour = integrate_hours(timestamps, kw, method="left", max_gap=0, split_hours=False, use_numpy=use_numpy)
+    # On its own the first sample has no interval; the gap across the boundary is lost
+    assert per_hour == {HOUR - 3600: 0.0, HOUR: pytest.approx(1800 / 3600)}
+
+    split = integrate_hours(timestamps, kw, method="left", max_gap=0, split_hours=True, use_numpy=use_numpy)
+    assert split[HOUR - 3600] == pytest.approx(1.0)
+    assert split[HOUR] == pytest.approx(0.5 + 0.25 + 0.25)
+    assert sum(split.values()) == pytest.approx(2 * 2700 / 3600 + 900 / 3600 + 900 / 3600)
+
+    trapezoid = integrate_hours(timestamps, kw, method="trapezoid", max_gap=0, split_hours=True,
+                                use_numpy=use_numpy)
+    # Linear from 2 kW to 1 kW over 45 minutes: 1.3333 kW at the boundary
+    assert trapezoid[HOUR - 3600] == pytest.approx((2 + 4 / 3) / 2 * 0.5)
+    assert trapezoid[HOUR] == pytest.approx((4 / 3 + 1) / 2 * 0.25 + 0.25 + 0.25)
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        integrate_hours([HOUR], [1.0], method="simpson")
+    with pytest.raises(ValueError):
+        integrate_hours([HOUR, HOUR + 1], [1.0])
+    assert integrate_rows([]) == {}
+    assert interval_kwh(2.0, 4.0, 1800, method="trapezoid", max_gap=0) == 1.5
+
+
+def test_aggregate_one_hour_split_uses_neighbours(tmp_path):
+    db = Database(tmp_path / "split.db")
+    db.setup()
+    # efergy_h3 values are tenths of a watt: 20000 = 2 kW
+    db.log_many([("efergy_h3_1", 20000.0, HOUR - 1800), ("efergy_h3_1", 10000.0, HOUR + 900),
+                 ("efergy_h3_1", 10000.0, HOUR + 1800), ("efergy_h3_1", 10000.0, HOUR + 4500)])
+
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        assert db.aggregate_one_hour(cursor, HOUR) == pytest.approx(900 / 3600 + 900 / 3600)
+        with patch("database.ENERGY_INTEGRATION_SPLIT_HOURS", True):
+            kwh = db.aggregate_one_hour(cursor, HOUR)
+    assert kwh == pytest.approx(2 * 900 / 3600 + 1 * 2700 / 3600)
@@ -0,0 +1,76 @@
+import pytest
+from database import Database
+from hot_window import HotWindow
+
+
+def test_window_trims_old_readings():
+    window = HotWindow(window_sec=60)
+    for ts in range(0, 300, 6):
+        window.add("efergy_h3_1", ts, 100.0)
+
+    rows = window.window("efergy_h3_1", now=294)
+    assert rows[0][0] >= 294 - 60
+    assert rows[-1] == (294, 100.0)
+
+
+def test_out_of_order_reading_is_inserted_in_place():
+    window = HotWindow(window_sec=600)
+    window.add("efergy_h3_1", 100, 1.0)
+    window.add("efergy_h3_1", 112, 3.0)
+    window.add("efergy_h3_1", 106, 2.0)
+
+    assert window.window("efergy_h3_1", now=112) == [(100, 1.0), (106, 2.0), (112, 3.0)]
+
+
+def test_stats_in_watts():
+    window = HotWindow(window_sec=3600)
+    for ts, value in [(1000, 100.0), (1006, 300.0), (1012, 200.0)]:
+        window.add("efergy_h3_1", ts, value)
+
+    stats = window.stats("efergy_h3_1", 300, now=1012)
+    assert stats["count"] == 3
+    assert stats["average_watts"] == pytest.approx(20.0)
+    assert stats["peak_watts"] == pytest.approx(30.0)
+    assert stats["latest_watts"] == pytest.approx(20.0)
+    assert window.stats("efergy_h3_1", 300, now=5000) is None
+    assert window.stats("unknown", 300, now=1012) is None
+
+
+def test_partial_hour_energy_matches_aggregation(tmp_path):
+    hour_start = 3600 * 10
+    readings = [(hour_start + 10, 1000.0), (hour_start + 1810, 2000.0), (hour_start + 2710, 1500.0)]
+
+    window = HotWindow(window_sec=3600)
+    db = Database(tmp_path / "hot.db")
+    db.setup()
+    for ts, value in readings:
+        window.add("efergy_h3_1", ts, value)
+        db.log_data("efergy_h3_1", value, timestamp=ts)
+
+    with db._get_connection() as conn:
+        expected = db.aggregate_one_hour(conn.cursor(), hour_start)
+
+    assert window.partial_hour_energy("efergy_h3_1", now=hour_start + 3599) == pytest.approx(expected)
+
+
+def test_load_from_database(tmp_path):
+    db = Database(tmp_path / "hot.db")
+    db.setup()
+    db.log_many([("efergy_h2_1", 1.0, 1000), ("efergy_h2_1", 2.0, 3000), ("efergy_h3_1", 3.0, 3500)])
+
+    window = HotWindow(window_sec=1000)
+    assert window.load_from_database(db, now=3600) == 2
+    assert window.window("efergy_h2_1", now=3600) == [(3000, 2.0)]
+    assert window.labels() == ["efergy_h2_1", "efergy_h3_1"]
+
+
+def test_load_keeps_readings_added_since_startup(tmp_path):
+    db = Database(tmp_path / "hot.db")
+    db.setup()
+    db.log_many([("efergy_h2_1", 1.0, 3000), ("efergy_h2_1", 2.0, 3100), ("efergy_h2_1", 3.0, 3200)])
+
+    window = HotWindow(window_sec=1000)
+    window.add("efergy_h2_1", 3200, 3.0)
+    window.add("efergy_h2_1", 3300, 4.0)
+    window.load_from_database(db, now=3600)
+    assert window.window("efergy_h2_1", now=3600) == [(3000, 1.0), (3100, 2.0), (3200, 3.0), (3300, 4.0)]
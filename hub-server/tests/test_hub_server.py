@@ -1,7 +1,10 @@
+import json
+import logging
 import pytest
 import http.client
 import threading
 import socket
+import time
 from unittest.mock import MagicMock
 from hub_server import EfergyHTTPServer, FakeEfergyServer
 
@@ -14,12 +17,15 @@ def mock_mqtt():
     return MagicMock()
 
 @pytest.fixture
-def test_server(mock_db, mock_mqtt):
+def httpd(mock_db, mock_mqtt):
+    server_address = ('127.0.0.1', 0)  # 0 = pick a free port
+    return EfergyHTTPServer(server_address, FakeEfergyServer, mock_db, mock_mqtt)
+
+@pytest.fixture
+def test_server(httpd):
     """
     Starts the HTTP server in a background thread and ensures clean shutdown.
     """
-    server_address = ('127.0.0.1', 0)  # 0 = pick a free port
-    httpd = EfergyHTTPServer(server_address, FakeEfergyServer, mock_db, mock_mqtt)
     port = httpd.server_port
 
     thread = threading.Thread(target=httpd.serve_forever)
@@ -110,3 +116,310 @@ def test_post_ping(test_server):
     status, data = http_request(host, port, "POST", "/any", body=payload, headers=headers)
     assert status == 200
     assert data == b"success"
+
+
+def test_request_latency_metrics(test_server):
+    from metrics import HTTP_REQUEST_DURATION
+
+    host, port = test_server
+    before = HTTP_REQUEST_DURATION.count("/check_key.html")
+    http_request(host, port, "GET", "/check_key.html")
+
+    # The observation is recorded after the response has been flushed
+    deadline = time.monotonic() + 1
+    while HTTP_REQUEST_DURATION.count("/check_key.html") == before and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert HTTP_REQUEST_DURATION.count("/check_key.html") == before + 1
+
+
+def test_debug_details_skipped_at_info(test_server, caplog):
+    caplog.set_level(logging.INFO)
+    host, port = test_server
+    payload = b"741459|1|EFCT|P1,2479.98"
+    http_request(host, port, "POST", "/h2", body=payload, headers={"Content-Length": str(len(payload))})
+
+    assert not any(">>> REQUEST" in rec.getMessage() for rec in caplog.records)
+
+
+def test_sampled_debug_logs_every_nth_request(httpd, test_server, caplog):
+    caplog.set_level(logging.INFO)
+    httpd.debug_sample_rate = 2
+    host, port = test_server
+
+    for _ in range(4):
+        http_request(host, port, "GET", "/check_key.html")
+
+    sampled = [rec for rec in caplog.records if ">>> REQUEST" in rec.getMessage()]
+    assert len(sampled) == 2
+    assert all(rec.levelno == logging.INFO for rec in sampled)
+
+
+def test_unknown_post_is_captured(httpd, test_server):
+    host, port = test_server
+    payload = b"x" * 5000
+    status, _ = http_request(host, port, "POST", "/nope", body=payload,
+                             headers={"Content-Type": "text/plain", "Content-Length": str(len(payload))})
+    assert status == 200
+
+    recent = httpd.unknown_packets.recent()
+    assert recent[-1]["path"] == "/nope"
+    assert len(recent[-1]["body"]) == httpd.unknown_packets.max_bytes
+
+
+def test_api_latest(test_server, mock_db):
+    mock_db.get_latest_readings.return_value = {
+        "efergy_h2_741459": {"timestamp": 1000, "value": 2479.98, "watts": 342.23},
+        "efergy_h3_815751": {"timestamp": 1006, "value": 391.86, "watts": 39.186},
+    }
+    host, port = test_server
+
+    status, data = http_request(host, port, "GET", "/api/latest")
+    assert status == 200
+    assert json.loads(data)["efergy_h3_815751"]["watts"] == 39.186
+
+    status, data = http_request(host, port, "GET", "/api/latest?label=efergy_h2_741459")
+    assert list(json.loads(data)) == ["efergy_h2_741459"]
+
+
+def test_api_recent_uses_hot_window(test_server):
+    host, port = test_server
+    payload = b"815751|1|EFCT|P1,391.86|-66"
+    http_request(host, port, "POST", "/h3", body=payload, headers={"Content-Length": str(len(payload))})
+
+    status, data = http_request(host, port, "GET", "/api/recent?seconds=60")
+    assert status == 200
+    sensors = json.loads(data)["sensors"]
+    assert sensors["efergy_h3_815751"]["latest_watts"] == pytest.approx(39.186)
+
+    status, _ = http_request(host, port, "GET", "/api/recent?seconds=abc")
+    assert status == 400
+
+
+def test_api_ready_reports_startup_phases(httpd, test_server):
+    from startup import StartupStatus
+
+    host, port = test_server
+    status, data = http_request(host, port, "GET", "/api/ready")
+    assert status == 200
+    assert json.loads(data)["ready"] is True
+
+    httpd.startup = StartupStatus(["schema", "aggregation"])
+    httpd.startup.run("schema", lambda: None)
+    status, data = http_request(host, port, "GET", "/api/ready")
+    assert status == 503
+    assert json.loads(data)["phases"]["aggregation"]["state"] == "pending"
+
+    httpd.startup.finish("aggregation")
+    status, data = http_request(host, port, "GET", "/api/ready")
+    assert status == 200
+    assert json.loads(data)["ready"] is True
+
+
+def test_api_liveness_tracks_posts_and_pings(test_server, mock_mqtt):
+    host, port = test_server
+    payload = b"815751|1|EFCT|P1,391.86|-66"
+    headers = {"Host": "AABBCCDDEEFF.h3.sensornet.info", "Content-Length": str(len(payload))}
+    http_request(host, port, "POST", "/h3", body=payload, headers=headers)
+    http_request(host, port, "POST", "/h3", body=payload, headers=headers)
+    mock_mqtt.publish_availability.assert_called_once_with("efergy_h3_815751", True)
+
+    ping = b"815751|815752"
+    http_request(host, port, "POST", "/h3", body=ping, headers={
+        "Host": "AABBCCDDEEFF.h3.sensornet.info", "Content-Type": "application/eh-ping",
+        "Content-Length": str(len(ping)),
+    })
+
+    status, data = http_request(host, port, "GET", "/api/liveness")
+    assert status == 200
+    liveness = json.loads(data)
+    hub = liveness["hubs"]["AABBCCDDEEFF"]
+    assert hub["posts"] == 2 and hub["sensors"] == ["815751", "815752"]
+    sensor = liveness["sensors"]["efergy_h3_815751"]
+    assert sensor["online"] and sensor["readings"] == 2 and sensor["rssi"] == -66.0
+    assert sensor["hub"] == "AABBCCDDEEFF"
+    assert not liveness["sensors"]["efergy_h3_815752"]["online"]
+
+    status, data = http_request(host, port, "GET", "/api/liveness?label=efergy_h3_815752")
+    assert list(json.loads(data)["sensors"]) == ["efergy_h3_815752"]
+
+
+def test_retried_post_is_dropped(httpd, test_server, mock_db, mock_mqtt):
+    from dedupe import INGEST_DUPLICATES
+
+    httpd.deduper.window = 600
+    host, port = test_server
+    before = INGEST_DUPLICATES.value("h2")
+    payload = b"741459|7|EFCT|P1,2479.98\r\n741460|7|EFCT|P1,100.00"
+    for host_header in ("41.0a.04.001ec0.h2.sensornet.info", "41.0a.04.001ec0.h2.sensornet.info",
+                        "41.0a.04.001ec1.h2.sensornet.info"):
+        status, _ = http_request(host, port, "POST", "/h2", body=payload, headers={
+            "Host": host_header, "Content-Length": str(len(payload)),
+        })
+        assert status == 200
+
+    # The retry from the first hub is dropped, the same lines from another hub are not
+    assert mock_db.log_data.call_count == 4
+    assert mock_mqtt.publish_power.call_count == 4
+    assert INGEST_DUPLICATES.value("h2") == before + 2
+
+
+def test_repeated_post_is_stored_by_default(test_server, mock_db):
+    host, port = test_server
+    # Real hubs send a constant 1 after the sensor id, so an unchanged reading repeats the whole line
+    payload = b"741459|1|EFCT|P1,2479.98"
+    for _ in range(3):
+        http_request(host, port, "POST", "/h2", body=payload, headers={"Content-Length": str(len(payload))})
+    assert mock_db.log_data.call_count == 3
+
+
+def test_batched_mode_publishes_one_message_per_post(test_server, mock_mqtt):
+    mock_mqtt.per_sensor_topics = False
+    host, port = test_server
+    payload = b"741459|3|EFCT|P1,2479.98\r\n741460|3|EFCT|P1,100.00"
+    http_request(host, port, "POST", "/h2", body=payload, headers={
+        "Host": "41.0a.04.001ec0.h2.sensornet.info", "Content-Length": str(len(payload)),
+    })
+
+    mock_mqtt.publish_power.assert_not_called()
+    mock_mqtt.publish_hub_power.assert_called_once()
+    hub, hub_version, readings, _ = mock_mqtt.publish_hub_power.call_args[0]
+    assert (hub, hub_version) == ("41.0a.04.001ec0", "h2")
+    assert readings == [("efergy_h2_741459", "741459", 2479.98), ("efergy_h2_741460", "741460", 100.0)]
+
+
+def test_concurrent_posts_reach_live_energy_in_storage_order(httpd, mock_db, test_server):
+    stored, added = [], []
+
+    def log_data(label, value, timestamp):
+        stored.append(label)
+        time.sleep(0.001 * (int(label[-1]) % 3))
+
+    mock_db.log_data.side_effect = log_data
+    httpd.live_energy = MagicMock()
+    httpd.live_energy.add.side_effect = lambda label, timestamp, value: added.append(label)
+    host, port = test_server
+
+    def post(hub):
+        lines = [f"{hub}{sensor}|1|EFCT|P1,100.00|-66" for sensor in range(1, 6)]
+        payload = "\r\n".join(lines).encode()
+        http_request(host, port, "POST", "/h3", body=payload, headers={"Content-Length": str(len(payload))})
+
+    threads = [threading.Thread(target=post, args=(hub,)) for hub in range(80001, 80009)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(added) == 40
+    assert added == stored
+
+
+def test_readings_are_streamed(httpd, test_server):
+    from stream import ReadingStream
+
+    httpd.stream = ReadingStream(httpd.hot_window)
+    subscription = httpd.stream.subscribe(["efergy_h3_815751"])
+    host, port = test_server
+    payload = b"815751|1|EFCT|P1,391.86|-66\r\n815752|1|EFCT|P1,100.00|-66"
+    http_request(host, port, "POST", "/h3", body=payload, headers={"Content-Length": str(len(payload))})
+
+    label, _, value, _ = subscription.queue.get(timeout=1)
+    assert (label, value) == ("efergy_h3_815751", 391.86)
+    assert subscription.queue.empty()
+
+
+def test_idle_keepalive_connection_does_not_block_others(test_server):
+    host, port = test_server
+    idle = http.client.HTTPConnection(host, port, timeout=5)
+    try:
+        idle.request("GET", "/check_key.html")
+        assert idle.getresponse().read() == b"success"
+
+        # A second connection is served while the first is kept alive
+        status, data = http_request(host, port, "GET", "/check_key.html")
+        assert status == 200
+
+        # And the first is still reusable
+        idle.request("GET", "/get_key.html")
+        assert idle.getresponse().status == 200
+    finally:
+        idle.close()
+
+
+def test_idle_connection_times_out(monkeypatch, test_server):
+    host, port = test_server
+    monkeypatch.setattr(FakeEfergyServer, "timeout", 0.2)
+    with socket.create_connection((host, port), timeout=5) as sock:
+        sock.sendall(b"GET /check_key.html HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = b""
+        while not response.endswith(b"success"):
+            response += sock.recv(4096)
+        # The server closes the idle connection
+        assert sock.recv(4096) == b""
+
+
+def test_server_close_closes_idle_connections(httpd, test_server):
+    host, port = test_server
+    conn = http.client.HTTPConnection(host, port, timeout=5)
+    conn.request("GET", "/check_key.html")
+    conn.getresponse().read()
+    assert httpd.open_connections() == 1
+
+    start = time.monotonic()
+    assert httpd.close_idle_connections(timeout=1)
+    assert time.monotonic() - start < 1
+    deadline = time.monotonic() + 1
+    while httpd.open_connections() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert httpd.open_connections() == 0
+    conn.close()
+
+
+def test_unix_socket(tmp_path, mock_db, mock_mqtt):
+    path = str(tmp_path / "hub.sock")
+    # A socket left behind by a previous run is replaced
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(path)
+    stale.close()
+
+    httpd = EfergyHTTPServer(path, FakeEfergyServer, mock_db, mock_mqtt)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.settimeout(5)
+            sock.connect(path)
+            payload = b"741459|1|EFCT|P1,2479.98"
+            sock.sendall(b"POST /h2 HTTP/1.1\r\nHost: localhost\r\nContent-Type: text/plain\r\n"
+                         b"Content-Length: %d\r\n\r\n%s" % (len(payload), payload))
+            response = b""
+            while b"\r\n\r\n" not in response:
+                response += sock.recv(4096)
+        assert response.startswith(b"HTTP/1.1 200")
+        mock_db.log_data.assert_called_once()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join()
+    # Removed on close
+    assert not (tmp_path / "hub.sock").exists()
+
+
+def test_is_trusted_proxy():
+    from hub_server import is_trusted_proxy
+
+    proxies = "unix,127.0.0.0/8,172.16.0.0/12"
+    assert is_trusted_proxy("unix", proxies)
+    assert is_trusted_proxy("172.18.0.3", proxies)
+    assert is_trusted_proxy("::ffff:127.0.0.1", proxies)
+    assert not is_trusted_proxy("192.168.1.20", proxies)
+    assert not is_trusted_proxy("unix", "127.0.0.1")
+
+
+def test_unknown_packets_are_rate_limited_per_real_client(httpd, test_server):
+    host, port = test_server
+    httpd.unknown_packets.rate_limit = 1
+    for client in ("192.168.1.20", "192.168.1.20", "192.168.1.21"):
+        http_request(host, port, "GET", "/nope", headers={"X-Real-IP": client})
+
+    # The loopback peer is a trusted proxy, so each real client has its own budget
+    assert [packet["client"] for packet in httpd.unknown_packets.recent()] == ["192.168.1.20", "192.168.1.21"]
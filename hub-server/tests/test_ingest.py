@@ -0,0 +1,74 @@
+import http.client
+import multiprocessing
+import queue
+import socket
+import time
+import pytest
+from database import Database
+from ingest import ForwardingDatabase, IngestWriter, start_workers, stop_workers
+from live_energy import LiveEnergyIntegrator
+
+
+def test_forwarding_database_forwards_writes(tmp_path):
+    db = Database(tmp_path / "ingest.db")
+    db.setup()
+    forwarded = queue.Queue()
+    worker_db = ForwardingDatabase(db.db_path, forwarded)
+    worker_db.load_latest_readings()
+
+    worker_db.log_data("efergy_h3_1", 1000.0, timestamp=100)
+    assert worker_db.log_many([("efergy_h3_1", 2000.0, 110), ("efergy_h3_2", 5.0, 105)]) == 2
+
+    assert forwarded.get_nowait() == [("efergy_h3_1", 1000.0, 100)]
+    assert forwarded.get_nowait() == [("efergy_h3_1", 2000.0, 110), ("efergy_h3_2", 5.0, 105)]
+    assert worker_db.get_latest_readings()["efergy_h3_1"]["watts"] == pytest.approx(200.0)
+    # Nothing was written by the worker
+    assert db.get_all_labels() == []
+
+
+def test_writer_commits_batches(tmp_path):
+    db = Database(tmp_path / "ingest.db")
+    db.setup()
+    forwarded = queue.Queue()
+    live = LiveEnergyIntegrator()
+    live.set_completed(0.0, None)
+    writer = IngestWriter(db, forwarded, batch_size=3, flush_interval=0.01, live_energy=live)
+
+    for ts in range(7200, 7260, 10):
+        forwarded.put([("efergy_h3_1", 1000.0, ts)])
+
+    assert writer.drain() == 3
+    assert writer.drain_all() == 3
+    assert writer.drain() == 0
+    assert db.get_recent_readings(0)["efergy_h3_1"][-1] == (7250, 1000.0)
+    assert live.total() == pytest.approx(0.1 * 50 / 3600)
+
+
+def test_workers_forward_to_writer(tmp_path):
+    db = Database(tmp_path / "ingest.db")
+    db.setup()
+    sock = socket.create_server(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    forwarded = multiprocessing.get_context("fork").Queue()
+    processes = start_workers(sock, forwarded, db.db_path, 2)
+    writer = IngestWriter(db, forwarded, flush_interval=0.1)
+
+    try:
+        payload = b"741459|1|EFCT|P1,2479.98"
+        for _ in range(6):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("POST", "/h3", body=payload, headers={"Content-Length": str(len(payload))})
+            assert conn.getresponse().read() == b"success"
+            conn.close()
+
+        committed = 0
+        deadline = time.time() + 5
+        while committed < 6 and time.time() < deadline:
+            committed += writer.drain()
+        assert committed == 6
+    finally:
+        stop_workers(processes)
+        sock.close()
+
+    assert all(process.exitcode is not None for process in processes)
+    assert db.get_all_labels() == ["efergy_h3_741459"]
@@ -0,0 +1,88 @@
+import os
+import pytest
+from database import Database
+from journal import HEADER_SIZE, IngestJournal
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(tmp_path / "journal.db")
+    db.setup()
+    return db
+
+
+def _count(db):
+    with db._get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+
+
+def test_journaled_writes_are_committed_by_drain(tmp_path, db):
+    journal = IngestJournal(tmp_path / "ingest.journal", db, fsync_interval=0)
+    journal.open()
+    db.attach_journal(journal)
+
+    db.log_data("efergy_h3_1", 1000.0, timestamp=100)
+    db.log_many([("efergy_h3_1", 2000.0, 110), ("efergy_h3_2", 5.5, 105)])
+
+    # Acknowledged and visible in memory before anything reaches SQLite
+    assert _count(db) == 0
+    assert db.get_latest_readings()["efergy_h3_1"]["value"] == 2000.0
+
+    assert journal.drain() == 3
+    assert _count(db) == 3
+    assert db.get_journal_checkpoint() == (journal.generation, os.path.getsize(journal.path))
+    assert db.get_recent_readings(0)["efergy_h3_2"] == [(105, 5.5)]
+
+
+def test_uncommitted_tail_is_replayed_once(tmp_path, db):
+    path = tmp_path / "ingest.journal"
+    journal = IngestJournal(path, db)
+    journal.open()
+    journal.append([("efergy_h3_1", 1.0, 100), ("efergy_h3_1", 2.0, 110)])
+    journal.drain()
+    journal.append([("efergy_h3_1", 3.0, 120)])
+    # Simulate a crash: no stop(), plus a torn final write
+    with open(path, "ab") as f:
+        f.write(b"efergy_h3_1\t4.0")
+
+    replayed = IngestJournal(path, db)
+    assert replayed.open() == 1
+    assert _count(db) == 3
+    assert os.path.getsize(path) == HEADER_SIZE
+
+    # Reopening again replays nothing
+    assert IngestJournal(path, db).open() == 0
+    assert _count(db) == 3
+
+
+def test_drain_failure_keeps_readings(tmp_path, db, monkeypatch):
+    journal = IngestJournal(tmp_path / "ingest.journal", db)
+    journal.open()
+    journal.append([("efergy_h3_1", 1.0, 100)])
+
+    def locked(*args):
+        raise RuntimeError("Could not acquire DB connection after retries")
+
+    monkeypatch.setattr(db, "commit_journal_batch", locked)
+    assert journal.drain() == 0
+    monkeypatch.undo()
+
+    assert journal.drain() == 1
+    assert _count(db) == 1
+
+
+def test_compaction_keeps_uncommitted_tail(tmp_path, db):
+    path = tmp_path / "ingest.journal"
+    journal = IngestJournal(path, db, compact_bytes=HEADER_SIZE + 1)
+    journal.open()
+    generation = journal.generation
+
+    journal.append([("efergy_h3_1", 1.0, 100)])
+    assert journal.drain() == 1
+    assert journal.generation != generation
+    assert os.path.getsize(path) == HEADER_SIZE
+
+    journal.append([("efergy_h3_1", 2.0, 110)])
+    journal.stop()
+    assert _count(db) == 2
+    assert IngestJournal(path, db).open() == 0
@@ -0,0 +1,137 @@
+import random
+from unittest.mock import MagicMock
+from database import Database
+from live_energy import LiveEnergyIntegrator, LiveEnergyPublisher
+
+HOUR = 3600 * 100
+
+
+def _readings(seed=1):
+    rng = random.Random(seed)
+    rows = []
+    for offset in range(5, 3600, 6):
+        rows.append(("efergy_h3_1", HOUR + offset, float(rng.randint(100, 3000))))
+        if offset % 12 == 5:
+            rows.append(("efergy_h1_2", HOUR + offset, float(rng.randint(1, 15))))
+    return rows
+
+
+def _aggregate(db, hour_start):
+    with db._get_connection() as conn:
+        return db.aggregate_one_hour(conn.cursor(), hour_start)
+
+
+def test_total_reconciles_exactly_with_aggregation(tmp_path):
+    db = Database(tmp_path / "live.db")
+    db.setup()
+    live = LiveEnergyIntegrator()
+    live.set_completed(0.0, None)
+
+    for label, ts, value in _readings():
+        db.log_data(label, value, timestamp=ts)
+        live.add(label, ts, value)
+
+    partial = live.total()
+    kwh = _aggregate(db, HOUR)
+    series = db.get_hour_series(HOUR)
+    tail = series[-1][1] * ((series[-1][0] - series[-2][0]) / 3600)
+    # Same operations in the same order: the stored hour is exactly partial + tail
+    assert partial + tail == kwh
+
+    live.set_completed(kwh, HOUR)
+    assert live.total() == kwh
+
+
+def test_partial_hour_matches_aggregation_of_closed_intervals(tmp_path):
+    db = Database(tmp_path / "live.db")
+    db.setup()
+    live = LiveEnergyIntegrator()
+    live.set_completed(1.5, HOUR - 3600)
+
+    rows = [("efergy_h3_1", HOUR + 10, 1000.0), ("efergy_h3_1", HOUR + 1810, 2000.0),
+            ("efergy_h3_1", HOUR + 2710, 1500.0)]
+    for label, ts, value in rows:
+        live.add(label, ts, value)
+
+    # Two closed intervals: 0.1 kW for 30 min + 0.2 kW for 15 min
+    assert live.total() == 1.5 + (0.1 * (1800 / 3600) + 0.2 * (900 / 3600))
+
+
+def test_total_is_none_until_completed_and_monotonic():
+    live = LiveEnergyIntegrator()
+    live.add("efergy_h3_1", HOUR, 1000.0)
+    assert live.total() is None
+
+    live.set_completed(10.0, HOUR - 3600)
+    totals = []
+    for ts in range(HOUR + 6, HOUR + 600, 6):
+        live.add("efergy_h3_1", ts, 1000.0)
+        totals.append(live.total())
+    assert totals == sorted(totals)
+
+    # A tiny decrease from reconciling the float sum is not published
+    live.set_completed(totals[-1] - 1e-12, HOUR)
+    assert live.total() == totals[-1]
+
+
+def test_late_readings_for_aggregated_hour_are_ignored():
+    live = LiveEnergyIntegrator()
+    live.set_completed(5.0, HOUR)
+    live.add("efergy_h3_1", HOUR + 100, 1000.0)
+    live.add("efergy_h3_1", HOUR + 200, 1000.0)
+    assert live.total() == 5.0
+
+
+def test_out_of_order_reading_reseeds_from_database(tmp_path):
+    db = Database(tmp_path / "live.db")
+    db.setup()
+    live = LiveEnergyIntegrator()
+    live.seed_from_database(db, now=HOUR + 3599)
+    live.set_completed(0.0, HOUR - 3600)
+
+    for ts in (HOUR + 0, HOUR + 20, HOUR + 10, HOUR + 30):
+        db.log_data("efergy_h3_1", 1000.0, timestamp=ts)
+        live.add("efergy_h3_1", ts, 1000.0)
+
+    assert live.total() == 0.1 * (10 / 3600) * 3
+
+
+def test_seed_from_database_and_aggregator_handoff(tmp_path):
+    db = Database(tmp_path / "live.db")
+    db.setup()
+    rows = _readings(seed=2)
+    half = len(rows) // 2
+    db.log_many([(label, value, ts) for label, ts, value in rows[:half]])
+
+    live = LiveEnergyIntegrator()
+    live.seed_from_database(db, now=HOUR + 3599)
+    live.set_completed(0.0, None)
+    for label, ts, value in rows[half:]:
+        db.log_data(label, value, timestamp=ts)
+        live.add(label, ts, value)
+
+    kwh = _aggregate(db, HOUR)
+    assert db.get_last_aggregated_hour() == HOUR
+    live.set_completed(db.get_total_energy(), db.get_last_aggregated_hour())
+    assert live.total() == kwh
+
+
+def test_publisher_publishes_total():
+    live = LiveEnergyIntegrator()
+    mqtt = MagicMock()
+    publisher = LiveEnergyPublisher(live, mqtt, interval_sec=60)
+
+    assert publisher.publish_once() is None
+    assert not mqtt.publish_energy.called
+
+    live.set_completed(2.5, None)
+    assert publisher.publish_once() == 2.5
+    mqtt.publish_energy.assert_called_once_with(2.5)
+
+
+def test_disabled_with_split_hours():
+    from live_energy import live_energy_enabled
+
+    assert live_energy_enabled(60, split_hours=False)
+    assert not live_energy_enabled(60, split_hours=True)
+    assert not live_energy_enabled(0, split_hours=False)
@@ -0,0 +1,112 @@
+from unittest.mock import MagicMock, call, patch
+from database import Database
+from liveness import LivenessMonitor, LivenessRegistry, hub_id_from_host
+from mqtt_manager import MQTTManager
+
+
+def test_hub_id_from_host():
+    assert hub_id_from_host("AABBCCDDEEFF.h3.sensornet.info") == "AABBCCDDEEFF"
+    assert hub_id_from_host("AABBCCDDEEFF.keys.sensornet.info:443") == "AABBCCDDEEFF"
+    assert hub_id_from_host("41.0a.04.001ec0.h3.sensornet.info") == "41.0a.04.001ec0"
+    assert hub_id_from_host("41.0a.04.001ec0.sensornet.info") == "41.0a.04.001ec0"
+    assert hub_id_from_host("localhost:5000", "10.0.0.7") == "10.0.0.7"
+    assert hub_id_from_host("", "10.0.0.7") == "10.0.0.7"
+
+
+def test_record_and_snapshot():
+    registry = LivenessRegistry(timeout=60)
+    registry.record_post("AABB", "h3", 1000)
+    assert registry.record_reading("efergy_h3_1", "AABB", "h3", 1000, 2500.0, rssi=-61.0)
+    assert not registry.record_reading("efergy_h3_1", "AABB", "h3", 1006, 2600.0)
+    registry.record_ping("AABB", "h3", ["1", "2"], 1010)
+
+    snapshot = registry.snapshot(now=1030)
+    hub = snapshot["hubs"]["AABB"]
+    assert hub["posts"] == 1 and hub["last_seen"] == 1010 and hub["last_ping"] == 1010
+    assert hub["sensors"] == ["1", "2"] and hub["online"]
+
+    sensor = snapshot["sensors"]["efergy_h3_1"]
+    assert sensor["readings"] == 2 and sensor["last_value"] == 2600.0 and sensor["rssi"] == -61.0
+    assert sensor["age"] == 24 and sensor["online"] and sensor["last_ping"] == 1010
+
+    # Listed in a ping but never posted a reading
+    silent = snapshot["sensors"]["efergy_h3_2"]
+    assert silent["last_seen"] is None and not silent["online"]
+    assert registry.online_count() == 1
+
+
+def test_expire_reports_each_sensor_once():
+    registry = LivenessRegistry(timeout=60)
+    registry.record_reading("efergy_h2_1", "AABB", "h2", 1000, 10.0)
+    registry.record_reading("efergy_h2_2", "AABB", "h2", 1050, 10.0)
+
+    assert registry.expire(now=1100) == ["efergy_h2_1"]
+    assert registry.expire(now=1100) == []
+    assert registry.availability() == {"efergy_h2_1": False, "efergy_h2_2": True}
+    # Back online with the next reading
+    assert registry.record_reading("efergy_h2_1", "AABB", "h2", 1101, 10.0)
+
+
+def test_checkpoint_round_trip(tmp_path):
+    database = Database(tmp_path / "liveness.db")
+    database.setup()
+    registry = LivenessRegistry(timeout=60)
+    registry.record_post("AABB", "h3", 1000)
+    registry.record_reading("efergy_h3_1", "AABB", "h3", 1000, 2500.0, rssi=-70.0)
+    monitor = LivenessMonitor(registry, database, MagicMock(started=False))
+
+    assert monitor.checkpoint() == 2
+    # Nothing changed since
+    assert monitor.checkpoint() == 0
+
+    restored = LivenessRegistry(timeout=60)
+    restored.load_from_database(database)
+    assert restored.snapshot(now=1010) == registry.snapshot(now=1010)
+    # Restored sensors are offline once the first expire runs
+    assert restored.expire(now=2000) == ["efergy_h3_1"]
+
+
+def test_failed_checkpoint_is_retried():
+    registry = LivenessRegistry()
+    registry.record_post("AABB", "h2", 1000)
+    database = MagicMock()
+    database.save_liveness.side_effect = RuntimeError("locked")
+    monitor = LivenessMonitor(registry, database, MagicMock(started=False))
+
+    try:
+        monitor.checkpoint()
+    except RuntimeError:
+        pass
+    assert len(registry.checkpoint_rows()) == 1
+
+
+def test_monitor_announces_then_publishes_offline():
+    registry = LivenessRegistry(timeout=60)
+    registry.record_reading("efergy_h2_1", "AABB", "h2", 1000, 10.0)
+    mqtt = MagicMock(started=True)
+    monitor = LivenessMonitor(registry, MagicMock(), mqtt)
+
+    monitor.run_once(now=1010)
+    assert mqtt.publish_availability.call_args_list == [call("efergy_h2_1", True)]
+
+    monitor.run_once(now=1100)
+    assert mqtt.publish_availability.call_args_list[-1] == call("efergy_h2_1", False)
+    assert mqtt.publish_availability.call_count == 2
+
+
+@patch("mqtt_manager.HA_DISCOVERY", True)
+def test_discovery_and_availability_topics():
+    manager = MQTTManager(enabled=False, availability=True)
+    manager.enabled = True
+    manager.publish = MagicMock()
+
+    manager.publish_power_discovery("efergy_h3_1", "1", "efergy/efergy_h3_1/power", "h3")
+    payload = manager.publish.call_args[0][1]
+    assert payload["availability_topic"].endswith("/efergy_h3_1/availability")
+
+    manager.publish_availability("efergy_h3_1", False)
+    assert manager.publish.call_args == call(payload["availability_topic"], "offline", retain=True)
+
+    manager.availability_enabled = False
+    manager.publish_power_discovery("efergy_h3_1", "1", "efergy/efergy_h3_1/power", "h3")
+    assert "availability_topic" not in manager.publish.call_args[0][1]
@@ -0,0 +1,72 @@
+import pytest
+from loadgen import synthesize_traffic, write_capture, load_capture, percentile, run_local
+from payload_parser import parse_sensor_payload
+
+
+def test_synthesized_payloads_parse():
+    requests = synthesize_traffic(hubs=3, sensors=2, interval=6, duration=60, versions=["h1", "h2", "h3"])
+
+    data_posts = [r for r in requests if r["method"] == "POST" and r["headers"]["Content-Type"] != "application/eh-ping"]
+    assert data_posts
+
+    for req in data_posts:
+        if req["path"] == "/recjson":
+            assert req["body"].startswith(b"json=")
+            parsed = parse_sensor_payload(req["body"][5:], "h1")
+            assert len(parsed) == 1
+        else:
+            hub_version = req["path"].strip("/")
+            parsed = parse_sensor_payload(req["body"], hub_version)
+            assert len(parsed) == 2
+            assert all(p["type"] == "CT" for p in parsed)
+
+
+def test_synthesized_schedule_is_ordered_and_has_pings():
+    requests = synthesize_traffic(hubs=2, sensors=1, interval=1, duration=20, ping_every=5)
+
+    offsets = [r["ts"] for r in requests]
+    assert offsets == sorted(offsets)
+    assert any(r["headers"]["Content-Type"] == "application/eh-ping" for r in requests)
+    assert sum(1 for r in requests if r["path"] == "/check_key.html") == 2
+
+
+def test_capture_round_trip(tmp_path):
+    requests = synthesize_traffic(hubs=1, sensors=2, interval=6, duration=30)
+    for req in requests:
+        req["ts"] += 1000.0
+
+    path = tmp_path / "capture.jsonl"
+    assert write_capture(path, requests) == len(requests)
+
+    loaded = load_capture(path)
+    assert [r["body"] for r in loaded] == [r["body"] for r in requests]
+    assert loaded[0]["ts"] == 0.0
+
+
+def test_percentile():
+    assert percentile([], 50) == 0.0
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile(list(range(1, 101)), 99) == 99
+
+
+def test_run_local_end_to_end():
+    requests = synthesize_traffic(hubs=2, sensors=2, interval=6, duration=30, ping_every=2)
+
+    report = run_local(requests, speed=0, concurrency=2, mqtt=True)
+
+    assert report["errors"] == 0
+    assert report["requests"] == len(requests)
+    assert report["db_readings"] == 2 * 2 * 5
+    assert report["mqtt_broker_received"] == report["mqtt_published"]
+    assert report["latency_p99_ms"] >= report["latency_p50_ms"]
+
+
+def test_run_local_counts_only_new_readings(tmp_path):
+    requests = synthesize_traffic(hubs=1, sensors=2, interval=6, duration=30, ping_every=0)
+    db_path = tmp_path / "readings.db"
+
+    run_local(requests, speed=0, concurrency=2, mqtt=False, db_path=db_path)
+    report = run_local(requests, speed=0, concurrency=2, mqtt=False, db_path=db_path)
+
+    assert report["db_readings"] == 2 * 5
+    assert report["db_readings_per_sec"] > 0
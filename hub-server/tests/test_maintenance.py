@@ -0,0 +1,65 @@
+import sqlite3
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+from database import Database, sqlite_profile
+from maintenance import DatabaseMaintenance
+
+
+def test_profile_overrides():
+    with patch("database.SQLITE_CACHE_SIZE", "-1234"), patch("database.SQLITE_TEMP_STORE", "file"):
+        profile = sqlite_profile("ssd")
+    assert profile["cache_size"] == -1234
+    assert profile["temp_store"] == "FILE"
+    assert profile["checkpoint_interval"] == 60
+    assert sqlite_profile("nonexistent") == sqlite_profile("default")
+
+    with patch("database.SQLITE_TEMP_STORE", "disk"):
+        with pytest.raises(ValueError):
+            sqlite_profile("default")
+
+
+def test_profile_pragmas_applied(tmp_path):
+    profile = dict(sqlite_profile("sdcard"), page_size=8192)
+    db = Database(tmp_path / "profile.db", profile=profile)
+    db.setup()
+
+    with db._get_connection() as conn:
+        assert conn.execute("PRAGMA page_size").fetchone()[0] == 8192
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == -8000
+        assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2
+        assert conn.execute("PRAGMA wal_autocheckpoint").fetchone()[0] == 0
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+
+
+def test_passive_checkpoint_drains_wal(tmp_path):
+    db = Database(tmp_path / "profile.db", profile=sqlite_profile("ssd"))
+    db.setup()
+    db.log_many([("efergy_h3_1", float(i), 1000 + i) for i in range(500)])
+
+    busy, frames, checkpointed = db.checkpoint()
+    assert busy == 0
+    assert frames > 0 and checkpointed == frames
+    db.optimize()
+
+    with pytest.raises(ValueError):
+        db.checkpoint("NOW")
+
+
+def test_maintenance_thread_runs_tasks():
+    database = MagicMock()
+    maintenance = DatabaseMaintenance(database, checkpoint_interval=0.05, optimize_interval=0.1)
+    maintenance.start()
+    time.sleep(0.35)
+    maintenance.stop()
+
+    assert database.checkpoint.call_count >= 2
+    assert database.optimize.called
+
+
+def test_maintenance_disabled_by_default_profile():
+    database = MagicMock()
+    database.profile = sqlite_profile("default")
+    maintenance = DatabaseMaintenance(database)
+    maintenance.start()
+    assert maintenance._thread is None
@@ -0,0 +1,65 @@
+import urllib.request
+import pytest
+from metrics import Registry, Counter, Gauge, Histogram, PARSER_LINES, start_metrics_server
+from payload_parser import parse_sensor_payload
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter_render(registry):
+    counter = Counter("test_total", "A test counter.", ["kind"], registry=registry)
+    counter.inc("a")
+    counter.inc("a", amount=2)
+    counter.inc("b")
+
+    text = registry.render()
+    assert "# TYPE test_total counter" in text
+    assert 'test_total{kind="a"} 3' in text
+    assert 'test_total{kind="b"} 1' in text
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = Histogram("test_seconds", "A test histogram.", buckets=(0.1, 1.0), registry=registry)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    text = registry.render()
+    assert 'test_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_seconds_bucket{le="1"} 2' in text
+    assert 'test_seconds_bucket{le="+Inf"} 3' in text
+    assert "test_seconds_count 3" in text
+    assert "test_seconds_sum 5.55" in text
+
+
+def test_gauge_function(registry):
+    gauge = Gauge("test_age", "A test gauge.", ["label"], registry=registry)
+    gauge.set_function(lambda: {("x",): 1.5})
+
+    assert 'test_age{label="x"} 1.5' in registry.render()
+
+
+def test_parser_line_counters():
+    parsed_before = PARSER_LINES.value("h2", "parsed")
+    rejected_before = PARSER_LINES.value("h2", "rejected")
+
+    parse_sensor_payload(b"741459|1|EFCT|P1,2479.98\r\nbroken|line\r\n741460|1|EFCT|P1,1.00", "h2")
+
+    assert PARSER_LINES.value("h2", "parsed") == parsed_before + 2
+    assert PARSER_LINES.value("h2", "rejected") == rejected_before + 1
+
+
+def test_metrics_server():
+    httpd = start_metrics_server(0, host="127.0.0.1")
+    try:
+        port = httpd.server_port
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as resp:
+            body = resp.read().decode("utf-8")
+            assert resp.headers["Content-Type"].startswith("text/plain")
+        assert "# TYPE efergy_http_request_duration_seconds histogram" in body
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
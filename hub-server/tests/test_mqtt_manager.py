@@ -0,0 +1,104 @@
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+from mqtt_manager import MQTTManager, batched_value_template, get_hub_topic
+
+
+def _manager(**kwargs) -> MQTTManager:
+    manager = MQTTManager(enabled=False, **kwargs)
+    manager.enabled = True
+    manager.started = True
+    manager.connected = True
+    manager.client = MagicMock()
+    return manager
+
+
+def _published(manager):
+    return [(c.args[0], c.args[1], c.kwargs.get("retain", False)) for c in manager.client.publish.call_args_list]
+
+
+def test_hub_topic():
+    assert get_hub_topic("41.0a.04.001ec0").endswith("/hub_410a04001ec0/power")
+
+
+def test_per_sensor_topics_flag():
+    assert _manager().per_sensor_topics
+    assert not _manager(batched=True).per_sensor_topics
+    assert _manager(batched=True, batched_per_sensor=True).per_sensor_topics
+
+
+def test_hub_power_noop_unless_batched():
+    manager = _manager()
+    manager.publish_hub_power("41.0a.04.001ec0", "h3", [("efergy_h3_1", "1", 391.86)], 1000)
+    manager.client.publish.assert_not_called()
+
+
+@patch("mqtt_manager.HA_DISCOVERY", True)
+def test_batched_message_and_discovery():
+    manager = _manager(batched=True, availability=False)
+    manager.discovery_enabled = True
+    readings = [("efergy_h3_1", "1", 391.86), ("efergy_h3_2", "2", 120.0)]
+    topic = get_hub_topic("41.0a.04.001ec0")
+
+    manager.publish_hub_power("41.0a.04.001ec0", "h3", readings, 1000)
+
+    published = _published(manager)
+    assert published[0][0] == topic
+    assert json.loads(published[0][1]) == {
+        "hub": "41.0a.04.001ec0", "hub_version": "h3", "timestamp": 1000,
+        "sensors": {"efergy_h3_1": 391.86, "efergy_h3_2": 120.0},
+    }
+    configs = {t: json.loads(p) for t, p, retain in published[1:] if retain}
+    config = configs["homeassistant/sensor/efergy_h3_2/config"]
+    assert config["state_topic"] == topic
+    assert config["value_template"] == batched_value_template("efergy_h3_2", "{{ (value_json.value | float) / 10 }}")
+    assert config["json_attributes_topic"] == topic
+    assert "value_json.timestamp" in config["json_attributes_template"]
+    assert len(configs) == 2
+
+    # Discovery only once per sensor and hub topic
+    manager.client.publish.reset_mock()
+    manager.publish_hub_power("41.0a.04.001ec0", "h3", readings, 1006)
+    assert len(_published(manager)) == 1
+
+    # Sensor moved to another hub
+    manager.client.publish.reset_mock()
+    manager.publish_hub_power("41.0a.04.001ec1", "h3", readings[:1], 1012)
+    assert [t for t, _, _ in _published(manager)] == [
+        get_hub_topic("41.0a.04.001ec1"), "homeassistant/sensor/efergy_h3_1/config"
+    ]
+
+
+@patch("mqtt_manager.HA_DISCOVERY", True)
+def test_batched_startup_discovery_needs_hub():
+    manager = _manager(batched=True, availability=False)
+    manager.publish_startup_discovery(
+        ["efergy_h2_1", "efergy_h2_2"], {"efergy_h2_1": "41.0a.04.001ec0"}
+    )
+    configs = {t: json.loads(p) for t, p, _ in _published(manager)}
+    assert configs["homeassistant/sensor/efergy_h2_1/config"]["state_topic"] == get_hub_topic("41.0a.04.001ec0")
+    assert "homeassistant/sensor/efergy_h2_2/config" not in configs
+    # Energy discovery is unchanged
+    assert "homeassistant/sensor/energy_consumption/config" in configs
+
+
+@patch("mqtt_manager.HA_DISCOVERY", True)
+def test_batched_publish_power_skips_per_sensor_discovery():
+    manager = _manager(batched=True, batched_per_sensor=True, availability=False)
+    manager.discovery_enabled = True
+    manager.publish_power("efergy_h3_1", "1", "h3", 391.86)
+    assert [t for t, _, _ in _published(manager)] == ["home/efergy/efergy_h3_1/power"]
+
+
+@pytest.mark.parametrize("template", [
+    "{{ (value_json.value | float) / 10 }}",
+    # Custom templates don't have to spell value_json.value
+    "{{ value_json['value'] | float / 10 }}",
+])
+def test_batched_value_template_renders(template):
+    jinja2 = pytest.importorskip("jinja2")
+    rendered = jinja2.Environment().from_string(batched_value_template("efergy_h3_1", template))
+
+    assert float(rendered.render(value_json={"sensors": {"efergy_h3_1": 3918.6}}, this={"state": "1"})) == 391.86
+    # A post without the sensor keeps its state
+    assert rendered.render(value_json={"sensors": {"efergy_h3_2": 100.0}}, this={"state": "12.5"}) == "12.5"
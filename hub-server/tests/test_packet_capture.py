@@ -0,0 +1,54 @@
+import json
+import logging
+from packet_capture import UnknownPacketCapture
+from loadgen import load_capture
+
+
+def test_rate_limit_per_client():
+    capture = UnknownPacketCapture(rate_limit=2, rate_window=60)
+
+    results = [capture.record("10.0.0.1", "GET", "/x", {}) for _ in range(4)]
+    assert results == [True, True, False, False]
+
+    # Another client has its own budget
+    assert capture.record("10.0.0.2", "GET", "/x", {}) is True
+    assert capture.total == 5
+    assert capture.suppressed == 2
+
+
+def test_ring_buffer_and_body_cap():
+    capture = UnknownPacketCapture(buffer_size=3, max_bytes=8, rate_limit=100)
+
+    for i in range(5):
+        capture.record("10.0.0.1", "POST", f"/p{i}", {}, b"0123456789abcdef")
+
+    recent = capture.recent()
+    assert [r["path"] for r in recent] == ["/p2", "/p3", "/p4"]
+    assert all(r["body"] == b"01234567" for r in recent)
+    assert recent[0]["content_length"] == 8
+
+
+def test_single_line_warning(caplog):
+    caplog.set_level(logging.WARNING)
+    capture = UnknownPacketCapture(rate_limit=1)
+
+    capture.record("10.0.0.1", "POST", "/unknown", {"Content-Type": "text/plain"}, b"\x00" * 4096, 4096)
+    capture.record("10.0.0.1", "POST", "/unknown", {"Content-Type": "text/plain"}, b"\x00" * 4096, 4096)
+
+    messages = [rec.getMessage() for rec in caplog.records]
+    assert len(messages) == 1
+    assert "4096 bytes" in messages[0]
+
+
+def test_capture_file_is_replayable(tmp_path):
+    path = tmp_path / "unknown.jsonl"
+    capture = UnknownPacketCapture(rate_limit=100, capture_file=str(path))
+    capture.record("10.0.0.1", "POST", "/h9", {"Content-Type": "text/plain"}, b"\x01\x02payload")
+    capture.close()
+
+    record = json.loads(path.read_text().strip())
+    assert record["client"] == "10.0.0.1"
+
+    replay = load_capture(path)
+    assert replay[0]["path"] == "/h9"
+    assert replay[0]["body"] == b"\x01\x02payload"
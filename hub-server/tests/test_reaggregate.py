@@ -0,0 +1,124 @@
+import json
+import time
+import pytest
+from unittest.mock import patch
+from database import Database, raw_to_kw, raw_to_watts
+from reaggregate import aggregate_slice, main, reaggregate, time_slices
+
+NOW = int(time.time())
+START = NOW - (NOW % 3600) - 6 * 3600
+END = START + 5 * 3600
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(tmp_path / "reaggregate.db")
+    database.setup()
+    readings = []
+    for ts in range(START, END, 30):
+        readings.append(("efergy_h3_1", 10000.0 + ts % 7, ts))
+        readings.append(("efergy_h2_2", 2000.0 + ts % 11, ts + 7))
+    database.log_many(readings)
+    database.aggregate_hours()
+    return database
+
+
+def _hours(database):
+    with database._get_connection() as conn:
+        return dict(conn.execute("SELECT hour_start, kwh FROM energy_hourly").fetchall())
+
+
+def test_time_slices():
+    assert time_slices(0, 5 * 3600, 2) == [(0, 7200), (7200, 14400), (14400, 18000)]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_reaggregate_matches_aggregator(db, workers):
+    before = _hours(db)
+    summary = reaggregate(db, START, END, calibration={}, workers=workers, slice_hours=2,
+                          method="left", max_gap=0, split_hours=False)
+
+    assert summary["hours"] == 5
+    assert summary["written"] == 5
+    assert summary["readings"] == 2 * (END - START) // 30
+    # Bit-identical to the server's own aggregation
+    assert _hours(db) == before
+    assert summary["new_kwh"] == pytest.approx(summary["old_kwh"])
+
+
+def test_calibration_and_label_filter(db):
+    uncalibrated = aggregate_slice(str(db.db_path), START, END, ["efergy_h3_1"], {})[2]
+    scaled = aggregate_slice(str(db.db_path), START, END, ["efergy_h3_1"], {"efergy_h3_1": {"scale": 2.0}})[2]
+    assert scaled.keys() == uncalibrated.keys()
+    for hour, kwh in uncalibrated.items():
+        assert scaled[hour] == pytest.approx(2 * kwh)
+
+    before = _hours(db)
+    summary = reaggregate(db, START, END, labels=["efergy_h3_1"], calibration={"efergy_h3_1": {"scale": 2.0}},
+                          dry_run=True)
+    assert summary["new_kwh"] == pytest.approx(sum(scaled.values()))
+    assert _hours(db) == before
+
+
+def test_label_filter_needs_dry_run(db):
+    before = _hours(db)
+    with pytest.raises(ValueError):
+        reaggregate(db, START, END, labels=["efergy_h3_1"])
+    with pytest.raises(SystemExit):
+        main(["--db", str(db.db_path), "--labels", "efergy_h3_1"])
+    assert _hours(db) == before
+
+
+def test_configured_calibration_is_the_default(db):
+    calibration = {"*": {"scale": 2.0}}
+    with patch("database.SENSOR_CALIBRATION", calibration), patch("reaggregate.SENSOR_CALIBRATION", calibration):
+        summary = reaggregate(db, START, END, dry_run=True)
+    assert summary["new_kwh"] == pytest.approx(2 * summary["old_kwh"])
+
+
+def test_split_hours_skips_hours_without_readings(tmp_path):
+    database = Database(tmp_path / "gap.db")
+    database.setup()
+    # Nothing in the second hour
+    database.log_many([("efergy_h3_1", 1000.0, ts) for ts in range(START, START + 3600, 600)]
+                      + [("efergy_h3_1", 3000.0, ts) for ts in range(START + 7200, END, 600)])
+    with patch("database.ENERGY_INTEGRATION_SPLIT_HOURS", True):
+        database.aggregate_hours()
+    before = _hours(database)
+    assert START + 3600 not in before
+
+    reaggregate(database, START, END, calibration={}, method="left", max_gap=0, split_hours=True)
+    assert _hours(database) == before
+
+
+def test_dry_run_does_not_write(db):
+    before = _hours(db)
+    summary = reaggregate(db, START, END, calibration={"*": {"scale": 0.5}}, dry_run=True)
+    assert summary["written"] == 0
+    assert summary["new_kwh"] == pytest.approx(summary["old_kwh"] / 2)
+    assert _hours(db) == before
+
+
+def test_main(db, tmp_path, capsys):
+    calibration = tmp_path / "calibration.json"
+    calibration.write_text(json.dumps({"efergy_h2_2": {"power_factor": 1.2}}))
+    before = _hours(db)
+
+    summary = main(["--db", str(db.db_path), "--start", str(START), "--end", str(END), "--workers", "1",
+                    "--calibration", str(calibration)])
+
+    assert summary["written"] == 5
+    assert "new_kwh" in capsys.readouterr().out
+    after = _hours(db)
+    assert all(after[hour] > before[hour] for hour in before)
+
+
+def test_raw_conversion_calibration():
+    assert raw_to_kw("efergy_h2_2", 1000.0, {}) == raw_to_kw("efergy_h2_2", 1000.0)
+    override = {"efergy_h2_2": {"power_factor": 1.0, "mains_voltage": 240}, "*": {"scale": 3.0}}
+    assert raw_to_watts("efergy_h2_2", 1000.0, override) == pytest.approx(240.0)
+    assert raw_to_kw("efergy_h2_2", 1000.0, override) == pytest.approx(0.24)
+    assert raw_to_watts("efergy_h3_1", 1000.0, override) == pytest.approx(300.0)
+
+    with patch("database.SENSOR_CALIBRATION", {"efergy_h3_1": {"scale": 2.0}}):
+        assert raw_to_watts("efergy_h3_1", 1000.0) == pytest.approx(200.0)
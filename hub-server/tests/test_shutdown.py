@@ -0,0 +1,122 @@
+import http.client
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+from database import Database
+from mqtt_manager import MQTTManager
+from shutdown import ShutdownSequence, stop_http_server
+
+
+def test_sequence_runs_steps_in_order_past_failures(caplog):
+    calls = []
+
+    def fail():
+        calls.append("fail")
+        raise RuntimeError("boom")
+
+    sequence = ShutdownSequence()
+    sequence.add("first", lambda: calls.append("first"))
+    sequence.add("fail", fail)
+    sequence.add("last", lambda: calls.append("last"))
+
+    with caplog.at_level("INFO"):
+        total = sequence.run()
+
+    assert calls == ["first", "fail", "last"]
+    assert total >= 0
+    assert "Shutdown step 'fail' failed" in caplog.text
+    assert "Shutdown: last (" in caplog.text
+    assert "Shutdown complete in" in caplog.text
+
+
+class _SlowHandler(BaseHTTPRequestHandler):
+    started = threading.Event()
+
+    def do_GET(self):
+        self.started.set()
+        time.sleep(0.3)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_stop_http_server_drains_in_flight_request():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _SlowHandler)
+    httpd.block_on_close = True
+    serve_thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    serve_thread.start()
+
+    result = {}
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", httpd.server_port, timeout=5)
+        conn.request("GET", "/")
+        response = conn.getresponse()
+        result["status"], result["body"] = response.status, response.read()
+
+    client_thread = threading.Thread(target=client)
+    client_thread.start()
+    assert _SlowHandler.started.wait(5)
+
+    assert stop_http_server(httpd, serve_thread, timeout=5)
+    client_thread.join(5)
+    assert result == {"status": 200, "body": b"ok"}
+
+
+def test_stop_http_server_gives_up_after_timeout():
+    httpd = MagicMock()
+    serve_thread = threading.Thread(target=time.sleep, args=(1,), daemon=True)
+    serve_thread.start()
+
+    assert not stop_http_server(httpd, serve_thread, timeout=0.05)
+    httpd.server_close.assert_called_once()
+
+
+def test_database_close_truncates_wal(tmp_path):
+    db = Database(tmp_path / "close.db")
+    db.setup()
+    db.log_many([("efergy_h3_1", 1000.0, ts) for ts in range(100, 200)])
+    wal = tmp_path / "close.db-wal"
+    assert wal.exists() and os.path.getsize(wal) > 0
+
+    db.close()
+
+    assert not wal.exists() or os.path.getsize(wal) == 0
+    reopened = Database(tmp_path / "close.db")
+    reopened.setup()
+    assert len(reopened.get_recent_readings(0)["efergy_h3_1"]) == 100
+
+
+def test_mqtt_stop_when_disabled():
+    manager = MQTTManager(enabled=False)
+    manager.stop()
+    assert not manager.connected
+
+
+def test_mqtt_stop_disconnects():
+    manager = MQTTManager(enabled=False)
+    manager.enabled = True
+    manager.connected = True
+    manager.client = MagicMock()
+    manager.queue_depth = MagicMock(return_value=0)
+
+    manager.stop(timeout=0.1)
+
+    manager.client.disconnect.assert_called_once()
+    manager.client.loop_stop.assert_called_once()
+    assert not manager.enabled and not manager.connected
+
+
+def test_mqtt_publish_skipped_until_started():
+    manager = MQTTManager(enabled=False)
+    manager.enabled = True
+    manager.client = MagicMock()
+
+    manager.publish("efergy/test", {"value": 1})
+    manager.client.publish.assert_not_called()
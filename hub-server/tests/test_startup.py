@@ -0,0 +1,51 @@
+import threading
+import pytest
+from startup import StartupStatus, run_in_background
+
+
+def test_status_ready_once_all_phases_finish():
+    status = StartupStatus(["schema", "discovery"])
+    assert not status.ready
+
+    status.run("schema", lambda: None)
+    snapshot = status.snapshot()
+    assert not snapshot["ready"]
+    assert snapshot["phases"]["schema"]["state"] == "done"
+    assert snapshot["phases"]["discovery"] == {"state": "pending"}
+
+    status.start("discovery")
+    assert status.snapshot()["phases"]["discovery"] == {"state": "running"}
+    status.finish("discovery")
+    assert status.ready
+
+
+def test_failed_phase_is_recorded_and_raised():
+    status = StartupStatus(["schema"])
+
+    def fail():
+        raise RuntimeError("disk I/O error")
+
+    with pytest.raises(RuntimeError):
+        status.run("schema", fail)
+
+    phase = status.snapshot()["phases"]["schema"]
+    assert phase["state"] == "failed"
+    assert phase["error"] == "disk I/O error"
+    # A failed phase doesn't hold readiness back forever
+    assert status.ready
+
+
+def test_run_in_background_continues_past_failures():
+    status = StartupStatus(["mqtt", "discovery"])
+    done = threading.Event()
+
+    def fail():
+        raise OSError("connection refused")
+
+    thread = run_in_background(status, [("mqtt", fail), ("discovery", lambda: None)], then=done.set)
+    thread.join(5)
+
+    assert done.is_set()
+    phases = status.snapshot()["phases"]
+    assert phases["mqtt"]["state"] == "failed"
+    assert phases["discovery"]["state"] == "done"
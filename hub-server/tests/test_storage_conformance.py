@@ -0,0 +1,183 @@
+"""Behaviour every StorageBackend must share, run against each backend."""
+import time
+import pytest
+from unittest.mock import patch
+from database import months_ago, raw_to_kw
+from energy_integration import integrate_rows
+from storage import HAS_DUCKDB, StorageBackend, open_storage
+
+BACKENDS = ["sqlite", pytest.param("duckdb", marks=pytest.mark.skipif(not HAS_DUCKDB, reason="DuckDB not installed"))]
+
+START = int(months_ago(2).timestamp())
+READINGS = (
+    [("efergy_h3_1", 3000.0 + i % 700, START + i) for i in range(0, 3 * 3600, 90)]
+    + [("efergy_h2_2", 2479.98 if i % 600 else 120.5, START + i) for i in range(0, 3 * 3600, 120)]
+    # Hour 3 has no readings; two readings share a timestamp, the later one is the latest
+    + [("efergy_h3_1", 1.5, START + 5 * 3600), ("efergy_h3_1", 2.5, START + 5 * 3600)]
+    + [("efergy_h1_3", 10.0 * i, START + 4 * 3600 + 60 * i) for i in range(30)]
+)
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def storage(backend, tmp_path):
+    store = open_storage(backend, tmp_path)
+    store.setup()
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def loaded(storage):
+    storage.log_many(READINGS[:100])
+    for label, value, timestamp in READINGS[100:110]:
+        storage.log_data(label, value, timestamp)
+    storage.log_many(READINGS[110:])
+    return storage
+
+
+def _ordered():
+    """READINGS as (timestamp, label, value) in timestamp and then insertion order."""
+    return sorted(((ts, label, value) for label, value, ts in READINGS), key=lambda row: row[0])
+
+
+def _expected_hours(split_hours: bool):
+    series = [(ts, raw_to_kw(label, value)) for ts, label, value in _ordered()]
+    hours = {}
+    for hour_start in sorted({ts - ts % 3600 for ts, _ in series}):
+        indices = [i for i, (ts, _) in enumerate(series) if hour_start <= ts < hour_start + 3600]
+        if split_hours:
+            rows = series[max(indices[0] - 1, 0):indices[-1] + 2]
+        else:
+            rows = series[indices[0]:indices[-1] + 1]
+        hours[hour_start] = integrate_rows(rows, split_hours=split_hours)[hour_start]
+    return hours
+
+
+def _aggregate_all(storage):
+    # Empty hours are revisited on every pass, so catch up in one
+    storage.aggregate_hours(limit_hours=100_000)
+
+
+def test_implements_protocol(storage):
+    assert isinstance(storage, StorageBackend)
+
+
+def test_unknown_backend(tmp_path):
+    with pytest.raises(ValueError):
+        open_storage("parquet", tmp_path)
+
+
+def test_readings_round_trip(loaded):
+    assert loaded.get_readings(START, START + 6 * 3600) == _ordered()
+    assert loaded.get_readings(START + 3600, START + 7200, ["efergy_h2_2"]) == [
+        row for row in _ordered() if row[1] == "efergy_h2_2" and START + 3600 <= row[0] < START + 7200
+    ]
+    assert loaded.get_all_labels() == ["efergy_h1_3", "efergy_h2_2", "efergy_h3_1"]
+    assert loaded.get_hour_series(START + 4 * 3600) == [
+        (ts, raw_to_kw(label, value)) for ts, label, value in _ordered() if START + 4 * 3600 <= ts < START + 5 * 3600
+    ]
+
+
+def test_recent_readings(loaded):
+    recent = loaded.get_recent_readings(START + 4 * 3600)
+    assert recent == {
+        "efergy_h1_3": [(START + 4 * 3600 + 60 * i, 10.0 * i) for i in range(30)],
+        "efergy_h3_1": [(START + 5 * 3600, 1.5), (START + 5 * 3600, 2.5)],
+    }
+
+
+def test_latest_readings_survive_reopen(loaded, backend, tmp_path):
+    expected = {
+        "efergy_h1_3": {"timestamp": START + 4 * 3600 + 60 * 29, "value": 290.0},
+        "efergy_h2_2": {"timestamp": START + 3 * 3600 - 120, "value": 2479.98},
+        "efergy_h3_1": {"timestamp": START + 5 * 3600, "value": 2.5},
+    }
+    latest = loaded.get_latest_readings()
+    assert {label: {k: v for k, v in row.items() if k != "watts"} for label, row in latest.items()} == expected
+
+    loaded.close()
+    reopened = open_storage(backend, tmp_path)
+    reopened.setup()
+    try:
+        assert reopened.get_latest_readings() == latest
+    finally:
+        reopened.close()
+
+
+def test_summarize_readings(loaded):
+    summary = loaded.summarize_readings(START, START + 6 * 3600, bucket=3600, labels=["efergy_h2_2", "efergy_h3_1"])
+    expected = {}
+    for ts, label, value in _ordered():
+        if label != "efergy_h1_3":
+            expected.setdefault((ts - ts % 3600, label), []).append(value)
+    assert [row[:2] for row in summary] == sorted(expected)
+    for bucket, label, count, low, high, mean in summary:
+        values = expected[(bucket, label)]
+        assert (count, low, high) == (len(values), min(values), max(values))
+        assert mean == pytest.approx(sum(values) / len(values))
+
+
+@pytest.mark.parametrize("split_hours", [False, True])
+def test_aggregate_hours(loaded, split_hours):
+    with patch("database.ENERGY_INTEGRATION_SPLIT_HOURS", split_hours), \
+            patch("storage.ENERGY_INTEGRATION_SPLIT_HOURS", split_hours):
+        _aggregate_all(loaded)
+
+    expected = _expected_hours(split_hours)
+    assert dict(loaded.get_hourly_energy(START, START + 6 * 3600)) == expected
+    assert loaded.get_last_aggregated_hour() == max(expected)
+    assert loaded.get_total_energy() == pytest.approx(sum(expected.values()))
+    # Aggregated hours are never recomputed
+    loaded.log_data("efergy_h3_1", 9999.0, START + 60)
+    _aggregate_all(loaded)
+    assert dict(loaded.get_hourly_energy(START, START + 6 * 3600)) == expected
+
+
+def test_aggregation_stops_at_current_hour(storage):
+    now = int(time.time())
+    storage.log_many([("efergy_h3_1", 100.0, now - 7200), ("efergy_h3_1", 100.0, now)])
+    _aggregate_all(storage)
+    assert storage.get_last_aggregated_hour() == (now - 7200) - (now - 7200) % 3600
+
+
+def test_replace_hours(storage):
+    storage.replace_hours({START: 1.0, START + 3600: 2.0, START + 7200: 3.0}, START, START + 3 * 3600)
+    assert storage.replace_hours({START + 3600: 5.0, START + 9 * 3600: 9.0}, START + 3600, START + 3 * 3600) == 1
+    assert storage.get_hourly_energy(START, START + 10 * 3600) == [(START, 1.0), (START + 3600, 5.0)]
+
+
+def test_truncate_old_data(storage):
+    old = int(months_ago(4).timestamp())
+    storage.log_many([("efergy_h3_1", 1.0, old + i) for i in range(5)] + [("efergy_h3_1", 1.0, START)])
+    storage.replace_hours({old: 1.0, START: 1.0}, old, START + 3600)
+    assert storage.truncate_old_data(3) == 6
+    assert storage.get_readings(0, START + 1) == [(START, "efergy_h3_1", 1.0)]
+    assert storage.get_hourly_energy(0, START + 3600) == [(START, 1.0)]
+    assert storage.truncate_old_data(0) == 0
+
+
+def test_journal_checkpoint(storage):
+    assert storage.get_journal_checkpoint() is None
+    assert storage.commit_journal_batch([("efergy_h3_1", 1.0, START)], "gen-1", 42) == 1
+    assert storage.get_journal_checkpoint() == ("gen-1", 42)
+    storage.commit_journal_batch([], "gen-2", 0)
+    assert storage.get_journal_checkpoint() == ("gen-2", 0)
+    assert storage.get_readings(START, START + 1) == [(START, "efergy_h3_1", 1.0)]
+
+
+def test_liveness_and_ingest_keys(storage):
+    rows = [("sensor", "efergy_h3_1", "hub1", "h3", START, 391.5, 10, -66.0, None),
+            ("hub", "hub1", "hub1", "h3", START, None, 10, None, START)]
+    assert storage.save_liveness(rows) == 2
+    storage.save_liveness([rows[0][:6] + (11,) + rows[0][7:]])
+    assert sorted(storage.get_liveness()) == sorted([rows[0][:6] + (11,) + rows[0][7:], rows[1]])
+
+    storage.save_ingest_keys([("hub1", "efergy_h3_1", "5", START), ("hub1", "efergy_h3_1", "6", START + 10)], 0)
+    storage.save_ingest_keys([("hub1", "efergy_h3_1", "7", START + 20)], prune_before=START + 5)
+    assert storage.get_ingest_keys(START) == [("hub1", "efergy_h3_1", "6", START + 10),
+                                              ("hub1", "efergy_h3_1", "7", START + 20)]
@@ -0,0 +1,162 @@
+import http.client
+import json
+import pytest
+from hot_window import HotWindow
+from stream import STREAM_DROPPED, ReadingStream, start_stream_server
+
+
+def _read_events(response, count):
+    events = []
+    event = {}
+    while len(events) < count:
+        line = response.fp.readline().decode().rstrip("\n")
+        if not line:
+            if event:
+                events.append(event)
+                event = {}
+            continue
+        if line.startswith(":"):
+            continue
+        key, _, value = line.partition(": ")
+        event[key] = value
+    return events
+
+
+@pytest.fixture
+def stream():
+    hot_window = HotWindow(window_sec=3600)
+    return ReadingStream(hot_window, buffer=4, max_clients=2)
+
+
+@pytest.fixture
+def stream_server(stream):
+    httpd = start_stream_server(stream, 0, host="127.0.0.1")
+    yield httpd.server_port
+    stream.close()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_publish_filters_labels(stream):
+    everything = stream.subscribe()
+    filtered = stream.subscribe(["efergy_h3_2"])
+    stream.publish("efergy_h3_1", 1000, 10.0)
+    stream.publish("efergy_h3_2", 1000, 20.0)
+
+    assert everything.queue.qsize() == 2
+    first = everything.queue.get_nowait()
+    assert filtered.queue.get_nowait() == ("efergy_h3_2", 1000, 20.0, first[3] + 1)
+    assert filtered.queue.empty()
+    # Max clients
+    assert stream.subscribe() is None
+
+
+def test_slow_consumer_is_dropped(stream):
+    before = STREAM_DROPPED.value()
+    slow = stream.subscribe()
+    fast = stream.subscribe(["efergy_h3_2"])
+    for ts in range(10):
+        stream.publish("efergy_h3_1", ts, 1.0)
+
+    assert slow.dropped and slow.queue.qsize() == 4
+    assert stream.client_count() == 1
+    assert STREAM_DROPPED.value() == before + 1
+    assert not fast.dropped
+
+
+def test_resume_after_sequence_number(stream):
+    for value in (1.0, 2.0, 3.0):
+        stream.publish("efergy_h3_1", 1000, value)
+    stream.publish("efergy_h3_2", 1000, 4.0)
+    seqs = [event[3] for event in stream._recent]
+
+    assert [event[2] for event in stream.resume(seqs[0])] == [2.0, 3.0, 4.0]
+    assert [event[2] for event in stream.resume(seqs[0], labels=["efergy_h3_1"])] == [2.0, 3.0]
+    assert [event[2] for event in stream.resume(seqs[0] - 1)] == [1.0, 2.0, 3.0, 4.0]
+    assert stream.resume(seqs[-1]) == []
+    # Already out of the buffer, or from another run
+    assert stream.resume(seqs[0] - 2) is None
+    assert stream.resume(seqs[-1] + 1) is None
+
+
+def test_replay_merges_labels(stream):
+    for ts in (100, 106, 112):
+        stream.hot_window.add("efergy_h3_1", ts, 1.0)
+    stream.hot_window.add("efergy_h3_2", 103, 2.0)
+
+    assert stream.replay(103, now=120) == [
+        ("efergy_h3_2", 103, 2.0), ("efergy_h3_1", 106, 1.0), ("efergy_h3_1", 112, 1.0)
+    ]
+    assert stream.replay(103, labels=["efergy_h3_2"], now=120) == [("efergy_h3_2", 103, 2.0)]
+
+
+def test_sse_replay_then_live(stream, stream_server):
+    import time
+    now = int(time.time())
+    stream.hot_window.add("efergy_h3_1", now - 30, 3900.0)
+    stream.hot_window.add("efergy_h3_1", now - 10, 3910.0)
+
+    conn = http.client.HTTPConnection("127.0.0.1", stream_server, timeout=5)
+    conn.request("GET", f"/stream?label=efergy_h3_1&since={now - 20}")
+    response = conn.getresponse()
+    assert response.status == 200
+    assert response.getheader("Content-Type") == "text/event-stream"
+
+    replayed = _read_events(response, 1)[0]
+    assert replayed["id"] == str(now - 10) and replayed["event"] == "reading"
+
+    # Wait until subscribed, then publish live
+    while stream.client_count() == 0:
+        time.sleep(0.01)
+    stream.publish("efergy_h3_2", now, 1.0)
+    stream.publish("efergy_h3_1", now, 3920.0)
+    live = json.loads(_read_events(response, 1)[0]["data"])
+    assert live == {"label": "efergy_h3_1", "timestamp": now, "value": 3920.0, "watts": 392.0}
+    conn.close()
+
+
+def test_sse_last_event_id_and_errors(stream, stream_server):
+    import time
+    now = int(time.time())
+    for ts in (now - 20, now - 10):
+        stream.hot_window.add("efergy_h3_1", ts, 1.0)
+
+    conn = http.client.HTTPConnection("127.0.0.1", stream_server, timeout=5)
+    conn.request("GET", "/stream", headers={"Last-Event-ID": str(now - 20)})
+    response = conn.getresponse()
+    # A bare timestamp replays its own second again rather than skip readings
+    assert [event["id"] for event in _read_events(response, 2)] == [str(now - 20), str(now - 10)]
+
+    for path, status in (("/nope", 404), ("/stream?since=abc", 400)):
+        other = http.client.HTTPConnection("127.0.0.1", stream_server, timeout=5)
+        other.request("GET", path)
+        assert other.getresponse().status == status
+        other.close()
+
+    # Closing the stream ends the response
+    stream.close()
+    assert response.read() == b""
+    conn.close()
+
+
+def test_sse_resumes_within_the_same_second(stream, stream_server):
+    import time
+    now = int(time.time())
+    for index in range(4):
+        stream.publish(f"efergy_h3_{index}", now, float(index))
+        stream.hot_window.add(f"efergy_h3_{index}", now, float(index))
+    second = "%d-%d" % (now, stream._recent[1][3])
+
+    conn = http.client.HTTPConnection("127.0.0.1", stream_server, timeout=5)
+    conn.request("GET", "/stream", headers={"Last-Event-ID": second})
+    response = conn.getresponse()
+    resumed = _read_events(response, 2)
+    assert [json.loads(event["data"])["label"] for event in resumed] == ["efergy_h3_2", "efergy_h3_3"]
+
+    while stream.client_count() == 0:
+        time.sleep(0.01)
+    stream.publish("efergy_h3_0", now, 5.0)
+    live = _read_events(response, 1)[0]
+    assert live["id"] == "%d-%d" % (now, stream._recent[-1][3])
+    assert json.loads(live["data"])["value"] == 5.0
+    conn.close()